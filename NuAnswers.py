@@ -1,78 +1,238 @@
 import random
+import re
+import struct
+from enum import IntEnum
+from functools import lru_cache
+from types import MappingProxyType
+
+@lru_cache(maxsize=None)
+def _trie_pattern(phrases):
+    """Builds a regex alternation factored by common prefixes
+
+    A flat alternation retries every phrase at each position; the trie shape
+    lets the engine rule out most positions after a character or two.
+    """
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        optional = "" in node
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        group = "(?:" + "|".join(branches) + ")"
+        return group + "?" if optional else group
+
+    return build(trie)
+
+def _phrases_can_overlap(phrases):
+    """True if some phrase can start inside another on a word boundary
+
+    That is, a trailing run of words of one phrase is a leading run of words
+    of another, as in "here's the answer" and "the answer is".
+    """
+    for a in phrases:
+        for b in phrases:
+            words_a, words_b = a.split(" "), b.split(" ")
+            for k in range(1, min(len(words_a), len(words_b) + 1)):
+                if words_a[-k:] == words_b[:k]:
+                    return True
+    return False
+
+class PhraseMatcher:
+    """Finds every occurrence of a set of lowercase phrases in a single pass"""
+
+    def __init__(self, phrases):
+        self.phrases = [phrase.lower() for phrase in phrases]
+        self.max_length = max(len(phrase) for phrase in self.phrases)
+        pattern = _trie_pattern(tuple(self.phrases))
+        if _phrases_can_overlap(self.phrases):
+            # A zero-width lookahead also reports matches that overlap each
+            # other, at about half the speed of a plain scan
+            pattern = "(?=(" + pattern + "))"
+        else:
+            pattern = "(" + pattern + ")"
+        self._regex = re.compile(pattern)
+
+    def finditer(self, text):
+        """Yields (offset, phrase) for each match; text must already be lowercased"""
+        for match in self._regex.finditer(text):
+            yield match.start(), match.group(1)
+
+    def find_all(self, text):
+        """Returns every (offset, phrase) match in text"""
+        return list(self.finditer(text.lower()))
+
+    def scanner(self):
+        return PhraseScanner(self)
+
+class PhraseScanner:
+    """Incrementally matches phrases across the chunks of a streamed response"""
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.consumed = 0
+        self._tail = ""
+
+    def feed(self, chunk):
+        """Returns (offset, phrase) matches completed by this chunk
+
+        Offsets are relative to the start of the stream. The last
+        max_length - 1 characters are carried over so a phrase split between
+        chunks is still found, and matches already reported are skipped.
+        """
+        text = self._tail + chunk.lower()
+        base = self.consumed - len(self._tail)
+        matches = [(base + offset, phrase) for offset, phrase in self.matcher.finditer(text)
+                   if offset + len(phrase) > len(self._tail)]
+        self.consumed += len(chunk)
+        self._tail = text[-(self.matcher.max_length - 1):] if self.matcher.max_length > 1 else ""
+        return matches
+
+class KeywordIndex:
+    """Scores text against several keyword groups at once
+
+    Keywords keep the tutor's substring semantics: each distinct keyword found
+    anywhere in the text counts once. The text is lowercased a single time and
+    each distinct keyword is checked once for all groups. Plain substring
+    checks beat a combined regex here, because matches are dense in student
+    answers (benchmarks/keyword_scoring.py).
+    """
+
+    def __init__(self, groups):
+        self.names = list(groups)
+        self.keywords = sorted({keyword.lower() for words in groups.values() for keyword in words})
+        self.group_keywords = [tuple(sorted({keyword.lower() for keyword in groups[name]})) for name in self.names]
+        self._membership = None
+
+    def score(self, text):
+        """Returns {group name: number of distinct group keywords in text}"""
+        text = text.lower()
+        return {name: sum([keyword in text for keyword in keywords])
+                for name, keywords in zip(self.names, self.group_keywords)}
+
+    def best(self, text, groups=None):
+        """Name of the highest-scoring group (earliest wins ties), or None if nothing matched"""
+        scores = self.score(text)
+        candidates = groups or self.names
+        best = max(candidates, key=lambda name: scores[name])
+        return best if scores[best] > 0 else None
+
+    def score_many(self, texts):
+        """Returns a (len(texts), len(names)) NumPy matrix of keyword counts
+
+        Builds a texts x keywords presence matrix and multiplies it by the
+        keywords x groups membership matrix.
+        """
+        import numpy as np
+
+        if self._membership is None:
+            membership = np.zeros((len(self.keywords), len(self.names)), dtype=np.int32)
+            for group_index, keywords in enumerate(self.group_keywords):
+                for keyword in keywords:
+                    membership[self.keywords.index(keyword), group_index] = 1
+            self._membership = membership
+        keywords = self.keywords
+        presence = np.fromiter((keyword in text for text in map(str.lower, texts) for keyword in keywords),
+                               dtype=np.bool_, count=len(texts) * len(keywords))
+        return presence.reshape(len(texts), len(keywords)).astype(np.int32) @ self._membership
+
+# Tutor content is immutable and shared at module level: every tutor and
+# session refers to these objects rather than holding its own copies
+
+FORBIDDEN_PATTERNS = (
+    "the answer is",
+    "you should write",
+    "the correct answer is",
+    "here's the answer",
+    "the solution is",
+    "you need to write",
+    "you must write",
+    "the final answer is",
+    "the result is",
+    "you should get",
+    "the answer will be",
+    "the answer would be",
+    "the answer should be",
+    "the answer must be",
+    "the answer needs to be",
+    "here's how to solve it",
+    "the way to solve this is",
+    "you need to do this",
+    "the formula is",
+    "the calculation is",
+    "the method is",
+    "the approach is",
+    "you need to use",
+    "the correct method is",
+    "the right way is"
+)
+
+REQUIRED_PHRASES = (
+    "what do you think",
+    "how would you approach",
+    "can you explain",
+    "let's think about",
+    "consider this",
+    "what if",
+    "suppose that",
+    "imagine if",
+    "let's explore",
+    "how might you",
+    "what's your understanding of",
+    "how would you break this down",
+    "what factors would you consider",
+    "what's the relationship between",
+    "how would you analyze this",
+    "what information would you need",
+    "how would you verify this",
+    "what assumptions are you making",
+    "how would you test this",
+    "what's the first step you would take"
+)
+
+RESPONSE_TEMPLATES = (
+    "Let's think about this step by step. What would you do first?",
+    "How would you approach this problem?",
+    "What information do you think we need to solve this?",
+    "Can you explain your reasoning so far?",
+    "What's the first thing you would consider?",
+    "How would you start solving this?",
+    "What do you know about this concept?",
+    "Let's break this down. What's the first step?",
+    "What would you need to know to solve this?",
+    "How would you organize your thoughts on this?",
+    "What's your understanding of the key concepts here?",
+    "How would you verify if your approach is correct?",
+    "What assumptions are you making in your approach?",
+    "How would you test your solution?",
+    "What alternative approaches could you consider?"
+)
+
+# Compiled once so streamed output can be checked chunk by chunk
+FORBIDDEN_MATCHER = PhraseMatcher(FORBIDDEN_PATTERNS)
 
 class TutorRules:
-    def __init__(self):
-        self.forbidden_patterns = [
-            "the answer is",
-            "you should write",
-            "the correct answer is",
-            "here's the answer",
-            "the solution is",
-            "you need to write",
-            "you must write",
-            "the final answer is",
-            "the result is",
-            "you should get",
-            "the answer will be",
-            "the answer would be",
-            "the answer should be",
-            "the answer must be",
-            "the answer needs to be",
-            "here's how to solve it",
-            "the way to solve this is",
-            "you need to do this",
-            "the formula is",
-            "the calculation is",
-            "the method is",
-            "the approach is",
-            "you need to use",
-            "the correct method is",
-            "the right way is"
-        ]
-        
-        self.required_phrases = [
-            "what do you think",
-            "how would you approach",
-            "can you explain",
-            "let's think about",
-            "consider this",
-            "what if",
-            "suppose that",
-            "imagine if",
-            "let's explore",
-            "how might you",
-            "what's your understanding of",
-            "how would you break this down",
-            "what factors would you consider",
-            "what's the relationship between",
-            "how would you analyze this",
-            "what information would you need",
-            "how would you verify this",
-            "what assumptions are you making",
-            "how would you test this",
-            "what's the first step you would take"
-        ]
-        
-        self.response_templates = [
-            "Let's think about this step by step. What would you do first?",
-            "How would you approach this problem?",
-            "What information do you think we need to solve this?",
-            "Can you explain your reasoning so far?",
-            "What's the first thing you would consider?",
-            "How would you start solving this?",
-            "What do you know about this concept?",
-            "Let's break this down. What's the first step?",
-            "What would you need to know to solve this?",
-            "How would you organize your thoughts on this?",
-            "What's your understanding of the key concepts here?",
-            "How would you verify if your approach is correct?",
-            "What assumptions are you making in your approach?",
-            "How would you test your solution?",
-            "What alternative approaches could you consider?"
-        ]
+    forbidden_patterns = FORBIDDEN_PATTERNS
+    required_phrases = REQUIRED_PHRASES
+    response_templates = RESPONSE_TEMPLATES
+    forbidden_matcher = FORBIDDEN_MATCHER
+
+    def __init__(self, rng=None):
+        # Pass a seeded random.Random to make the choice of template reproducible
+        self.random = rng or random
 
     def validate_response(self, response):
         """Validates that the response doesn't contain direct answers"""
+        # A whole response is checked with plain substring search: CPython's
+        # string search with early exit beats the regex matcher here, which
+        # pays off for offsets and incremental checks (benchmarks/tutor_rules.py)
         response_lower = response.lower()
         
         # Check for forbidden patterns
@@ -87,107 +247,252 @@ class TutorRules:
         
         return True, "Response is valid"
 
+    def find_direct_answers(self, response):
+        """Returns every (offset, pattern) forbidden match in the response"""
+        return self.forbidden_matcher.find_all(response)
+
+    def direct_answer_scanner(self):
+        """Returns a scanner that flags forbidden patterns chunk by chunk while streaming"""
+        return self.forbidden_matcher.scanner()
+
     def get_redirecting_response(self):
         """Returns a response that redirects the student to think for themselves"""
-        return random.choice(self.response_templates)
+        return self.random.choice(self.response_templates)
+
+# Words that suggest a student is reasoning rather than guessing
+CRITICAL_THINKING_INDICATORS = (
+    "because",
+    "therefore",
+    "thus",
+    "since",
+    "if",
+    "then",
+    "assume",
+    "consider",
+    "analyze",
+    "evaluate"
+)
+
+# Retrieved hints below this cosine similarity fall back to the learning-path hints
+RETRIEVED_HINT_MIN_SCORE = 0.15
+
+# Topic ids are indexes into TOPICS; TutorState stores the id, not the name
+TOPICS = ("accounting_equation", "financial_ratios", "financial_statements", "time_value_money")
+
+LEARNING_PATH = MappingProxyType({
+    "accounting_equation": (
+        "Understanding the basic equation",
+        "Analyzing transactions",
+        "Impact on financial statements",
+        "Real-world applications"
+    ),
+    "financial_ratios": (
+        "Types of ratios",
+        "Calculation methods",
+        "Interpretation",
+        "Industry comparisons"
+    ),
+    "financial_statements": (
+        "Statement components",
+        "Interrelationships",
+        "Analysis techniques",
+        "Practical applications"
+    ),
+    "time_value_money": (
+        "Basic concepts",
+        "Present value calculations",
+        "Future value calculations",
+        "Annuities and perpetuities"
+    )
+})
+
+# Common encouraging phrases
+ENCOURAGEMENT_PHRASES = (
+    "You're on the right track!",
+    "That's a good start. Let's think about this further.",
+    "You're getting closer!",
+    "Good effort! Let's break this down step by step.",
+    "Almost there! Consider one more aspect...",
+    "That's an interesting perspective. Let's explore it further.",
+    "You're making good progress. Let's refine your understanding.",
+    "That's a thoughtful approach. Let's build on it.",
+    "You're asking good questions. Let's explore them together.",
+    "You're developing good analytical skills. Let's apply them here."
+)
+
+# Topic-specific guidance templates
+TOPIC_HINTS = MappingProxyType({
+    "accounting_equation": (
+        "Remember the basic accounting equation: Assets = Liabilities + Equity",
+        "Think about what changes on each side of the equation when a transaction occurs",
+        "Consider how this transaction affects the company's assets and liabilities",
+        "Remember that every transaction must maintain the equation's balance",
+        "What's the impact on the company's financial position?",
+        "How would this transaction be recorded in the accounting system?",
+        "What's the relationship between this transaction and the company's equity?"
+    ),
+    "financial_ratios": (
+        "Start by identifying which financial statements you need",
+        "Consider what this ratio is trying to measure",
+        "Think about the relationship between the numerator and denominator",
+        "What does this ratio tell us about the company's performance?",
+        "How would you interpret this ratio in context?",
+        "What industry standards should you consider?",
+        "How might this ratio change over time?"
+    ),
+    "financial_statements": (
+        "Which statement would show this information?",
+        "What's the relationship between these statements?",
+        "Consider the timing of when transactions are recorded",
+        "Think about the accrual vs. cash basis of accounting",
+        "How do these statements work together?",
+        "What's the purpose of each statement?",
+        "How would you analyze trends in these statements?"
+    ),
+    "time_value_money": (
+        "What is the relationship between present and future value?",
+        "Consider the impact of interest rates and time periods",
+        "Think about whether this is a single payment or an annuity",
+        "How does compounding frequency affect the calculation?",
+        "What assumptions are you making about interest rates?",
+        "How would inflation impact your calculations?",
+        "What's the difference between nominal and real rates?"
+    )
+})
+
+# Topic keywords for identification
+TOPIC_KEYWORDS = MappingProxyType({
+    "accounting_equation": ("equation", "assets", "liabilities", "equity", "balance", "transaction", "accounting"),
+    "financial_ratios": ("ratio", "calculate", "divide", "percentage", "profitability", "liquidity", "leverage"),
+    "financial_statements": ("statement", "balance sheet", "income", "cash flow", "financial", "report"),
+    "time_value_money": ("time value", "present value", "future value", "interest", "annuity", "discounting")
+})
+
+# Topics and reasoning indicators scored together
+KEYWORD_INDEX = KeywordIndex(dict(TOPIC_KEYWORDS, critical_thinking=CRITICAL_THINKING_INDICATORS))
+
+# Built-in practice problems, used when there is no retrieval index
+PRACTICE_PROBLEMS = (
+    ("accounting_equation", "easy",
+     "A company purchases $1,000 of inventory on credit. How does this affect the accounting equation?"),
+    ("accounting_equation", "medium",
+     "A company issues $5,000 in common stock and purchases equipment worth $3,000 cash. Show the impact on the accounting equation."),
+    ("accounting_equation", "hard",
+     "A company takes out a $10,000 loan, purchases inventory for $7,000, and pays $2,000 in dividends. What's the net effect on the accounting equation?"),
+    ("financial_ratios", "easy",
+     "Calculate the current ratio if current assets are $50,000 and current liabilities are $25,000."),
+    ("financial_ratios", "medium",
+     "A company has current assets of $75,000, inventory of $25,000, and current liabilities of $30,000. Calculate the quick ratio."),
+    ("financial_ratios", "hard",
+     "Calculate the return on equity if net income is $60,000, total assets are $400,000, and total liabilities are $200,000."),
+)
+
+MAX_HINTS = 3
+
+# An opening message longer than this, or with numbers in it, is a question, not a choice of topic
+TOPIC_CHOICE_MAX_WORDS = 12
+
+class ConversationState(IntEnum):
+    INITIAL = 0
+    TOPIC_SELECTED = 1
+    IN_DISCUSSION = 2
+    PRACTICE = 3
+
+    @property
+    def label(self):
+        """The state's name as the tutor has always reported it, e.g. "topic_selected" """
+        return self.name.lower()
+
+class TutorState:
+    """Everything that differs between two students' sessions with the tutor
+
+    Small enough to keep hundreds of thousands in memory, and to_bytes()
+    packs it into 8 bytes for an external session store. The current problem
+    is kept as a reference: 0 for none, n for PRACTICE_PROBLEMS[n - 1], and
+    -n for item n - 1 of the retrieval index.
+    """
+
+    __slots__ = ("state", "topic", "question_index", "hints_given", "problem")
+
+    # state, topic id + 1 (0 = none), question index, hints given, problem reference
+    _FORMAT = struct.Struct("<BBBBi")
+
+    def __init__(self, state=ConversationState.INITIAL, topic=None, question_index=0, hints_given=0, problem=0):
+        self.state = state
+        self.topic = topic
+        self.question_index = question_index
+        self.hints_given = hints_given
+        self.problem = problem
+
+    def to_bytes(self):
+        return self._FORMAT.pack(self.state, 0 if self.topic is None else self.topic + 1,
+                                 self.question_index, self.hints_given, self.problem)
+
+    @classmethod
+    def from_bytes(cls, data):
+        state, topic, question_index, hints_given, problem = cls._FORMAT.unpack(data)
+        return cls(ConversationState(state), None if topic == 0 else topic - 1, question_index, hints_given, problem)
+
+    def __eq__(self, other):
+        return isinstance(other, TutorState) and self.to_bytes() == other.to_bytes()
+
+    def __repr__(self):
+        return (f"TutorState({self.state.name}, topic={self.topic}, question_index={self.question_index}, "
+                f"hints_given={self.hints_given}, problem={self.problem})")
 
 class AccountingFinanceTutor:
-    def __init__(self):
-        self.hints_given = 0
-        self.max_hints = 3
-        self.student_progress = {}
-        self.rules = TutorRules()
-        self.current_topic = None
-        self.current_question_index = 0
-        self.conversation_state = "initial"  # initial, topic_selected, in_discussion, practice
-        self.learning_path = {
-            "accounting_equation": [
-                "Understanding the basic equation",
-                "Analyzing transactions",
-                "Impact on financial statements",
-                "Real-world applications"
-            ],
-            "financial_ratios": [
-                "Types of ratios",
-                "Calculation methods",
-                "Interpretation",
-                "Industry comparisons"
-            ],
-            "financial_statements": [
-                "Statement components",
-                "Interrelationships",
-                "Analysis techniques",
-                "Practical applications"
-            ],
-            "time_value_money": [
-                "Basic concepts",
-                "Present value calculations",
-                "Future value calculations",
-                "Annuities and perpetuities"
-            ]
-        }
-        
-        # Common encouraging phrases
-        self.encouragement_phrases = [
-            "You're on the right track!",
-            "That's a good start. Let's think about this further.",
-            "You're getting closer!",
-            "Good effort! Let's break this down step by step.",
-            "Almost there! Consider one more aspect...",
-            "That's an interesting perspective. Let's explore it further.",
-            "You're making good progress. Let's refine your understanding.",
-            "That's a thoughtful approach. Let's build on it.",
-            "You're asking good questions. Let's explore them together.",
-            "You're developing good analytical skills. Let's apply them here."
-        ]
-        
-        # Topic-specific guidance templates
-        self.topic_hints = {
-            "accounting_equation": [
-                "Remember the basic accounting equation: Assets = Liabilities + Equity",
-                "Think about what changes on each side of the equation when a transaction occurs",
-                "Consider how this transaction affects the company's assets and liabilities",
-                "Remember that every transaction must maintain the equation's balance",
-                "What's the impact on the company's financial position?",
-                "How would this transaction be recorded in the accounting system?",
-                "What's the relationship between this transaction and the company's equity?"
-            ],
-            "financial_ratios": [
-                "Start by identifying which financial statements you need",
-                "Consider what this ratio is trying to measure",
-                "Think about the relationship between the numerator and denominator",
-                "What does this ratio tell us about the company's performance?",
-                "How would you interpret this ratio in context?",
-                "What industry standards should you consider?",
-                "How might this ratio change over time?"
-            ],
-            "financial_statements": [
-                "Which statement would show this information?",
-                "What's the relationship between these statements?",
-                "Consider the timing of when transactions are recorded",
-                "Think about the accrual vs. cash basis of accounting",
-                "How do these statements work together?",
-                "What's the purpose of each statement?",
-                "How would you analyze trends in these statements?"
-            ],
-            "time_value_money": [
-                "What is the relationship between present and future value?",
-                "Consider the impact of interest rates and time periods",
-                "Think about whether this is a single payment or an annuity",
-                "How does compounding frequency affect the calculation?",
-                "What assumptions are you making about interest rates?",
-                "How would inflation impact your calculations?",
-                "What's the difference between nominal and real rates?"
-            ]
-        }
-        
-        # Topic keywords for identification
-        self.topic_keywords = {
-            "accounting_equation": ["equation", "assets", "liabilities", "equity", "balance", "transaction", "accounting"],
-            "financial_ratios": ["ratio", "calculate", "divide", "percentage", "profitability", "liquidity", "leverage"],
-            "financial_statements": ["statement", "balance sheet", "income", "cash flow", "financial", "report"],
-            "time_value_money": ["time value", "present value", "future value", "interest", "annuity", "discounting"]
-        }
+    """The rule-based tutor: shared content and rules applied to one TutorState
+
+    A tutor is cheap to create around a stored state, so a server can keep
+    only TutorState bytes per student and build a tutor for each message.
+    """
+
+    learning_path = LEARNING_PATH
+    encouragement_phrases = ENCOURAGEMENT_PHRASES
+    topic_hints = TOPIC_HINTS
+    topic_keywords = TOPIC_KEYWORDS
+    keyword_index = KEYWORD_INDEX
+    max_hints = MAX_HINTS
+
+    def __init__(self, seed=None, retriever=None, state=None, problems=None):
+        # A seed makes every random choice repeatable, e.g. when replaying transcripts
+        self.seeded = seed is not None
+        self.random = random.Random(seed) if seed is not None else random
+        # Optional RetrievalIndex of worked problems and hints (see retrieval.py)
+        self.retriever = retriever
+        # Optional ProblemPool of generated practice problems with checked solutions (see practice.py)
+        self.problems = problems
+        self.rules = TutorRules(self.random)
+        self.state = state if state is not None else TutorState()
+
+    # Read-only views of the state, named as the tutor has always exposed them
+
+    @property
+    def current_topic(self):
+        return None if self.state.topic is None else TOPICS[self.state.topic]
+
+    @property
+    def conversation_state(self):
+        return self.state.state.label
+
+    @property
+    def current_question_index(self):
+        return self.state.question_index
+
+    @property
+    def hints_given(self):
+        return self.state.hints_given
+
+    @property
+    def current_problem(self):
+        problem = self.state.problem
+        if self.problems is not None and self.problems.owns(problem):
+            return self.problems.text(problem)
+        if 0 < problem <= len(PRACTICE_PROBLEMS):
+            return PRACTICE_PROBLEMS[problem - 1][2]
+        if problem < 0 and self.retriever is not None:
+            return self.retriever.item(-problem - 1)["problem"]
+        return None
 
     def greet_student(self):
         """Initial greeting and session setup"""
@@ -207,37 +512,69 @@ class AccountingFinanceTutor:
         return welcome_message
 
     def identify_topic(self, user_input):
-        """Identifies the topic from user input"""
+        """Identifies the topic with the most keyword matches in user input"""
+        return self.keyword_index.best(user_input, groups=TOPICS)
+
+    def can_answer(self, user_input):
+        """Whether evaluate_response has a real answer for this turn, without changing any state
+
+        Naming a topic, asking for a practice problem or a hint (while hints
+        remain), numeric answers to a generated practice problem, and answers
+        that _assess_response rates as good are handled by the rules. A
+        question or a pasted problem in the opening message, or an answer
+        that needs guidance, is better left to the LLM; only a short
+        message without numbers counts as naming a topic.
+        """
         user_input_lower = user_input.lower()
-        
-        for topic, keywords in self.topic_keywords.items():
-            if any(keyword in user_input_lower for keyword in keywords):
-                return topic
-        return None
+        state = self.state.state
+        if user_input_lower == "exit":
+            return True
+        if state == ConversationState.INITIAL:
+            return (len(user_input.split()) <= TOPIC_CHOICE_MAX_WORDS and "?" not in user_input_lower
+                    and not any(char.isdigit() for char in user_input)
+                    and self.identify_topic(user_input) is not None)
+        if state == ConversationState.TOPIC_SELECTED and "practice" in user_input_lower:
+            return True
+        if "hint" in user_input_lower:
+            return self.state.hints_given < self.max_hints
+        if state == ConversationState.PRACTICE and self._check_practice_answer(user_input) is not None:
+            return True
+        return self._assess_response(user_input) == "good"
+
+    def start_topic_discussion(self, topic):
+        """Opens the discussion of a newly selected topic"""
+        self.state.question_index = 0
+        self.state.hints_given = 0
+        topic_name = topic.replace("_", " ").title()
+        first_stage = self.learning_path[topic][0]
+        return (f"Great, let's work on {topic_name}. We'll start with {first_stage.lower()}. "
+                f"What do you think you already know about it? "
+                f"(You can also ask for an easy, medium or hard practice problem.)")
 
     def evaluate_response(self, user_input, current_topic=None):
         """Evaluates response and determines next question or guidance needed"""
         user_input_lower = user_input.lower()
+        state = self.state
         
         # Handle exit command
         if user_input_lower == "exit":
             return "Thank you for studying with me! Keep up the good work!"
         
         # Handle initial state
-        if self.conversation_state == "initial":
+        if state.state == ConversationState.INITIAL:
             identified_topic = self.identify_topic(user_input)
             if identified_topic:
-                self.current_topic = identified_topic
-                self.conversation_state = "topic_selected"
+                state.topic = TOPICS.index(identified_topic)
+                state.state = ConversationState.TOPIC_SELECTED
                 return self.start_topic_discussion(identified_topic)
             else:
                 return ("I can help you with Accounting Equation, Financial Ratios, "
                        "Financial Statements, or Time Value of Money. Which topic would you like to work on?")
         
         # Handle topic selected state
-        elif self.conversation_state == "topic_selected":
+        elif state.state == ConversationState.TOPIC_SELECTED:
             if "practice" in user_input_lower:
-                self.conversation_state = "practice"
+                state.state = ConversationState.PRACTICE
                 difficulty = "medium"  # default difficulty
                 if "easy" in user_input_lower:
                     difficulty = "easy"
@@ -245,17 +582,17 @@ class AccountingFinanceTutor:
                     difficulty = "hard"
                 return self.create_practice_problem(self.current_topic, difficulty)
             else:
-                self.conversation_state = "in_discussion"
+                state.state = ConversationState.IN_DISCUSSION
                 return self._handle_discussion(user_input)
         
         # Handle in discussion state
-        elif self.conversation_state == "in_discussion":
+        elif state.state == ConversationState.IN_DISCUSSION:
             return self._handle_discussion(user_input)
         
         # Handle practice state
-        elif self.conversation_state == "practice":
+        elif state.state == ConversationState.PRACTICE:
             if "hint" in user_input_lower:
-                return self._provide_guided_hint()
+                return self._provide_guided_hint(user_input)
             else:
                 return self._handle_practice_response(user_input)
         
@@ -266,10 +603,12 @@ class AccountingFinanceTutor:
         response_quality = self._assess_response(user_input)
         
         if response_quality == "good":
-            self.current_question_index += 1
-            if self.current_question_index < len(self.learning_path[self.current_topic]):
-                next_response = (f"{random.choice(self.encouragement_phrases)} "
-                               f"Let's move on to {self.learning_path[self.current_topic][self.current_question_index]}. "
+            path = self.learning_path[self.current_topic]
+            # Stops at the end of the path, so the index always fits its byte in to_bytes()
+            self.state.question_index = min(self.state.question_index + 1, len(path))
+            if self.state.question_index < len(path):
+                next_response = (f"{self.random.choice(self.encouragement_phrases)} "
+                               f"Let's move on to {path[self.state.question_index]}. "
                                f"What's your understanding of this aspect?")
                 is_valid, _ = self.rules.validate_response(next_response)
                 if not is_valid:
@@ -279,10 +618,17 @@ class AccountingFinanceTutor:
                 return ("Excellent! You've shown good understanding of this topic. "
                        "Would you like to try a practice problem to test your knowledge?")
         else:
-            return self._provide_guided_hint()
+            return self._provide_guided_hint(user_input)
 
     def _handle_practice_response(self, user_input):
         """Handles responses during practice problems"""
+        checked = self._check_practice_answer(user_input)
+        if checked:
+            return ("Your numbers check out! Now walk me through your reasoning: "
+                   "which relationship did you use, and why does it apply here?")
+        if checked is False:
+            return f"Not all of your numbers check out yet. {self._provide_guided_hint(user_input)}"
+
         response_quality = self._assess_response(user_input)
         
         if response_quality == "good":
@@ -290,73 +636,89 @@ class AccountingFinanceTutor:
                    "What assumptions are you making in your solution? "
                    "How would you verify if your answer is correct?")
         else:
-            return self._provide_guided_hint()
+            return self._provide_guided_hint(user_input)
+
+    def _check_practice_answer(self, user_input):
+        """Whether the numbers in the reply solve the current generated problem; None if it cannot tell"""
+        problem = self.state.problem
+        if self.problems is None or not self.problems.owns(problem):
+            return None
+        return self.problems.check_answer(problem, user_input)
 
     def _assess_response(self, response):
         """Assess the quality of student response"""
         if not self.current_topic:
             return "needs_guidance"
             
-        relevant_keywords = self.topic_keywords.get(self.current_topic, [])
-        matches = sum(keyword in response.lower() for keyword in relevant_keywords)
+        scores = self.keyword_index.score(response)
+        matches = scores.get(self.current_topic, 0)
         
         # Check for critical thinking indicators
-        critical_thinking_indicators = [
-            "because",
-            "therefore",
-            "thus",
-            "since",
-            "if",
-            "then",
-            "assume",
-            "consider",
-            "analyze",
-            "evaluate"
-        ]
-        
-        critical_thinking_matches = sum(indicator in response.lower() for indicator in critical_thinking_indicators)
+        critical_thinking_matches = scores["critical_thinking"]
         
         # Consider both keyword matches and critical thinking indicators
         total_score = matches + critical_thinking_matches
         
         return "good" if total_score >= 3 else "needs_guidance"
 
-    def _provide_guided_hint(self):
+    def _provide_guided_hint(self, user_input=None):
         """Provides a structured hint based on current topic and progress"""
-        if self.hints_given >= self.max_hints:
+        state = self.state
+        if state.hints_given >= self.max_hints:
             return ("I've given you several hints. Let's take a step back. "
                    "What's your current understanding of the problem? "
                    "What specific part is challenging you?")
             
-        if self.current_topic and self.current_question_index < len(self.topic_hints[self.current_topic]):
-            self.hints_given += 1
-            hint = f"Let's think about this differently. {self.topic_hints[self.current_topic][self.current_question_index]}"
+        # Prefer the hint of the most similar worked problem, when there is one
+        retrieved = self._retrieve_hint(user_input)
+        topic = self.current_topic
+        if retrieved or (topic and state.question_index < len(self.topic_hints[topic])):
+            state.hints_given += 1
+            hint = f"Let's think about this differently. {retrieved or self.topic_hints[topic][state.question_index]}"
             is_valid, _ = self.rules.validate_response(hint)
             if not is_valid:
                 hint = self.rules.get_redirecting_response()
             return hint
         return "Could you explain your thinking process to me? What's challenging you about this problem?"
 
+    def _retrieve_hint(self, user_input):
+        """Hint of a corpus problem close to the student's message and current problem
+
+        Each further hint comes from the next most similar problem, so asking
+        again does not repeat the same hint.
+        """
+        if self.retriever is None or not self.current_topic:
+            return None
+        hints_given = self.state.hints_given
+        query = " ".join(text for text in (self.current_problem, user_input) if text)
+        results = self.retriever.search(query, k=hints_given + 1, topic=self.current_topic,
+                                        min_score=RETRIEVED_HINT_MIN_SCORE)
+        return results[hints_given][1]["hint"] if len(results) > hints_given else None
+
     def create_practice_problem(self, topic, difficulty):
         """Generates a practice problem based on topic and difficulty"""
-        practice_problems = {
-            "accounting_equation": {
-                "easy": "A company purchases $1,000 of inventory on credit. How does this affect the accounting equation?",
-                "medium": "A company issues $5,000 in common stock and purchases equipment worth $3,000 cash. Show the impact on the accounting equation.",
-                "hard": "A company takes out a $10,000 loan, purchases inventory for $7,000, and pays $2,000 in dividends. What's the net effect on the accounting equation?"
-            },
-            "financial_ratios": {
-                "easy": "Calculate the current ratio if current assets are $50,000 and current liabilities are $25,000.",
-                "medium": "A company has current assets of $75,000, inventory of $25,000, and current liabilities of $30,000. Calculate the quick ratio.",
-                "hard": "Calculate the return on equity if net income is $60,000, total assets are $400,000, and total liabilities are $200,000."
-            }
-        }
-        
-        problem = practice_problems.get(topic, {}).get(difficulty, "No problem available for this topic and difficulty level.")
+        if self.problems is not None:
+            generated = self.problems.take(topic, difficulty, self.random if self.seeded else None)
+            if generated is not None:
+                self.state.problem, problem = generated
+                return f"{problem}\n\nHow would you approach solving this problem?"
+
+        if self.retriever is not None:
+            doc_id = self.retriever.sample_id(topic, difficulty, self.random)
+            if doc_id is not None:
+                self.state.problem = -(doc_id + 1)
+                return f"{self.current_problem}\n\nHow would you approach solving this problem?"
+
+        self.state.problem = next((number for number, (problem_topic, problem_difficulty, _)
+                                   in enumerate(PRACTICE_PROBLEMS, 1)
+                                   if (problem_topic, problem_difficulty) == (topic, difficulty)), 0)
+        problem = self.current_problem or "No problem available for this topic and difficulty level."
         return f"{problem}\n\nHow would you approach solving this problem?"
 
 def main():
-    tutor = AccountingFinanceTutor()
+    from practice import create_problem_pool
+    from retrieval import create_retrieval_index
+    tutor = AccountingFinanceTutor(retriever=create_retrieval_index(), problems=create_problem_pool())
     print(tutor.greet_student())
     
     while True:
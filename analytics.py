@@ -0,0 +1,308 @@
+"""Student progress analytics over the transcript log.
+
+Turns from closed transcript segments are ingested into a Parquet dataset,
+partitioned by month and topic; each file keeps the turn's date, so a date
+range also skips row groups within a month. Ingestion is incremental: a
+watermark file lists the segments already ingested, so each run only reads
+the new ones, and partitions that collect many small files are compacted.
+Queries read just the columns they need from the partitions they need and
+aggregate with pyarrow and pandas, without a Python loop over turns.
+
+A student is a session: the tutor has no accounts.
+
+Usage:
+    python analytics.py ingest
+    python analytics.py report stages --start 2026-08-01 --topic financial_ratios
+    python analytics.py report topics --by semester -o topics.csv
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import uuid
+from datetime import date
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from NuAnswers import LEARNING_PATH
+from transcripts import TRANSCRIPT_SCHEMA, read_segment, seal_orphaned_segments, segment_paths
+
+# Daily partitions would leave a query over a few semesters opening thousands of tiny files
+PARTITIONING = ds.partitioning(pa.schema([("month", pa.string()), ("topic", pa.string())]), flavor="hive")
+# Transcript columns plus the date; topic comes back from the partition path as a plain string
+DATASET_SCHEMA = pa.schema([field for field in TRANSCRIPT_SCHEMA if field.name != "topic"]
+                           + [pa.field("date", pa.date32())] + list(PARTITIONING.schema))
+# Starts with "_", so dataset discovery skips it
+WATERMARK = "_watermark.json"
+# The month each term starts in, latest first
+SEMESTERS = ((8, "Fall"), (6, "Summer"), (1, "Spring"))
+PERIODS = ("date", "week", "month", "semester")
+ROW_GROUP_ROWS = 1 << 16
+
+class ProgressAnalytics:
+    """A Parquet dataset of logged turns and the aggregate queries over it"""
+
+    def __init__(self, directory, compression="zstd", max_files=8):
+        self.directory = directory
+        self.compression = compression
+        self.max_files = max_files
+        os.makedirs(directory, exist_ok=True)
+
+    def ingest(self, transcript_dir):
+        """Adds the closed segments not ingested yet; returns the number of turns added
+
+        The segments about to be ingested are written to the watermark
+        first, under the file name prefix their Parquet files will get. A
+        run that dies half way is redone by the next one under the same
+        names, overwriting its partial files instead of duplicating turns.
+        Segments left open by killed workers are sealed and ingested too.
+        """
+        watermark = self._load_watermark()
+        pending = watermark["pending"]
+        if pending is None:
+            seal_orphaned_segments(transcript_dir)
+            done = set(watermark["segments"])
+            segments = [os.path.basename(path) for path in segment_paths(transcript_dir)
+                        if os.path.basename(path) not in done]
+            if not segments:
+                return 0
+            pending = watermark["pending"] = {"name": uuid.uuid4().hex[:12], "segments": segments}
+            self._save_watermark(watermark)
+
+        paths = [os.path.join(transcript_dir, name) for name in pending["segments"]]
+        batches = [batch for path in paths if os.path.exists(path) for batch in read_segment(path)]
+        rows = sum(batch.num_rows for batch in batches)
+        if rows:
+            self._write(pa.Table.from_batches(batches, schema=TRANSCRIPT_SCHEMA), pending["name"])
+
+        watermark["segments"] += pending["segments"]
+        watermark["rows"] += rows
+        watermark["pending"] = None
+        self._save_watermark(watermark)
+        self.compact()
+        return rows
+
+    def _write(self, table, name):
+        dates = pc.cast(table["timestamp"], pa.date32())
+        table = table.append_column("date", dates)
+        table = table.append_column("month", pc.utf8_slice_codeunits(pc.cast(dates, pa.string()), 0, 7))
+        table = table.set_column(table.schema.get_field_index("topic"), "topic",
+                                 pc.cast(table["topic"], pa.string()))
+        ds.write_dataset(table, self.directory, format="parquet", partitioning=PARTITIONING,
+                         basename_template=f"part-{name}-{{i}}.parquet",
+                         existing_data_behavior="overwrite_or_ignore",
+                         # The log's batches are small; split by partition they would each make a tiny row group
+                         min_rows_per_group=ROW_GROUP_ROWS, max_rows_per_group=ROW_GROUP_ROWS * 4,
+                         file_options=ds.ParquetFileFormat().make_write_options(compression=self.compression))
+
+    def compact(self):
+        """Rewrites every partition of more than max_files files as one file; returns how many it rewrote
+
+        Each ingest adds a file to every partition it touches. The rewritten
+        file keeps a leading "_", which hides it from readers, until the swap
+        is recorded in the watermark and the files it replaces are deleted.
+        A compaction that dies half way is finished by the next call.
+        """
+        watermark = self._load_watermark()
+        if watermark.get("compacting"):
+            self._finish_compaction(watermark)
+        # Hidden files whose swap was never recorded
+        for path in glob.glob(os.path.join(self.directory, "month=*", "topic=*", "_part-*.parquet")):
+            os.remove(path)
+
+        compacted = 0
+        for partition in sorted(glob.glob(os.path.join(self.directory, "month=*", "topic=*"))):
+            files = sorted(glob.glob(os.path.join(partition, "part-*.parquet")))
+            if len(files) <= self.max_files:
+                continue
+            name = f"part-{uuid.uuid4().hex[:12]}-0.parquet"
+            table = ds.dataset(files, format="parquet").to_table().sort_by("timestamp")
+            pq.write_table(table, os.path.join(partition, "_" + name), compression=self.compression)
+            watermark["compacting"] = {"partition": os.path.relpath(partition, self.directory), "file": name,
+                                       "replaces": [os.path.basename(path) for path in files]}
+            self._save_watermark(watermark)
+            self._finish_compaction(watermark)
+            compacted += 1
+        return compacted
+
+    def _finish_compaction(self, watermark):
+        swap = watermark["compacting"]
+        partition = os.path.join(self.directory, swap["partition"])
+        for name in swap["replaces"]:
+            if os.path.exists(os.path.join(partition, name)):
+                os.remove(os.path.join(partition, name))
+        if os.path.exists(os.path.join(partition, "_" + swap["file"])):
+            os.replace(os.path.join(partition, "_" + swap["file"]), os.path.join(partition, swap["file"]))
+        watermark["compacting"] = None
+        self._save_watermark(watermark)
+
+    def _load_watermark(self):
+        try:
+            with open(os.path.join(self.directory, WATERMARK)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"segments": [], "rows": 0, "pending": None, "compacting": None}
+
+    def _save_watermark(self, watermark):
+        path = os.path.join(self.directory, WATERMARK)
+        with open(path + ".tmp", "w") as f:
+            json.dump(watermark, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def dataset(self):
+        return ds.dataset(self.directory, schema=DATASET_SCHEMA, format="parquet", partitioning=PARTITIONING)
+
+    def turns(self, columns=None, start=None, end=None, topics=None):
+        """Logged turns as an Arrow table, reading only the partitions in range
+
+        start and end are inclusive dates; topics may include None for turns
+        before any topic was chosen.
+        """
+        condition = None
+        for part in _date_filter(start, end) + _topic_filter(topics):
+            condition = part if condition is None else condition & part
+        return self.dataset().to_table(columns=columns, filter=condition)
+
+    def stage_rows(self, start=None, end=None, topics=None):
+        """One row per student, topic and learning path stage the student reached
+
+        hints is the number of hints taken during the stage (hints_given
+        counts up across a topic's stages), and mastered whether the student
+        went on to a later stage of the topic.
+        """
+        table = self.turns(["session_id", "topic", "stage", "hints_given", "date"], start, end, topics)
+        table = table.filter(pc.is_valid(table["topic"]))
+        per_stage = table.group_by(["session_id", "topic", "stage"]).aggregate([
+            ("stage", "count"), ("hints_given", "max"), ("date", "min")])
+        reached = table.group_by(["session_id", "topic"]).aggregate([("stage", "max")])
+        frame = per_stage.join(reached, ["session_id", "topic"]).to_pandas()
+        frame = frame.rename(columns={"stage_count": "turns", "date_min": "date"})
+        frame = frame.sort_values(["session_id", "topic", "stage"], ignore_index=True)
+
+        # Rows past the last stage only mark the topic as completed
+        frame["mastered"] = frame["stage"] < frame["stage_max"]
+        previous = frame.groupby(["session_id", "topic"])["hints_given_max"].shift(fill_value=0)
+        frame["hints"] = (frame["hints_given_max"].astype("int16") - previous).clip(lower=0)
+        path_length = frame["topic"].map({topic: len(path) for topic, path in LEARNING_PATH.items()})
+        frame = frame[frame["stage"] < path_length]
+        names = pd.Series({(topic, stage): name for topic, path in LEARNING_PATH.items()
+                           for stage, name in enumerate(path)})
+        frame = frame.assign(stage_name=names.reindex(pd.MultiIndex.from_arrays(
+            [frame["topic"], frame["stage"].astype("int64")])).to_numpy())
+        return frame[["session_id", "topic", "stage", "stage_name", "date", "turns", "hints", "mastered"]]
+
+    def stage_summary(self, start=None, end=None, topics=None):
+        """Per topic and learning path stage: students, mastery rate, hints and turns"""
+        rows = self.stage_rows(start, end, topics)
+        summary = rows.groupby(["topic", "stage", "stage_name"], as_index=False).agg(
+            students=("session_id", "size"), mastered=("mastered", "sum"),
+            mean_hints=("hints", "mean"), mean_turns=("turns", "mean"))
+        summary["mastery_rate"] = summary["mastered"] / summary["students"]
+        return summary.round(3)
+
+    def hint_usage(self, by="week", start=None, end=None, topics=None):
+        """Per period and topic: students, hints taken and hints per student"""
+        rows = self.stage_rows(start, end, topics)
+        rows["period"] = _period_labels(pa.array(rows["date"], pa.date32()), by).to_numpy(zero_copy_only=False)
+        usage = rows.groupby(["period", "topic"], as_index=False).agg(
+            students=("session_id", "nunique"), hints=("hints", "sum"))
+        usage["hints_per_student"] = (usage["hints"] / usage["students"]).round(3)
+        return usage
+
+    def topic_distribution(self, by="semester", start=None, end=None, topics=None):
+        """Per period and topic: turns, students and the topic's share of the period's turns"""
+        table = self.turns(["session_id", "topic", "date"], start, end, topics)
+        table = table.append_column("period", _period_labels(table["date"], by))
+        counts = table.group_by(["period", "topic"]).aggregate([
+            ("session_id", "count"), ("session_id", "count_distinct")]).to_pandas()
+        counts = counts.rename(columns={"session_id_count": "turns", "session_id_count_distinct": "students"})
+        counts["share"] = (counts["turns"] / counts.groupby("period")["turns"].transform("sum")).round(4)
+        return counts.sort_values(["period", "turns"], ascending=[True, False], ignore_index=True)
+
+    def stats(self):
+        watermark = self._load_watermark()
+        return {"segments": len(watermark["segments"]), "rows": watermark["rows"],
+                "pending": watermark["pending"] is not None}
+
+def _date_filter(start, end):
+    # The month bounds prune partitions; the date bounds filter within the edge months
+    parts = []
+    if start is not None:
+        parts += [ds.field("month") >= start.strftime("%Y-%m"), ds.field("date") >= pa.scalar(start, pa.date32())]
+    if end is not None:
+        parts += [ds.field("month") <= end.strftime("%Y-%m"), ds.field("date") <= pa.scalar(end, pa.date32())]
+    return parts
+
+def _topic_filter(topics):
+    if topics is None:
+        return []
+    named = [topic for topic in topics if topic is not None]
+    condition = ds.field("topic").isin(pa.array(named, pa.string()))
+    if len(named) < len(topics):
+        condition = condition | ds.field("topic").is_null()
+    return [condition]
+
+def _period_labels(dates, by):
+    """Labels such as "2026-10-18", "2026-W42", "2026-10" or "2026 Fall" for an array of dates"""
+    if by == "date":
+        return pc.cast(dates, pa.string())
+    if by == "week":
+        years, weeks = pc.iso_year(dates), pc.iso_week(dates)
+        return pc.binary_join_element_wise(pc.cast(years, pa.string()),
+                                           pc.utf8_lpad(pc.cast(weeks, pa.string()), 2, "0"), "-W")
+    if by == "month":
+        return pc.utf8_slice_codeunits(pc.cast(dates, pa.string()), 0, 7)
+    if by == "semester":
+        months = pc.month(dates)
+        term = pa.scalar(SEMESTERS[-1][1])
+        for first_month, name in reversed(SEMESTERS[:-1]):
+            term = pc.if_else(pc.greater_equal(months, first_month), name, term)
+        return pc.binary_join_element_wise(pc.cast(pc.year(dates), pa.string()), term, " ")
+    raise ValueError(f"Unknown period {by!r}, expected one of {', '.join(PERIODS)}")
+
+def create_progress_analytics():
+    """Builds the analytics dataset configured by ANALYTICS_DIR"""
+    return ProgressAnalytics(os.getenv("ANALYTICS_DIR", "analytics"),
+                             compression=os.getenv("ANALYTICS_COMPRESSION", "zstd"),
+                             max_files=int(os.getenv("ANALYTICS_MAX_FILES", "8")))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest = commands.add_parser("ingest", help="add newly closed transcript segments to the dataset")
+    ingest.add_argument("--transcripts", default=os.getenv("TRANSCRIPTS_DIR", "transcripts"))
+    report = commands.add_parser("report", help="write an aggregate as CSV")
+    report.add_argument("query", choices=["students", "stages", "hints", "topics"])
+    report.add_argument("--start", type=date.fromisoformat, help="first date, e.g. 2026-08-01")
+    report.add_argument("--end", type=date.fromisoformat, help="last date, inclusive")
+    report.add_argument("--topic", action="append", dest="topics", help="repeat for several topics")
+    report.add_argument("--by", choices=PERIODS, default=None, help="period for hints and topics")
+    report.add_argument("-o", "--output", default="-", help="CSV file, or - for stdout")
+    args = parser.parse_args(argv)
+
+    analytics = create_progress_analytics()
+    if args.command == "ingest":
+        rows = analytics.ingest(args.transcripts)
+        print(json.dumps({"ingested": rows, **analytics.stats()}))
+        return
+
+    where = {"start": args.start, "end": args.end, "topics": args.topics}
+    if args.query == "students":
+        frame = analytics.stage_rows(**where)
+    elif args.query == "stages":
+        frame = analytics.stage_summary(**where)
+    elif args.query == "hints":
+        frame = analytics.hint_usage(by=args.by or "week", **where)
+    else:
+        frame = analytics.topic_distribution(by=args.by or "semester", **where)
+    frame.to_csv(sys.stdout if args.output == "-" else args.output, index=False)
+
+if __name__ == "__main__":
+    main()
@@ -1,152 +1,372 @@
 import os
 import sys
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+import math
+import time
+from flask import Blueprint, Flask, request, jsonify, Response, current_app, g, stream_with_context
 from dotenv import load_dotenv
-from openai import OpenAI
+from guard import REGENERATION_REMINDER
+from coalesce import flight_key
+from ratelimit import NO_PERMIT, RateLimited, client_ip
+from deadlines import DEADLINE_HEADER, ClientDisconnected, socket_closed
+from local_tier import CACHE, FALLBACK, LLM, LOCAL
+from tutor_services import SSE_HEADERS, TutorServices, local_stream_events, sse_event
+from NuAnswers import TOPICS
+import metrics
+from metrics import span
 
-# Load environment variables
-load_dotenv()
+# Settings create_app() reads from the environment unless config overrides them
+DEFAULT_CONFIG = {
+    "OPENAI_API_KEY": None,
+    "CORS_ENABLED": True
+}
 
-# Get OpenAI API key
-api_key = os.getenv("OPENAI_API_KEY")
+def services():
+    """The TutorServices of the app handling the current request"""
+    return current_app.extensions["nuanswers"]
 
-if not api_key:
-    raise ValueError("❌ ERROR: OPENAI_API_KEY is not set! Check your environment variables.")
+tutor = Blueprint("tutor", __name__)
 
-# Initialize OpenAI client
-client = OpenAI(api_key=api_key)
+# Scrapes and trace reads are not traced themselves
+UNTRACED_ENDPOINTS = {"tutor.metrics_endpoint", "tutor.traces"}
 
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+def start_trace():
+    if request.endpoint not in UNTRACED_ENDPOINTS:
+        rule = request.url_rule
+        g.trace = metrics.start_trace(metrics.UNMATCHED_ROUTE if rule is None else rule.rule)
 
-def get_openai_response(user_prompt):
-    """Function to get response from OpenAI API"""
+def finish_trace(response):
+    trace = g.pop("trace", None)
+    if trace is not None:
+        if not response.is_streamed:
+            response.headers["Server-Timing"] = trace.server_timing()
+        # Streams are only finished once the last event has been sent
+        response.call_on_close(lambda: metrics.finish_trace(trace, response.status_code))
+    return response
+
+def admit(session_id):
+    """Spends the client's rate-limit tokens; returns its upstream queue priority"""
+    admission = services().admission
+    if admission is None:
+        return None
+    return admission.check(session_id, client_ip(request.remote_addr, request.headers.get("X-Forwarded-For")))
+
+def request_deadline():
+    """The current request's Deadline, or None; under gunicorn it also watches the client's socket"""
+    sock = request.environ.get("gunicorn.socket")
+    return services().deadlines.start(request.headers.get(DEADLINE_HEADER),
+                                      client_gone=None if sock is None else lambda: socket_closed(sock))
+
+def upstream_permit(priority, deadline=None):
+    """Waits briefly for an upstream call slot; raises RateLimited if none frees up in time"""
+    admission = services().admission
+    if admission is None:
+        return NO_PERMIT
+    with span("admission"):
+        return admission.acquire(priority, None if deadline is None else deadline.at)
+
+def rate_limited_response(error):
+    response = jsonify({"error": str(error), "status": "rate_limited"})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(max(1, math.ceil(error.retry_after)))
+    return response
+
+def get_openai_response(user_prompt, history=None, params=None, deadline=None):
+    """Function to get response from OpenAI API
+
+    The completion is streamed through the output guard so a direct answer
+    cancels the upstream call straight away. It is then regenerated with a
+    reminder, or replaced by a redirecting question. Clean first-turn
+    responses are added to the response cache. Regenerations share the
+    request's deadline; ClientDisconnected is raised rather than turned into
+    an error reply.
+    """
+    tutor_services = services()
+    output_guard = tutor_services.output_guard
+    params = params or tutor_services.completion_params
     try:
-        print("⚡ Sending request to OpenAI...")
-        print(f"📨 Prompt: {user_prompt}")
-        
-        # System prompt to guide OpenAI's behavior
-        system_prompt = """You are an accounting and finance tutor. Your role is to guide students through problems by asking questions and helping them discover the solution themselves.
-
-        CRITICAL RULES:
-        1. When a user provides a numerical answer or a short response, it is ALWAYS an answer to your previous question, not a new question
-        2. After receiving an answer, acknowledge it and move to the next question in the sequence
-        3. Never ask for additional explanation of a correct answer
-        4. Maintain the conversation flow by building on previous answers
-        5. Keep track of which question you're on in the sequence
-        6. If a user provides a number or short answer, it is ALWAYS in response to your last question
-        7. NEVER treat a numerical answer or short response as a new question
-        8. ALWAYS acknowledge the answer and move to the next question in the sequence
-        9. If the answer is correct, say "Excellent!" or "Perfect!" and move to the next question
-        10. If the answer is incorrect, gently guide them to the correct answer
-
-        CONVERSATION FLOW:
-        1. Ask a question
-        2. Wait for user's answer
-        3. Acknowledge the answer (correct or incorrect)
-        4. Move to the next question in the sequence
-        5. Never ask for the full problem again
-        6. Never treat an answer as a new question
-        7. Always maintain the context of the current problem
-
-        Example of a successful interaction:
-        User: "In order to retain certain key executives, Smiley Corporation granted them incentive stock options on December 31, 2020. 150,000 options were granted at an option price of $35 per share. The options were granted as compensation for executives' services to be rendered over a two-year period beginning January 1, 2021. The Black-Scholes option pricing model determines total compensation expense to be $1,500,000. What amount of compensation expense should Smiley recognize as a result of this plan for the year ended December 31, 2021 under the fair value method?
-        a. $2,625,000.
-        b. $1,650,000.
-        c. $1,500,000.
-        d. $750,000."
-
-        Bot: "Let's solve this step by step by asking guiding questions.
-
-        First question: How long is the total service period for these stock options?"
-
-        User: "2 years"
-
-        Bot: "Excellent! You're correct. The service period is 2 years, from January 1, 2021 to December 31, 2022.
-
-        Second question: What is the total compensation expense determined by the Black-Scholes model?"
-
-        User: "$1,500,000"
-
-        Bot: "Perfect! You're correct. The total compensation expense is $1,500,000.
-
-        Now, let's think about how to allocate this expense. Since the service period is 2 years, we need to recognize the expense over that period.
-
-        Third question: How much of the total compensation expense should be recognized in 2021?"
-
-        User: "$750,000"
-
-        Bot: "Excellent! You're correct. Since the service period is 2 years, we recognize half of the total compensation expense in 2021, which is $1,500,000 ÷ 2 = $750,000.
-
-        So, looking back at the original multiple-choice question:
-        a. $2,625,000
-        b. $1,650,000
-        c. $1,500,000
-        d. $750,000
-
-        Which answer do you think is correct?"
-
-        User: "D"
-
-        Bot: "Excellent work! You've correctly identified that the answer is d. $750,000.
-
-        Let's summarize what we learned:
-        1. The total service period is 2 years
-        2. The total compensation expense is $1,500,000
-        3. Under the fair value method, we recognize the expense evenly over the service period
-        4. For 2021, we recognize half of the total expense: $750,000
-
-        This is a great example of how stock-based compensation expense is recognized under the fair value method. The key is to remember that the expense is recognized over the service period, not all at once.
-
-        Would you like to try another similar problem to reinforce your understanding?"
-
-        Remember: Your goal is to guide students to discover answers themselves through questions. Always maintain a questioning approach that helps students think through the problem themselves."""
-        
-        response = client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1000
-        )
-        
-        print("✅ Received response from OpenAI")
-        return response.choices[0].message.content
+        reminder = []
+        for attempt in range(output_guard.max_regenerations + 1):
+            if attempt:
+                output_guard.record_regeneration()
+                reminder = [REGENERATION_REMINDER]
+            tutor_response, tripped = output_guard.collect(
+                stream_openai_response(user_prompt, (history or []) + reminder, params, deadline),
+                params["max_tokens"]
+            )
+            if not tripped:
+                if not history:
+                    tutor_services.response_cache.put(user_prompt, params, tutor_response)
+                return tutor_response
+            print("🛑 Direct answer detected, cancelled the OpenAI stream")
+        return output_guard.fallback()
+    except ClientDisconnected:
+        raise
     except Exception as e:
         print(f"❌ Error while calling OpenAI: {str(e)}")
         return f"Error: {str(e)}"
 
-@app.route('/chat', methods=['POST'])
+def stream_openai_response(user_prompt, history=None, params=None, deadline=None):
+    """Generator that yields completion deltas from OpenAI as they arrive
+
+    With a deadline, the upstream call is cut off when it passes, and closed
+    as soon as the client is seen to have disconnected. A coalesced stream
+    keeps the deadline of the request that started it.
+    """
+    print("⚡ Streaming request to OpenAI...")
+    print(f"📨 Prompt: {user_prompt}")
+
+    tutor_services = services()
+    params = params or tutor_services.completion_params
+    with span("prompt_build"):
+        messages = tutor_services.build_messages(user_prompt, history)
+    upstream = tutor_services.upstream
+    open_deltas = lambda: upstream.stream_chat(messages, None if deadline is None else deadline.at, **params)
+    if tutor_services.coalescer is None:
+        deltas = open_deltas()
+    else:
+        deltas = tutor_services.coalescer.stream(flight_key(messages, params), open_deltas)
+
+    # Closing this generator early (client gone, guard tripped) closes the upstream stream
+    with span("upstream"):
+        deltas = tutor_services.local_tier.health.watch(deltas)
+        yield from deltas if deadline is None else deadline.watch(deltas)
+    print("✅ Finished streaming response from OpenAI")
+
+def local_stream_response(reply, session_id, tier):
+    """Returns an SSE response carrying a local tier reply as a single delta"""
+    return Response(local_stream_events(reply, session_id, tier), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+def stream_chat_response(user_message, session_id, permit=NO_PERMIT, deadline=None):
+    """Returns an SSE response that forwards completion deltas to the client
+
+    permit is the upstream call slot; it is released when the stream ends.
+    """
+    tutor_services = services()
+    session_store = tutor_services.session_store
+    response_cache = tutor_services.response_cache
+    output_guard = tutor_services.output_guard
+    started = time.perf_counter()
+
+    def generate():
+        history = session_store.get_history(session_id)
+        deltas = []
+        tier = LLM
+        try:
+            with span("cache"):
+                cached = None if history else response_cache.get(user_message, tutor_services.completion_params)
+            if cached is not None:
+                tier = CACHE
+                deltas.append(cached)
+                yield sse_event({"delta": cached})
+            else:
+                params = tutor_services.route_turn(session_id, user_message, history)
+                guarded = output_guard.start(params["max_tokens"])
+                upstream = stream_openai_response(user_message, history, params, deadline)
+                for delta in upstream:
+                    safe = guarded.feed(delta)
+                    if safe:
+                        deltas.append(safe)
+                        yield sse_event({"delta": safe})
+                    if guarded.tripped:
+                        # Stop paying for the rest of the answer and redirect instead
+                        upstream.close()
+                        print("🛑 Direct answer detected, cancelled the OpenAI stream")
+                        redirect = "\n\n" + output_guard.fallback()
+                        deltas.append(redirect)
+                        yield sse_event({"delta": redirect})
+                        break
+                else:
+                    safe = guarded.finish()
+                    if safe:
+                        deltas.append(safe)
+                        yield sse_event({"delta": safe})
+                    if not history:
+                        response_cache.put(user_message, params, "".join(deltas))
+            tutor_services.record_turn(session_id, user_message, "".join(deltas), tier, started)
+            yield sse_event({"status": "success", "session_id": session_id, "tier": tier}, event="done")
+        except ClientDisconnected:
+            print("🔌 Client disconnected, cancelled the OpenAI stream")
+        except Exception as e:
+            print(f"❌ Error while streaming from OpenAI: {str(e)}")
+            # Nothing sent yet: the local tier answers instead
+            fallback = None if deltas else tutor_services.local_fallback(session_id, user_message)
+            if fallback is None:
+                yield sse_event({"error": str(e), "status": "error"}, event="error")
+            else:
+                tutor_services.record_turn(session_id, user_message, fallback, FALLBACK, started)
+                yield sse_event({"delta": fallback})
+                yield sse_event({"status": "success", "session_id": session_id, "tier": FALLBACK}, event="done")
+        finally:
+            permit.release()
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream", headers=SSE_HEADERS)
+    # Also covers a client that disconnects before the stream starts
+    response.call_on_close(permit.release)
+    return response
+
+@tutor.route('/chat', methods=['POST'])
 def chat():
+    tutor_services = services()
+    session_store = tutor_services.session_store
+    started = time.perf_counter()
     try:
         # Get the message from the request
-        data = request.get_json()
+        with span("parse"):
+            data = request.get_json()
         if not data or 'message' not in data:
             return jsonify({"error": "No message provided"}), 400
-        
+
         user_message = data['message']
-        
-        # Get response from OpenAI
-        tutor_response = get_openai_response(user_message)
-        
+        priority = admit(data.get('session_id'))
+        session_id = data.get('session_id') or session_store.new_session_id()
+        deadline = request_deadline()
+
+        # The rule-based tutor answers without calling OpenAI when it can
+        tutor_response, tier = tutor_services.local_turn(session_id, user_message)
+        if tutor_response is not None:
+            tutor_services.record_turn(session_id, user_message, tutor_response, tier, started)
+            if data.get('stream'):
+                return local_stream_response(tutor_response, session_id, tier)
+            return jsonify({
+                "response": tutor_response,
+                "session_id": session_id,
+                "tier": tier,
+                "status": "success"
+            })
+
+        # Stream deltas back as Server-Sent Events when requested
+        if data.get('stream'):
+            return stream_chat_response(user_message, session_id, upstream_permit(priority, deadline), deadline)
+
+        # Only first turns are cacheable; later ones depend on the conversation so far
+        history = session_store.get_history(session_id)
+        with span("cache"):
+            tutor_response = None if history else tutor_services.response_cache.get(
+                user_message, tutor_services.completion_params)
+
+        # Get response from OpenAI, continuing the stored conversation
+        tier = CACHE
+        if tutor_response is None:
+            tier = LLM
+            params = tutor_services.route_turn(session_id, user_message, history)
+            with upstream_permit(priority, deadline):
+                tutor_response = get_openai_response(user_message, history, params, deadline)
+            if tutor_response.startswith("Error: "):
+                fallback = tutor_services.local_fallback(session_id, user_message)
+                if fallback is not None:
+                    tutor_response, tier = fallback, FALLBACK
+        if not tutor_response.startswith("Error: "):
+            tutor_services.record_turn(session_id, user_message, tutor_response, tier, started)
+
         # Return the response as JSON
         return jsonify({
             "response": tutor_response,
+            "session_id": session_id,
+            "tier": tier,
             "status": "success"
         })
-        
+
+    except RateLimited as e:
+        return rate_limited_response(e)
+    except ClientDisconnected as e:
+        # Nobody reads this; 499 is what nginx logs for a client that closed the request
+        print("🔌 Client disconnected, cancelled the OpenAI call")
+        return jsonify({"error": str(e), "status": "cancelled"}), 499
     except Exception as e:
         return jsonify({
             "error": str(e),
             "status": "error"
         }), 500
 
-@app.route('/health', methods=['GET'])
+@tutor.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    with span("parse"):
+        data = request.get_json()
+    if not data or 'message' not in data:
+        return jsonify({"error": "No message provided"}), 400
+
+    tutor_services = services()
+    started = time.perf_counter()
+    try:
+        priority = admit(data.get('session_id'))
+        session_id = data.get('session_id') or tutor_services.session_store.new_session_id()
+        reply, tier = tutor_services.local_turn(session_id, data['message'])
+        if reply is not None:
+            tutor_services.record_turn(session_id, data['message'], reply, tier, started)
+            return local_stream_response(reply, session_id, tier)
+        deadline = request_deadline()
+        permit = upstream_permit(priority, deadline)
+    except RateLimited as e:
+        return rate_limited_response(e)
+    return stream_chat_response(data['message'], session_id, permit, deadline)
+
+# The rule-based tutor on its own: never calls OpenAI, whatever the message
+@tutor.route('/tutor', methods=['POST'])
+def rule_tutor():
+    started = time.perf_counter()
+    with span("parse"):
+        data = request.get_json()
+    if not data or 'message' not in data:
+        return jsonify({"error": "No message provided"}), 400
+
+    tutor_services = services()
+    session_id = data.get('session_id') or tutor_services.session_store.new_session_id()
+    tutor_response, state = tutor_services.rule_turn(session_id, data['message'])
+    tutor_services.record_turn(session_id, data['message'], tutor_response, LOCAL, started)
+    return jsonify({
+        "response": tutor_response,
+        "session_id": session_id,
+        "conversation_state": state.state.label,
+        "topic": None if state.topic is None else TOPICS[state.topic],
+        "status": "success"
+    })
+
+@tutor.route('/stats', methods=['GET'])
+def stats():
+    return jsonify(services().stats()), 200
+
+@tutor.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@tutor.route('/traces', methods=['GET'])
+def traces():
+    return jsonify(list(metrics.RECENT_TRACES)), 200
+
+@tutor.route('/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "healthy"}), 200
 
+def create_app(config=None):
+    """Builds the tutoring Flask app
+
+    config overrides DEFAULT_CONFIG, which is otherwise read from the
+    environment (and .env). Components such as the session store and the
+    response cache keep reading their own environment variables.
+    """
+    # Load environment variables
+    load_dotenv()
+    settings = {key: os.getenv(key, default) for key, default in DEFAULT_CONFIG.items()}
+    if isinstance(settings["CORS_ENABLED"], str):
+        settings["CORS_ENABLED"] = settings["CORS_ENABLED"].lower() == "true"
+    settings.update(config or {})
+
+    if not settings["OPENAI_API_KEY"]:
+        raise ValueError("❌ ERROR: OPENAI_API_KEY is not set! Check your environment variables.")
+
+    app = Flask(__name__)
+    app.config.update(settings)
+    if settings["CORS_ENABLED"]:
+        from flask_cors import CORS
+        CORS(app)  # Enable CORS for all routes
+    app.extensions["nuanswers"] = TutorServices(settings["OPENAI_API_KEY"])
+    app.before_request(start_trace)
+    app.after_request(finish_trace)
+    app.register_blueprint(tutor)
+    return app
+
+# `gunicorn app:app`; gunicorn_config.py preloads it in the master
+app = create_app()
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000) 
+    app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,384 @@
+import os
+import asyncio
+import math
+import time
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from guard import REGENERATION_REMINDER
+from coalesce import flight_key
+from ratelimit import NO_PERMIT, RateLimited, client_ip
+from deadlines import DEADLINE_HEADER, ClientDisconnected
+from local_tier import CACHE, FALLBACK, LLM, LOCAL
+from tutor_services import SSE_HEADERS, TutorServices, local_stream_events, sse_event
+from NuAnswers import TOPICS
+import metrics
+from metrics import UPSTREAM_CANCELLED, span
+
+# Load environment variables
+load_dotenv()
+
+# Get OpenAI API key
+api_key = os.getenv("OPENAI_API_KEY")
+
+if not api_key:
+    raise ValueError("❌ ERROR: OPENAI_API_KEY is not set! Check your environment variables.")
+
+# The same tutor content, stores and tiers as the Flask app, with the asyncio
+# coalescer, admission queue and upstream client
+services = TutorServices(api_key, asynchronous=True)
+
+async def admit(request, session_id):
+    """Spends the client's rate-limit tokens; returns its upstream queue priority"""
+    admission = services.admission
+    if admission is None:
+        return None
+    remote_addr = request.client.host if request.client else None
+    return await admission.acheck(session_id, client_ip(remote_addr, request.headers.get("x-forwarded-for")))
+
+async def upstream_permit(priority, deadline=None):
+    """Waits briefly for an upstream call slot; raises RateLimited if none frees up in time"""
+    admission = services.admission
+    if admission is None:
+        return NO_PERMIT
+    with span("admission"):
+        return await admission.acquire(priority, None if deadline is None else deadline.at)
+
+async def until_disconnected(request, awaitable):
+    """Awaits awaitable; cancels it, and the upstream call under it, if the client disconnects first
+
+    The body has been read by then, so the next ASGI message is the
+    disconnect. Raises ClientDisconnected when it comes first.
+    """
+    async def disconnected():
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(disconnected())
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+    if not task.done():
+        task.cancel()
+        # Let it close the upstream stream and release its permit before answering
+        await asyncio.gather(task, return_exceptions=True)
+        UPSTREAM_CANCELLED.labels("disconnect").inc()
+        raise ClientDisconnected("Client disconnected before the reply was ready")
+    return task.result()
+
+def rate_limited_response(error):
+    return JSONResponse({"error": str(error), "status": "rate_limited"}, status_code=429,
+                        headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))})
+
+async def collect_guarded(deltas, max_tokens):
+    """Async counterpart of OutputGuard.collect; returns (text, tripped)"""
+    guarded = services.output_guard.start(max_tokens)
+    async for delta in deltas:
+        guarded.feed(delta)
+        if guarded.tripped:
+            await deltas.aclose()
+            return guarded.text, True
+    guarded.finish()
+    return guarded.text, False
+
+async def get_openai_response(user_prompt, history=None, params=None, deadline=None):
+    """Function to get response from OpenAI API without blocking the event loop
+
+    The completion is streamed through the output guard so a direct answer
+    cancels the upstream call straight away. It is then regenerated with a
+    reminder, or replaced by a redirecting question. Clean first-turn
+    responses are added to the response cache. Regenerations share the
+    request's deadline.
+    """
+    output_guard = services.output_guard
+    params = params or services.completion_params
+    try:
+        reminder = []
+        for attempt in range(output_guard.max_regenerations + 1):
+            if attempt:
+                output_guard.record_regeneration()
+                reminder = [REGENERATION_REMINDER]
+            tutor_response, tripped = await collect_guarded(
+                stream_openai_response(user_prompt, (history or []) + reminder, params, deadline),
+                params["max_tokens"]
+            )
+            if not tripped:
+                if not history:
+                    services.response_cache.put(user_prompt, params, tutor_response)
+                return tutor_response
+            print("🛑 Direct answer detected, cancelled the OpenAI stream")
+        return output_guard.fallback()
+    except Exception as e:
+        print(f"❌ Error while calling OpenAI: {str(e)}")
+        return f"Error: {str(e)}"
+
+async def stream_openai_response(user_prompt, history=None, params=None, deadline=None):
+    """Async generator that yields completion deltas from OpenAI as they arrive
+
+    With a deadline, the upstream call is cut off when it passes. A
+    coalesced stream keeps the deadline of the request that started it.
+    """
+    print("⚡ Streaming request to OpenAI...")
+    print(f"📨 Prompt: {user_prompt}")
+    
+    params = params or services.completion_params
+    with span("prompt_build"):
+        messages = services.build_messages(user_prompt, history)
+    upstream = services.upstream
+    open_deltas = lambda: upstream.stream_chat(messages, None if deadline is None else deadline.at, **params)
+    if services.coalescer is None:
+        deltas = open_deltas()
+    else:
+        deltas = services.coalescer.stream(flight_key(messages, params), open_deltas)
+    
+    # Closing this generator early (client gone, guard tripped) closes the upstream stream
+    try:
+        with span("upstream"):
+            async for delta in services.local_tier.health.awatch(deltas):
+                yield delta
+        print("✅ Finished streaming response from OpenAI")
+    finally:
+        await deltas.aclose()
+
+def local_stream_response(reply, session_id, tier):
+    """Returns an SSE response carrying a local tier reply as a single delta"""
+    return Response("".join(local_stream_events(reply, session_id, tier)), media_type="text/event-stream",
+                    headers=SSE_HEADERS)
+
+def stream_chat_response(user_message, session_id, permit=NO_PERMIT, deadline=None):
+    """Returns an SSE response that forwards completion deltas to the client
+
+    permit is the upstream call slot; it is released when the stream ends.
+    Starlette closes the generator, and so the upstream stream, when the
+    client disconnects.
+    """
+    session_store = services.session_store
+    response_cache = services.response_cache
+    output_guard = services.output_guard
+    started = time.perf_counter()
+
+    async def generate():
+        history = session_store.get_history(session_id)
+        deltas = []
+        tier = LLM
+        try:
+            with span("cache"):
+                cached = None if history else response_cache.get(user_message, services.completion_params)
+            if cached is not None:
+                tier = CACHE
+                deltas.append(cached)
+                yield sse_event({"delta": cached})
+            else:
+                params = services.route_turn(session_id, user_message, history)
+                guarded = output_guard.start(params["max_tokens"])
+                upstream = stream_openai_response(user_message, history, params, deadline)
+                async for delta in upstream:
+                    safe = guarded.feed(delta)
+                    if safe:
+                        deltas.append(safe)
+                        yield sse_event({"delta": safe})
+                    if guarded.tripped:
+                        # Stop paying for the rest of the answer and redirect instead
+                        await upstream.aclose()
+                        print("🛑 Direct answer detected, cancelled the OpenAI stream")
+                        redirect = "\n\n" + output_guard.fallback()
+                        deltas.append(redirect)
+                        yield sse_event({"delta": redirect})
+                        break
+                else:
+                    safe = guarded.finish()
+                    if safe:
+                        deltas.append(safe)
+                        yield sse_event({"delta": safe})
+                    if not history:
+                        response_cache.put(user_message, params, "".join(deltas))
+            services.record_turn(session_id, user_message, "".join(deltas), tier, started)
+            yield sse_event({"status": "success", "session_id": session_id, "tier": tier}, event="done")
+        except Exception as e:
+            print(f"❌ Error while streaming from OpenAI: {str(e)}")
+            # Nothing sent yet: the local tier answers instead
+            fallback = None if deltas else services.local_fallback(session_id, user_message)
+            if fallback is None:
+                yield sse_event({"error": str(e), "status": "error"}, event="error")
+            else:
+                services.record_turn(session_id, user_message, fallback, FALLBACK, started)
+                yield sse_event({"delta": fallback})
+                yield sse_event({"status": "success", "session_id": session_id, "tier": FALLBACK}, event="done")
+        finally:
+            permit.release()
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+        # Also covers a stream that never started
+        background=BackgroundTask(permit.release)
+    )
+
+async def read_message(request):
+    """Returns the parsed JSON body if it carries a message, else None"""
+    try:
+        with span("parse"):
+            data = await request.json()
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or 'message' not in data:
+        return None
+    return data
+
+async def chat(request: Request):
+    session_store = services.session_store
+    started = time.perf_counter()
+    try:
+        # Get the message from the request
+        data = await read_message(request)
+        if data is None:
+            return JSONResponse({"error": "No message provided"}, status_code=400)
+        
+        user_message = data['message']
+        priority = await admit(request, data.get('session_id'))
+        session_id = data.get('session_id') or session_store.new_session_id()
+        deadline = services.deadlines.start(request.headers.get(DEADLINE_HEADER))
+        
+        # The rule-based tutor answers without calling OpenAI when it can
+        tutor_response, tier = services.local_turn(session_id, user_message)
+        if tutor_response is not None:
+            services.record_turn(session_id, user_message, tutor_response, tier, started)
+            if data.get('stream'):
+                return local_stream_response(tutor_response, session_id, tier)
+            return JSONResponse({
+                "response": tutor_response,
+                "session_id": session_id,
+                "tier": tier,
+                "status": "success"
+            })
+        
+        # Stream deltas back as Server-Sent Events when requested
+        if data.get('stream'):
+            return stream_chat_response(user_message, session_id, await upstream_permit(priority, deadline), deadline)
+        
+        # Only first turns are cacheable; later ones depend on the conversation so far
+        history = session_store.get_history(session_id)
+        with span("cache"):
+            tutor_response = None if history else services.response_cache.get(
+                user_message, services.completion_params)
+        
+        # Get response from OpenAI, continuing the stored conversation
+        tier = CACHE
+        if tutor_response is None:
+            tier = LLM
+            params = services.route_turn(session_id, user_message, history)
+
+            # With a deadline, a client that hangs up gives up its place or slot and stops the upstream call
+            async def call_upstream():
+                with await upstream_permit(priority, deadline):
+                    return await get_openai_response(user_message, history, params, deadline)
+            if deadline is None:
+                tutor_response = await call_upstream()
+            else:
+                tutor_response = await until_disconnected(request, call_upstream())
+            if tutor_response.startswith("Error: "):
+                fallback = services.local_fallback(session_id, user_message)
+                if fallback is not None:
+                    tutor_response, tier = fallback, FALLBACK
+        if not tutor_response.startswith("Error: "):
+            services.record_turn(session_id, user_message, tutor_response, tier, started)
+        
+        # Return the response as JSON
+        return JSONResponse({
+            "response": tutor_response,
+            "session_id": session_id,
+            "tier": tier,
+            "status": "success"
+        })
+        
+    except RateLimited as e:
+        return rate_limited_response(e)
+    except ClientDisconnected as e:
+        # Nobody reads this; 499 is what nginx logs for a client that closed the request
+        print("🔌 Client disconnected, cancelled the OpenAI call")
+        return JSONResponse({"error": str(e), "status": "cancelled"}, status_code=499)
+    except Exception as e:
+        return JSONResponse({
+            "error": str(e),
+            "status": "error"
+        }, status_code=500)
+
+async def chat_stream(request: Request):
+    data = await read_message(request)
+    if data is None:
+        return JSONResponse({"error": "No message provided"}, status_code=400)
+    
+    started = time.perf_counter()
+    try:
+        priority = await admit(request, data.get('session_id'))
+        session_id = data.get('session_id') or services.session_store.new_session_id()
+        reply, tier = services.local_turn(session_id, data['message'])
+        if reply is not None:
+            services.record_turn(session_id, data['message'], reply, tier, started)
+            return local_stream_response(reply, session_id, tier)
+        deadline = services.deadlines.start(request.headers.get(DEADLINE_HEADER))
+        permit = await upstream_permit(priority, deadline)
+    except RateLimited as e:
+        return rate_limited_response(e)
+    return stream_chat_response(data['message'], session_id, permit, deadline)
+
+# The rule-based tutor on its own: never calls OpenAI, whatever the message
+async def rule_tutor(request: Request):
+    started = time.perf_counter()
+    data = await read_message(request)
+    if data is None:
+        return JSONResponse({"error": "No message provided"}, status_code=400)
+    
+    session_id = data.get('session_id') or services.session_store.new_session_id()
+    tutor_response, state = services.rule_turn(session_id, data['message'])
+    services.record_turn(session_id, data['message'], tutor_response, LOCAL, started)
+    return JSONResponse({
+        "response": tutor_response,
+        "session_id": session_id,
+        "conversation_state": state.state.label,
+        "topic": None if state.topic is None else TOPICS[state.topic],
+        "status": "success"
+    })
+
+async def stats(request: Request):
+    return JSONResponse(services.stats())
+
+async def metrics_endpoint(request: Request):
+    return Response(metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+async def traces(request: Request):
+    return JSONResponse(list(metrics.RECENT_TRACES))
+
+async def health_check(request: Request):
+    return JSONResponse({"status": "healthy"})
+
+app = Starlette(
+    routes=[
+        Route('/chat', chat, methods=['POST']),
+        Route('/chat/stream', chat_stream, methods=['POST']),
+        Route('/tutor', rule_tutor, methods=['POST']),
+        Route('/stats', stats, methods=['GET']),
+        Route('/metrics', metrics_endpoint, methods=['GET']),
+        Route('/traces', traces, methods=['GET']),
+        Route('/health', health_check, methods=['GET']),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+        Middleware(metrics.TracingMiddleware)
+    ]
+)
+# gunicorn's post_fork hook finds the services here, as it does in the Flask app's extensions
+app.state.nuanswers = services
+
+if __name__ == '__main__':
+    import uvicorn
+    metrics.REGISTRY.start_sharing()
+    uvicorn.run(app, host='0.0.0.0', port=5000)
@@ -0,0 +1,108 @@
+"""Replays recorded student transcripts through the rule-based tutor in bulk.
+
+Reads JSON Lines transcripts, one per line:
+    {"id": "s-001", "turns": ["I need help with ratios", "..."], "seed": 7}
+and writes one JSON line per transcript, in input order, with the tutor's
+replies and its final state. "seed" is optional; without it a seed is derived
+from --seed and the transcript id, so reruns are identical regardless of
+which worker process replays a transcript.
+
+Usage: python batch_grade.py transcripts.jsonl -o graded.jsonl --workers 8
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from NuAnswers import AccountingFinanceTutor
+
+def transcript_seed(record, base_seed):
+    """Deterministic per-transcript seed"""
+    if record.get("seed") is not None:
+        return record["seed"]
+    return zlib.crc32(f"{base_seed}:{record.get('id')}".encode())
+
+def replay_transcript(record, base_seed=0):
+    """Runs one transcript through a fresh tutor and returns its graded record"""
+    tutor = AccountingFinanceTutor(seed=transcript_seed(record, base_seed))
+    turns = []
+    for student_turn in record.get("turns", []):
+        state_before = tutor.conversation_state
+        tutor_reply = tutor.evaluate_response(student_turn)
+        turns.append({
+            "student": student_turn,
+            "tutor": tutor_reply,
+            "state": state_before,
+            "topic": tutor.current_topic,
+            "question_index": tutor.current_question_index,
+            "hints_given": tutor.hints_given
+        })
+    return {
+        "id": record.get("id"),
+        "turns": turns,
+        "final_state": {
+            "conversation_state": tutor.conversation_state,
+            "topic": tutor.current_topic,
+            "question_index": tutor.current_question_index,
+            "hints_given": tutor.hints_given
+        }
+    }
+
+def _replay_batch(lines, base_seed):
+    """Worker entry point: parses, replays and serialises a batch of JSONL lines"""
+    out = []
+    for line in lines:
+        try:
+            out.append(json.dumps(replay_transcript(json.loads(line), base_seed)))
+        except (ValueError, TypeError, AttributeError) as e:
+            out.append(json.dumps({"error": f"Invalid transcript: {e}", "line": line.rstrip("\n")}))
+    return out
+
+def grade_lines(lines, workers=None, batch_size=200, base_seed=0):
+    """Yields graded JSON lines in input order, keeping memory bounded
+
+    Batches are sent to a process pool with at most two batches per worker in
+    flight, so arbitrarily large inputs stream through.
+    """
+    lines = (line for line in lines if line.strip())
+    batches = iter(lambda: list(itertools.islice(lines, batch_size)), [])
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for batch in batches:
+            yield from _replay_batch(batch, base_seed)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.submit(_replay_batch, batch, base_seed))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", nargs="?", default="-", help="transcripts JSONL file, or - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="graded JSONL file, or - for stdout")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=200, help="transcripts per task sent to a worker")
+    parser.add_argument("--seed", type=int, default=0, help="base seed for transcripts without one")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == "-" else open(args.input)
+    sink = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        for line in grade_lines(source, args.workers, args.batch_size, args.seed):
+            sink.write(line + "\n")
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+
+if __name__ == "__main__":
+    main()
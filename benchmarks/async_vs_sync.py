@@ -0,0 +1,82 @@
+"""Load benchmark of the sync Flask workers versus the asyncio ASGI worker.
+
+Both deployments run under gunicorn against the same fake upstream, and are
+driven with the same number of concurrent clients.
+
+Usage: python benchmarks/async_vs_sync.py [--concurrency 200] [--requests 1000]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import bench_util
+import fake_openai
+
+import httpx
+
+DEPLOYMENTS = {
+    "sync": {"module": "app:app", "worker_class": "sync", "workers": "4"},
+    "asgi": {"module": "asgi_app:app", "worker_class": "uvicorn.workers.UvicornWorker", "workers": "1"},
+}
+
+
+async def drive(url, concurrency, total):
+    """Sends `total` /chat requests with `concurrency` clients in flight"""
+    latencies, errors = [], 0
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(i)
+
+    async def student(client):
+        nonlocal errors
+        while not queue.empty():
+            i = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                response = await client.post(f"{url}/chat", json={"message": f"What is a current ratio? ({i})"})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+            except httpx.HTTPError as e:
+                errors += 1
+                print(f"❌ {type(e).__name__}: {e}")
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=300) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(student(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    result = bench_util.summarize(latencies)
+    result.update({"requests_per_sec": round(len(latencies) / elapsed, 2), "errors": errors})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--tokens", type=int, default=50)
+    args = parser.parse_args()
+
+    upstream, upstream_url = fake_openai.start_in_subprocess(
+        latency=args.latency, token_delay=0.0, tokens=args.tokens)
+    results = {}
+    try:
+        for name, deployment in DEPLOYMENTS.items():
+            process, url = bench_util.start_gunicorn(
+                deployment["module"], deployment["worker_class"], deployment["workers"],
+                fake_openai.free_port(), upstream_url)
+            try:
+                results[name] = asyncio.run(drive(url, args.concurrency, args.requests))
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        upstream.terminate()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Throughput of batch transcript grading as worker processes are added.
+
+Usage: python benchmarks/batch_grade.py [--transcripts 20000] [--workers 1,2,4,8]
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+import bench_util  # noqa: F401  (puts the repo root on sys.path)
+
+from batch_grade import grade_lines
+
+TURNS = [
+    "I need help with the accounting equation",
+    "can we look at financial ratios",
+    "what is present value and interest",
+    "because assets increase, liabilities increase too since the transaction is on credit",
+    "I think the ratio divides current assets by liabilities, therefore liquidity improves",
+    "not sure",
+    "practice hard",
+    "hint",
+    "if we assume the interest rate is 5% then the future value grows",
+    "I don't know",
+]
+
+
+def make_transcripts(count, seed=1):
+    rng = random.Random(seed)
+    return [json.dumps({"id": f"s-{i}", "turns": rng.choices(TURNS, k=rng.randint(4, 12))})
+            for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--transcripts", type=int, default=20000)
+    parser.add_argument("--workers", default=",".join(str(w) for w in (1, 2, 4, 8) if w <= (os.cpu_count() or 1)))
+    args = parser.parse_args()
+
+    lines = make_transcripts(args.transcripts)
+    results = {"cpu_count": os.cpu_count(), "transcripts": args.transcripts, "runs": {}}
+    reference = None
+    for workers in [int(w) for w in args.workers.split(",")]:
+        start = time.perf_counter()
+        graded = list(grade_lines(lines, workers=workers))
+        elapsed = time.perf_counter() - start
+        # Seeded replays must not depend on how the work was split
+        reference = reference or graded
+        assert graded == reference
+        results["runs"][workers] = {"seconds": round(elapsed, 3),
+                                    "transcripts_per_sec": round(len(graded) / elapsed, 1)}
+    base = results["runs"][min(results["runs"])]["transcripts_per_sec"]
+    for run in results["runs"].values():
+        run["speedup"] = round(run["transcripts_per_sec"] / base, 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
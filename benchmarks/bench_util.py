@@ -0,0 +1,82 @@
+"""Shared helpers for the benchmark scripts."""
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+# Make the repo root importable when running `python benchmarks/<script>.py`
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def use_fake_upstream(base_url):
+    """Points the OpenAI client at a fake upstream; call before importing app"""
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake-benchmark-key")
+
+
+def serve_wsgi_in_thread(wsgi_app, port, ssl_context=None):
+    """Serves a WSGI app with a threaded werkzeug server and returns its URL
+
+    ssl_context is a (certificate, key) pair of file paths to serve HTTPS.
+    """
+    server = make_server("127.0.0.1", port, wsgi_app, threaded=True, ssl_context=ssl_context)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"{'https' if ssl_context else 'http'}://127.0.0.1:{port}"
+
+
+def start_gunicorn(module, worker_class, workers, port, upstream_url, threads=1, env_overrides=None,
+                   cwd=REPO_ROOT, config="gunicorn_config.py", stderr=subprocess.DEVNULL, ssl=None):
+    """Starts gunicorn with a config file (gunicorn_config.py) against a fake upstream and waits for /health
+
+    ssl is a (certificate, key) pair of file paths to serve HTTPS.
+    Returns (process, base URL).
+    """
+    import httpx
+
+    command = [sys.executable, "-m", "gunicorn", "-c", config, module]
+    if ssl:
+        command[-1:-1] = ["--certfile", ssl[0], "--keyfile", ssl[1]]
+    env = dict(os.environ,
+               OPENAI_BASE_URL=upstream_url,
+               OPENAI_API_KEY="sk-fake-benchmark-key",
+               GUNICORN_BIND=f"127.0.0.1:{port}",
+               GUNICORN_WORKERS=str(workers),
+               GUNICORN_THREADS=str(threads),
+               GUNICORN_WORKER_CLASS=worker_class)
+    env.update(env_overrides or {})
+    process = subprocess.Popen(command, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=stderr)
+    url = f"{'https' if ssl else 'http'}://127.0.0.1:{port}"
+    for _ in range(400):
+        try:
+            if httpx.get(f"{url}/health", verify=ssl[0] if ssl else True).status_code == 200:
+                return process, url
+        except httpx.TransportError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"gunicorn did not start for {module} ({worker_class} x{workers})")
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    """Returns p50/p95/p99/mean of a list of latencies in milliseconds"""
+    return {
+        "count": len(values),
+        "mean_ms": round(1000 * sum(values) / len(values), 3) if values else float("nan"),
+        "p50_ms": round(1000 * percentile(values, 50), 3),
+        "p95_ms": round(1000 * percentile(values, 95), 3),
+        "p99_ms": round(1000 * percentile(values, 99), 3),
+    }
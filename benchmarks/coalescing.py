@@ -0,0 +1,101 @@
+"""Upstream calls and latency for bursts of identical prompts, with and without coalescing.
+
+Each round sends a burst of concurrent /chat requests carrying the same new
+problem to a slow fake upstream, and counts how many upstream calls it made.
+The in-worker run uses a threaded server; the cross-worker run uses gunicorn
+sync workers sharing the file-based coalescer.
+
+Usage: python benchmarks/coalescing.py [--burst 40] [--rounds 5]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bench_util
+import fake_openai
+
+import requests
+
+
+def upstream_requests(base_url):
+    return requests.get(f"{base_url}/fake/stats").json()["requests"]
+
+
+def burst(url, base_url, size, rounds):
+    """Sends `rounds` bursts of `size` identical prompts; returns latency and upstream calls"""
+    latencies = []
+    before = upstream_requests(base_url)
+
+    def one(prompt):
+        start = time.perf_counter()
+        requests.post(f"{url}/chat", json={"message": prompt}).raise_for_status()
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=size) as pool:
+        for i in range(rounds):
+            prompt = f"Problem {time.time_ns()}-{i}: how does issuing common stock affect equity?"
+            latencies.extend(pool.map(one, [prompt] * size))
+    result = bench_util.summarize(latencies)
+    result["requests"] = size * rounds
+    result["upstream_calls"] = upstream_requests(base_url) - before
+    return result
+
+
+def start_gunicorn(port, base_url, workers, coalesce_dir):
+    env = dict(os.environ, OPENAI_BASE_URL=base_url, OPENAI_API_KEY="sk-fake-benchmark-key",
+               GUNICORN_BIND=f"127.0.0.1:{port}", GUNICORN_WORKERS=str(workers),
+               COALESCE_BACKEND="file", COALESCE_DIR=coalesce_dir)
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn_config.py", "app:app"],
+                               cwd=bench_util.REPO_ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try:
+            requests.get(f"{url}/health")
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("gunicorn did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--burst", type=int, default=40)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=2.0)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    upstream, base_url = fake_openai.start_in_subprocess(latency=args.latency, token_delay=0.01, tokens=50)
+    bench_util.use_fake_upstream(base_url)
+    import app
+    from coalesce import SingleFlight
+
+    results = {}
+    try:
+        url = bench_util.serve_wsgi_in_thread(app.app, fake_openai.free_port())
+        for name, coalescer in (("off", None), ("in_worker", SingleFlight())):
+            app.app.extensions["nuanswers"].coalescer = coalescer
+            results[name] = burst(url, base_url, args.burst, args.rounds)
+
+        with tempfile.TemporaryDirectory() as coalesce_dir:
+            process, url = start_gunicorn(fake_openai.free_port(), base_url, args.workers, coalesce_dir)
+            try:
+                # Sync workers serve one request each, so the burst is one per worker
+                results[f"across_{args.workers}_workers"] = burst(url, base_url, args.workers, args.rounds)
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        upstream.terminate()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Local fake of the OpenAI chat-completions API for benchmarks.
+
+Run standalone with `python benchmarks/fake_openai.py --port 8900` and point
+the app at it with OPENAI_BASE_URL=http://127.0.0.1:8900/v1.
+"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+DEFAULT_CONFIG = {
+    "latency": 0.5,       # seconds before the first token is produced
+    "token_delay": 0.02,  # seconds between streamed tokens
+    "tokens": 200,        # tokens per completion
+    "answer_rate": 0.0,   # fraction of completions that give the answer away part-way
+    "error_rate": 0.0,    # fraction of requests answered with a 429 or 500
+    "slow_rate": 0.0,     # fraction of requests that stall before the first token
+    "slow_latency": 5.0,  # extra seconds a stalled request waits
+    "prefill_delay": 0.0, # seconds per prompt token (chars/4) before the first token
+}
+
+FILLER = "Let's think about this step by step. What do you think the first step should be?"
+DIRECT_ANSWER = "So the answer is d. $750,000."
+
+
+def completion_tokens(count, give_answer=False):
+    """Builds a list of fake completion tokens, optionally stating the answer a third of the way in"""
+    words = FILLER.split()
+    tokens = [words[i % len(words)] + " " for i in range(count)]
+    if give_answer:
+        at = count // 3
+        answer = [word + " " for word in DIRECT_ANSWER.split()]
+        tokens[at:at + len(answer)] = answer
+        del tokens[count:]
+    return tokens
+
+
+def create_app(config=None):
+    """Creates the fake upstream Starlette app"""
+    settings = dict(DEFAULT_CONFIG, **(config or {}))
+    # tokens_sent and cancelled (streams the client closed before the end) show what cancellation saves
+    counters = {"requests": 0, "models": {}, "streaming": 0, "completed": 0, "cancelled": 0, "tokens_sent": 0}
+
+    async def chat_completions(request):
+        body = await request.json()
+        counters["requests"] += 1
+        counters["models"][body.get("model")] = counters["models"].get(body.get("model"), 0) + 1
+        if random.random() < settings["error_rate"]:
+            status = random.choice([429, 500])
+            return JSONResponse({"error": {"message": "Injected fault", "type": "fake", "code": status}},
+                                status_code=status)
+        latency = settings["latency"]
+        if random.random() < settings["slow_rate"]:
+            latency += settings["slow_latency"]
+        prompt_tokens = sum(len(m.get("content") or "") for m in body.get("messages", [])) // 4
+        latency += settings["prefill_delay"] * prompt_tokens
+        tokens = completion_tokens(min(settings["tokens"], body.get("max_tokens") or settings["tokens"]),
+                                   give_answer=random.random() < settings["answer_rate"])
+        created = int(time.time())
+        model = body.get("model", "gpt-4-turbo-preview")
+
+        if not body.get("stream"):
+            await asyncio.sleep(latency + settings["token_delay"] * len(tokens))
+            return JSONResponse({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop"
+                }],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                          "total_tokens": prompt_tokens + len(tokens)}
+            })
+
+        async def events():
+            counters["streaming"] += 1
+            finished = False
+            try:
+                await asyncio.sleep(latency)
+                for token in tokens:
+                    chunk = {
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    counters["tokens_sent"] += 1
+                    await asyncio.sleep(settings["token_delay"])
+                yield "data: [DONE]\n\n"
+                finished = True
+            finally:
+                counters["streaming"] -= 1
+                counters["completed" if finished else "cancelled"] += 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def stats(request):
+        return JSONResponse(counters)
+
+    return Starlette(routes=[
+        Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+        Route("/v1/fake/stats", stats, methods=["GET"]),
+    ])
+
+
+def free_port():
+    """Returns a free localhost TCP port"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_in_thread(port=None, **config):
+    """Starts the fake upstream on a background thread and returns its base URL"""
+    port = port or free_port()
+    server = uvicorn.Server(uvicorn.Config(create_app(config), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}/v1"
+
+
+def start_in_subprocess(port=None, **config):
+    """Starts the fake upstream in its own process; returns (process, base URL)"""
+    port = port or free_port()
+    settings = dict(DEFAULT_CONFIG, **config)
+    command = [sys.executable, __file__, "--port", str(port),
+               "--latency", str(settings["latency"]),
+               "--token-delay", str(settings["token_delay"]),
+               "--tokens", str(settings["tokens"]),
+               "--answer-rate", str(settings["answer_rate"]),
+               "--error-rate", str(settings["error_rate"]),
+               "--slow-rate", str(settings["slow_rate"]),
+               "--slow-latency", str(settings["slow_latency"]),
+               "--prefill-delay", str(settings["prefill_delay"])]
+    process = subprocess.Popen(command)
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return process, f"http://127.0.0.1:{port}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=DEFAULT_CONFIG["latency"])
+    parser.add_argument("--token-delay", type=float, default=DEFAULT_CONFIG["token_delay"])
+    parser.add_argument("--tokens", type=int, default=DEFAULT_CONFIG["tokens"])
+    parser.add_argument("--answer-rate", type=float, default=DEFAULT_CONFIG["answer_rate"])
+    parser.add_argument("--error-rate", type=float, default=DEFAULT_CONFIG["error_rate"])
+    parser.add_argument("--slow-rate", type=float, default=DEFAULT_CONFIG["slow_rate"])
+    parser.add_argument("--slow-latency", type=float, default=DEFAULT_CONFIG["slow_latency"])
+    parser.add_argument("--prefill-delay", type=float, default=DEFAULT_CONFIG["prefill_delay"])
+    args = parser.parse_args()
+    config = {"latency": args.latency, "token_delay": args.token_delay, "tokens": args.tokens,
+              "answer_rate": args.answer_rate, "error_rate": args.error_rate,
+              "slow_rate": args.slow_rate, "slow_latency": args.slow_latency,
+              "prefill_delay": args.prefill_delay}
+    uvicorn.run(create_app(config), host="127.0.0.1", port=args.port, log_level="warning")
@@ -0,0 +1,132 @@
+"""Per-turn client latency of the Streamlit frontend, before and after pooling its HTTP session.
+
+Serves the Flask app with gunicorn gthread workers over HTTPS (a throwaway
+self-signed certificate, so every new connection pays a real TLS handshake;
+gthread keeps connections alive like the TLS proxy of a hosted deployment)
+in front of the fake upstream, then holds the same conversation through:
+- before: frontend.py as of --baseline-rev, one requests.post per turn.
+  Its hard-coded backend URL is swapped for the local server.
+- after: the current frontend.py, pooled session and chat history,
+  pointed at the server with NUANSWERS_BACKEND_URL
+
+Both run in Streamlit's AppTest, so a turn is the whole script rerun that
+sends the message and renders the streamed reply. The raw HTTP cost
+without Streamlit is measured too: a new connection per turn against one
+pooled session.
+
+Usage: python benchmarks/frontend_latency.py [--turns 20] [--baseline-rev HEAD~1]
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import tempfile
+import time
+
+import bench_util
+import fake_openai
+
+import requests
+from streamlit.testing.v1 import AppTest
+
+# Turns the local tier answers in well under a millisecond, so the time is the client's and the connection's
+OPENING = "financial ratios please"
+ANSWERS = ["The ratio divides current assets by current liabilities, so if it is above one then liquidity is good",
+           "I think leverage is a ratio of debt to equity because it shows risk, therefore lower is safer",
+           "Profitability ratio is net income divided by sales, since that gives the percentage kept"]
+
+
+def self_signed_certificate(directory):
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+                    "-keyout", key, "-out", cert], check=True, capture_output=True)
+    return cert, key
+
+
+def message(turn):
+    return OPENING if turn == 0 else f"{ANSWERS[turn % len(ANSWERS)]} ({turn})"
+
+
+def time_turns(app_test, send, turns):
+    app_test.run(timeout=30)
+    latencies = []
+    for turn in range(turns):
+        start = time.perf_counter()
+        send(app_test, message(turn))
+        latencies.append(time.perf_counter() - start)
+        assert not app_test.exception, app_test.exception
+    return latencies
+
+
+def summarize_turns(latencies):
+    """Latency summary, plus the mean of the last ten turns to show any growth with the history"""
+    result = bench_util.summarize(latencies)
+    result["last_10_mean_ms"] = bench_util.summarize(latencies[-10:])["mean_ms"]
+    return result
+
+
+def send_before(app_test, text):
+    app_test.text_area[0].input(text)
+    app_test.button[0].click().run(timeout=30)
+
+
+def send_after(app_test, text):
+    app_test.chat_input[0].set_value(text).run(timeout=30)
+
+
+def time_http(url, turns, pooled):
+    """Per-turn time of the raw /chat/stream exchange, without Streamlit"""
+    session = requests.Session() if pooled else None
+    latencies, session_id = [], None
+    for turn in range(turns):
+        start = time.perf_counter()
+        post = session.post if pooled else requests.post
+        with post(f"{url}/chat/stream", json={"message": message(turn), "session_id": session_id},
+                  stream=True) as response:
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("data:") and '"session_id"' in line:
+                    session_id = json.loads(line[len("data:"):])["session_id"]
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake upstream seconds to first token")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="fake upstream seconds between tokens")
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--baseline-rev", default="HEAD~1", help="git revision of the frontend to compare against")
+    args = parser.parse_args()
+
+    upstream_url = fake_openai.start_in_thread(latency=args.latency, token_delay=args.token_delay, tokens=args.tokens)
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = self_signed_certificate(directory)
+        server, url = bench_util.start_gunicorn(
+            "app:app", "gthread", 1, fake_openai.free_port(), upstream_url, threads=4, ssl=(cert, key),
+            env_overrides={"RATE_LIMIT_ENABLED": "false"})
+        # Trust the certificate in every requests call, pooled or not
+        os.environ["REQUESTS_CA_BUNDLE"] = cert
+        os.environ["NUANSWERS_BACKEND_URL"] = url
+
+        before_source = subprocess.run(["git", "show", f"{args.baseline_rev}:frontend.py"], cwd=bench_util.REPO_ROOT,
+                                       capture_output=True, text=True, check=True).stdout
+        before_source = re.sub(r'BACKEND_URL = "[^"]*"', f'BACKEND_URL = "{url}"', before_source)
+
+        results = {
+            "before": summarize_turns(time_turns(AppTest.from_string(before_source), send_before, args.turns)),
+            "after": summarize_turns(time_turns(
+                AppTest.from_file(os.path.join(bench_util.REPO_ROOT, "frontend.py")), send_after, args.turns)),
+            "http_new_connection": bench_util.summarize(time_http(url, args.turns, pooled=False)),
+            "http_pooled_session": bench_util.summarize(time_http(url, args.turns, pooled=True)),
+        }
+        server.terminate()
+        server.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Topic identification and response assessment over thousands of student answers.
+
+Compares the original per-keyword `in` scans (with a .lower() per keyword)
+against one KeywordIndex scan per answer, and against the NumPy count matrix
+used for batch grading.
+
+Usage: python benchmarks/keyword_scoring.py [--answers 20000]
+"""
+import argparse
+import json
+import random
+import time
+
+import bench_util  # noqa: F401  (puts the repo root on sys.path)
+
+from NuAnswers import AccountingFinanceTutor, CRITICAL_THINKING_INDICATORS
+
+FILLER = ("i think the company should look at this because it makes sense and then we can see what "
+          "happens to the numbers over time when the business grows").split()
+
+
+def legacy_scores(topic_keywords, response):
+    """The original loops: one .lower() per keyword, one topic after another"""
+    scores = {topic: sum(keyword in response.lower() for keyword in keywords)
+              for topic, keywords in topic_keywords.items()}
+    scores["critical_thinking"] = sum(indicator in response.lower() for indicator in CRITICAL_THINKING_INDICATORS)
+    return scores
+
+
+def make_answers(count, topic_keywords, seed=3):
+    rng = random.Random(seed)
+    vocabulary = FILLER + [k for words in topic_keywords.values() for k in words] + list(CRITICAL_THINKING_INDICATORS)
+    return [" ".join(rng.choices(vocabulary, k=rng.randint(8, 60))) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--answers", type=int, default=20000)
+    args = parser.parse_args()
+
+    tutor = AccountingFinanceTutor(seed=0)
+    index = tutor.keyword_index
+    answers = make_answers(args.answers, tutor.topic_keywords)
+
+    start = time.perf_counter()
+    legacy = [legacy_scores(tutor.topic_keywords, answer) for answer in answers]
+    legacy_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed = [index.score(answer) for answer in answers]
+    indexed_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matrix = index.score_many(answers)
+    matrix_s = time.perf_counter() - start
+
+    assert legacy == indexed
+    assert [[row[name] for name in index.names] for row in legacy] == matrix.tolist()
+
+    results = {
+        "answers": args.answers,
+        "legacy_loops": {"seconds": round(legacy_s, 3), "answers_per_sec": round(args.answers / legacy_s)},
+        "keyword_index": {"seconds": round(indexed_s, 3), "answers_per_sec": round(args.answers / indexed_s),
+                          "speedup": round(legacy_s / indexed_s, 2)},
+        "score_many_matrix": {"seconds": round(matrix_s, 3), "answers_per_sec": round(args.answers / matrix_s),
+                              "speedup": round(legacy_s / matrix_s, 2)},
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
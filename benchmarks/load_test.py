@@ -0,0 +1,204 @@
+"""Load test of /chat per gunicorn worker class and worker count.
+
+Starts the fake OpenAI upstream (configurable latency, streaming speed and
+error rate), then for every deployment and worker count starts gunicorn with
+OPENAI_BASE_URL pointed at it and drives /chat with concurrent simulated
+students. Each student holds a conversation of --turns messages, sending its
+session id back, with --think-time seconds between messages.
+
+Throughput, p50/p95/p99 latency and errors are printed and, with --output,
+saved as JSON. --compare checks a run against a saved baseline and exits with
+status 1 when a latency percentile rose or throughput fell by more than
+--tolerance.
+
+Deployments are module@worker-class, e.g. app:app@sync, app:app@gthread,
+server:app@sync or asgi_app:app@uvicorn.
+
+Usage:
+    python benchmarks/load_test.py --workers 1,2,4 --output baseline.json
+    python benchmarks/load_test.py --workers 1,2,4 --compare baseline.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import bench_util
+import fake_openai
+
+import httpx
+
+WORKER_CLASSES = {
+    "sync": "sync",
+    "gthread": "gthread",
+    "uvicorn": "uvicorn.workers.UvicornWorker",
+}
+DEFAULT_DEPLOYMENTS = "app:app@sync,app:app@gthread,asgi_app:app@uvicorn"
+QUESTIONS = [
+    "What is the current ratio and how do I calculate it?",
+    "How do I find the present value of a bond?",
+    "Why does buying inventory on credit keep the accounting equation balanced?",
+    "Where does net income show up on the balance sheet?",
+]
+COMPARED = [("p50_ms", 1), ("p95_ms", 1), ("p99_ms", 1), ("requests_per_sec", -1)]
+
+
+async def drive(url, students, total, turns, think_time):
+    """Sends `total` /chat requests from `students` concurrent conversations"""
+    latencies, statuses = [], {}
+    remaining = total
+
+    async def student(client, number):
+        nonlocal remaining
+        while remaining > 0:
+            session_id = None
+            for turn in range(turns):
+                if remaining <= 0:
+                    return
+                remaining -= 1
+                question = QUESTIONS[(number + turn) % len(QUESTIONS)]
+                # Student and turn make every message distinct, so the response cache never answers
+                payload = {"message": f"{question} (student {number}, turn {turn})"}
+                if session_id:
+                    payload["session_id"] = session_id
+                start = time.perf_counter()
+                try:
+                    response = await client.post(f"{url}/chat", json=payload)
+                    status = str(response.status_code)
+                    if response.status_code == 200:
+                        latencies.append(time.perf_counter() - start)
+                        session_id = response.json().get("session_id")
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                statuses[status] = statuses.get(status, 0) + 1
+                if think_time:
+                    await asyncio.sleep(think_time)
+
+    limits = httpx.Limits(max_connections=students, max_keepalive_connections=students)
+    async with httpx.AsyncClient(limits=limits, timeout=300) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(student(client, number) for number in range(students)))
+        elapsed = time.perf_counter() - start
+
+    result = bench_util.summarize(latencies)
+    result.update({
+        "requests_per_sec": round(len(latencies) / elapsed, 2),
+        "errors": total - len(latencies),
+        "statuses": statuses,
+    })
+    return result
+
+
+def parse_deployment(spec):
+    module, _, worker_class = spec.partition("@")
+    if worker_class not in WORKER_CLASSES:
+        raise argparse.ArgumentTypeError(f"unknown worker class in {spec!r}, use one of {sorted(WORKER_CLASSES)}")
+    return module, worker_class
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=bench_util.REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Returns a line per metric that regressed by more than tolerance against baseline"""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        for metric, direction in COMPARED:
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if change * direction > tolerance:
+                regressions.append(f"{name} {metric}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--deployments", default=DEFAULT_DEPLOYMENTS,
+                        help="comma-separated module@worker-class list (default: %(default)s)")
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts (default: %(default)s)")
+    parser.add_argument("--threads", type=int, default=8, help="threads per gthread worker")
+    parser.add_argument("--students", type=int, default=50, help="concurrent simulated students")
+    parser.add_argument("--requests", type=int, default=500, help="/chat requests per run")
+    parser.add_argument("--turns", type=int, default=3, help="messages per conversation")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds between a student's messages")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake upstream seconds to first token")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="fake upstream seconds between tokens")
+    parser.add_argument("--tokens", type=int, default=50, help="fake upstream tokens per completion")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls failing with 429/500")
+    parser.add_argument("--rate-limit", action="store_true",
+                        help="keep per-client rate limiting on (all students share one address, so it is off by default)")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file from an earlier --output")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression (default: 10%%)")
+    args = parser.parse_args()
+
+    deployments = [parse_deployment(spec) for spec in args.deployments.split(",")]
+    worker_counts = [int(count) for count in args.workers.split(",")]
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "tolerance")}
+
+    upstream, upstream_url = fake_openai.start_in_subprocess(
+        latency=args.latency, token_delay=args.token_delay, tokens=args.tokens, error_rate=args.error_rate)
+    results = {}
+    try:
+        for module, worker_class in deployments:
+            for workers in worker_counts:
+                name = f"{module}@{worker_class}x{workers}"
+                process, url = bench_util.start_gunicorn(
+                    module, WORKER_CLASSES[worker_class], workers, fake_openai.free_port(), upstream_url,
+                    threads=args.threads if worker_class == "gthread" else 1,
+                    env_overrides={"RATE_LIMIT_ENABLED": "true" if args.rate_limit else "false"})
+                try:
+                    results[name] = asyncio.run(
+                        drive(url, args.students, args.requests, args.turns, args.think_time))
+                finally:
+                    process.terminate()
+                    process.wait()
+                print(f"{name}: {results[name]['requests_per_sec']} req/s, "
+                      f"p50 {results[name]['p50_ms']} ms, p95 {results[name]['p95_ms']} ms, "
+                      f"p99 {results[name]['p99_ms']} ms, {results[name]['errors']} errors", file=sys.stderr)
+    finally:
+        upstream.terminate()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "config": config,
+        },
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.tolerance)
+        for line in regressions:
+            print(f"❌ Regression: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"✅ No regressions beyond {args.tolerance:.0%} against {args.compare}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
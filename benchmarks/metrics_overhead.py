@@ -0,0 +1,111 @@
+"""Hot-path cost of metrics and tracing on /chat/stream.
+
+Two measurements:
+- end to end: the Flask app is run in child processes with METRICS_ENABLED
+  true and false, alternating, against a fake upstream with no added
+  latency. That is the worst case, because the app's own CPU time is the
+  whole request.
+- instrumentation only: the exact metric and span calls one streamed request
+  makes are timed in a loop and compared with the end-to-end request time.
+
+Usage: python benchmarks/metrics_overhead.py [--requests 300] [--rounds 3] [--tokens 200]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import bench_util
+import fake_openai
+
+
+def child(requests_count):
+    """Serves the app in this process and times sequential streamed requests"""
+    import requests
+    import app
+    url = bench_util.serve_wsgi_in_thread(app.app, fake_openai.free_port())
+    session = requests.Session()
+    latencies = []
+    for i in range(requests_count):
+        start = time.perf_counter()
+        with session.post(f"{url}/chat/stream", json={"message": f"What is the current ratio? ({i})"},
+                          stream=True) as response:
+            for _ in response.iter_lines():
+                pass
+        latencies.append(time.perf_counter() - start)
+    print(json.dumps({"mean_s": statistics.fmean(latencies[10:])}))
+
+
+def run_child(base_url, enabled, requests_count):
+    env = dict(os.environ, OPENAI_BASE_URL=base_url, OPENAI_API_KEY="sk-fake-benchmark-key",
+               METRICS_ENABLED="true" if enabled else "false")
+    output = subprocess.run([sys.executable, __file__, "--child", "--requests", str(requests_count)],
+                            env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])["mean_s"]
+
+
+def instrumentation_cost(tokens, repeat=2000):
+    """Seconds of metric and span work per streamed request with `tokens` deltas"""
+    import metrics
+    from metrics import span
+    start = time.perf_counter()
+    for _ in range(repeat):
+        trace = metrics.start_trace("/chat/stream")
+        with span("parse"):
+            pass
+        with span("cache"):
+            pass
+        with span("prompt_build"):
+            metrics.observe(metrics.PROMPT_TOKENS, 700)
+        with span("upstream"):
+            metrics.observe(metrics.UPSTREAM_FIRST_TOKEN_SECONDS, 0.5)
+            guard_seconds = 0.0
+            for _ in range(tokens):
+                # GuardedText.feed times each delta
+                started = time.perf_counter()
+                guard_seconds += time.perf_counter() - started
+            metrics.observe(metrics.UPSTREAM_SECONDS, 2.0)
+        metrics.add_span("guard", guard_seconds)
+        metrics.observe(metrics.COMPLETION_TOKENS, tokens)
+        trace.server_timing()
+        metrics.finish_trace(trace, 200)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.requests)
+        return
+
+    process, base_url = fake_openai.start_in_subprocess(latency=0.0, token_delay=0.0, tokens=args.tokens)
+    try:
+        timings = {True: [], False: []}
+        for _ in range(args.rounds):
+            for enabled in (False, True):
+                timings[enabled].append(run_child(base_url, enabled, args.requests))
+    finally:
+        process.terminate()
+
+    disabled = statistics.median(timings[False])
+    enabled = statistics.median(timings[True])
+    per_request = instrumentation_cost(args.tokens)
+    print(json.dumps({
+        "request_ms_metrics_off": round(disabled * 1000, 3),
+        "request_ms_metrics_on": round(enabled * 1000, 3),
+        "end_to_end_overhead": round(enabled / disabled - 1, 4),
+        "instrumentation_us_per_request": round(per_request * 1e6, 1),
+        "instrumentation_share_of_request": round(per_request / disabled, 4),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Offline replay of chat turns through the model router: latency and cost per route.
+
+Conversations are replayed through the real local tier, session store,
+prompt builder and router, without calling any model. Every turn that
+reaches the LLM is priced and timed from a model profile: time to first
+token plus prefill per prompt token, then the reply at the model's decode
+rate, and $ per million input and output tokens. Input tokens are the full
+prompt (system prompt, history, retrieved problems, message). Output tokens
+are the reply's, capped at the route's max_tokens (counted as truncated).
+Local turns are timed for real and cost nothing.
+
+Turns come from simulated students (openings, bare answers such as
+"$750,000" or "D", acknowledgements, reasoning, hints and new multi-part
+problems), or from the transcript log with --transcripts, replaying the
+logged messages with the logged replies' lengths. Three phases:
+- large_only: every turn to the large model, as before the local tier
+- local_tier: the local tier in front of the large model
+- routed: the local tier, then the router's small or large model
+
+The default profiles are estimates for gpt-4-turbo-preview and
+gpt-3.5-turbo; pass --profiles with a JSON file of the same shape to use
+measured ones.
+
+Usage: python benchmarks/model_routing.py [--students 400] [--turns 10] [--transcripts DIR]
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+import bench_util
+
+PROFILES = {
+    "gpt-4-turbo-preview": {"ttft_s": 0.6, "prefill_s_per_1k": 0.05, "tokens_per_s": 35,
+                            "usd_per_1m_input": 10.0, "usd_per_1m_output": 30.0},
+    "gpt-3.5-turbo": {"ttft_s": 0.25, "prefill_s_per_1k": 0.02, "tokens_per_s": 100,
+                      "usd_per_1m_input": 0.5, "usd_per_1m_output": 1.5},
+}
+
+OPENINGS = ["financial ratios please", "let's do the accounting equation", "time value of money",
+            "A company issues $5,000 in stock and buys equipment for $3,000 cash. What happens to the "
+            "accounting equation?",
+            "How do I calculate the current ratio if current assets are $50,000 and liabilities $25,000?",
+            "What is the present value of $1,000 received in 5 years at 6%?"]
+BARE_ANSWERS = ["2 years", "$750,000", "D", "b)", "12.5%", "$1,500,000", "0.8", "c", "yes", "500"]
+ACKNOWLEDGEMENTS = ["ok thanks", "got it", "makes sense", "ok", "thank you"]
+REASONING = ["I think assets equal liabilities plus equity because every transaction is balanced, therefore equity "
+             "changes",
+             "The ratio divides current assets by current liabilities, so if it is above one then liquidity is good",
+             "Since interest compounds, the present value is lower than the future value, thus we discount"]
+WEAK = ["not sure", "maybe the second one", "I don't really get it", "is it the bigger one?",
+        "I think you subtract them but I am not sure which one goes first here"]
+FOLLOW_UPS = ["why do we divide by liabilities?", "what does liquidity mean?", "can you explain that again?"]
+NEW_PROBLEMS = ["a) Calculate ROE if net income is $60,000 and equity is $200,000. b) What about ROA with "
+                "assets of $400,000?",
+                "A company takes out a $10,000 loan, buys $7,000 of inventory and pays $2,000 in dividends. "
+                "What is the net effect?",
+                "Now what is the future value of $2,500 invested for 3 years at 4%, and how does that compare?"]
+# Turn kinds, their weights after the opening, and the range of reply lengths in tokens they get
+KINDS = {
+    "opening": (OPENINGS, 0, (200, 500)),
+    "bare_answer": (BARE_ANSWERS, 5, (60, 220)),
+    "acknowledgement": (ACKNOWLEDGEMENTS, 2, (30, 120)),
+    "reasoning": (REASONING, 2, (80, 200)),
+    "weak": (WEAK, 3, (80, 260)),
+    "hint": (["can I get a hint?"], 1, (60, 150)),
+    "follow_up": (FOLLOW_UPS, 2, (120, 350)),
+    "new_problem": (NEW_PROBLEMS, 1, (250, 600)),
+}
+
+
+def simulated_conversations(students, turns, seed=22):
+    """Lists of (message, reply tokens), one list per student"""
+    rng = random.Random(seed)
+    kinds = [kind for kind in KINDS if KINDS[kind][1]]
+    weights = [KINDS[kind][1] for kind in kinds]
+    conversations = []
+    for _ in range(students):
+        script = ["opening"] + rng.choices(kinds, weights, k=turns - 1)
+        conversations.append([(rng.choice(KINDS[kind][0]), rng.randint(*KINDS[kind][2])) for kind in script])
+    return conversations
+
+
+def logged_conversations(directory, counter):
+    """The transcript log's turns per session, each with its logged reply's token count"""
+    from transcripts import read_transcripts
+
+    frame = read_transcripts(directory, columns=["timestamp", "session_id", "user_message", "response"]).to_pandas()
+    frame = frame.sort_values(["session_id", "timestamp"])
+    return [[(message, counter.count(response)) for message, response in zip(turns["user_message"], turns["response"])]
+            for _, turns in frame.groupby("session_id", sort=False)]
+
+
+def replay(conversations, local_enabled, router_enabled, profiles):
+    from local_tier import create_local_tier
+    from NuAnswers import TOPICS
+    from router import create_model_router
+    from sessions import create_session_store
+    from tutor_prompt import prompt_builder
+
+    local_tier = create_local_tier(prompt_builder.retriever)
+    local_tier.enabled = local_enabled
+    router = create_model_router()
+    router.enabled = router_enabled
+    session_store = create_session_store()
+
+    routes = {}
+    for number, conversation in enumerate(conversations):
+        session_id = f"replay-{number}"
+        for message, reply_tokens in conversation:
+            start = time.perf_counter()
+            reply = local_tier.answer(session_id, message) if local_tier.enabled else None
+            if reply is not None:
+                seconds, cost, truncated, route = time.perf_counter() - start, 0.0, False, "local"
+            else:
+                history = session_store.get_history(session_id)
+                state = local_tier.state(session_id)
+                route, params = router.route(message, history, None if state.topic is None else TOPICS[state.topic])
+                profile = profiles[params["model"]]
+                input_tokens = prompt_builder.report(message, history)["total"]
+                output_tokens = min(reply_tokens, params["max_tokens"])
+                truncated = reply_tokens > params["max_tokens"]
+                seconds = (profile["ttft_s"] + profile["prefill_s_per_1k"] * input_tokens / 1000
+                           + output_tokens / profile["tokens_per_s"])
+                cost = (input_tokens * profile["usd_per_1m_input"]
+                        + output_tokens * profile["usd_per_1m_output"]) / 1e6
+                reply = "tutor " * output_tokens
+            session_store.append_turn(session_id, message, reply)
+            entry = routes.setdefault(route, {"seconds": [], "cost": 0.0, "truncated": 0})
+            entry["seconds"].append(seconds)
+            entry["cost"] += cost
+            entry["truncated"] += truncated
+    return summarize(routes)
+
+
+def summarize(routes):
+    turns = sum(len(entry["seconds"]) for entry in routes.values())
+    cost = sum(entry["cost"] for entry in routes.values())
+    by_route = {}
+    for route, entry in sorted(routes.items()):
+        by_route[route] = dict(bench_util.summarize(entry["seconds"]), share=round(len(entry["seconds"]) / turns, 3),
+                               cost_usd=round(entry["cost"], 4), truncated=entry["truncated"])
+    return {
+        "turns": turns,
+        "mean_turn_ms": round(1000 * sum(sum(entry["seconds"]) for entry in routes.values()) / turns, 1),
+        "cost_usd": round(cost, 4),
+        "usd_per_1k_turns": round(1000 * cost / turns, 3),
+        "by_route": by_route,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=400)
+    parser.add_argument("--turns", type=int, default=10, help="turns per simulated student")
+    parser.add_argument("--transcripts", help="replay the transcript log in this directory instead")
+    parser.add_argument("--profiles", help="JSON file of model latency and price profiles")
+    args = parser.parse_args()
+
+    # Only the replay runs; nothing is sent upstream or written to the transcript log
+    bench_util.use_fake_upstream("http://127.0.0.1:9/v1")
+    os.environ["TRANSCRIPTS_ENABLED"] = "false"
+    profiles = PROFILES
+    if args.profiles:
+        with open(args.profiles) as f:
+            profiles = json.load(f)
+
+    if args.transcripts:
+        from tutor_prompt import prompt_builder
+        conversations = logged_conversations(args.transcripts, prompt_builder.counter)
+    else:
+        conversations = simulated_conversations(args.students, args.turns)
+
+    results = {phase: replay(conversations, local, routed, profiles) for phase, local, routed in (
+        ("large_only", False, False), ("local_tier", True, False), ("routed", True, True))}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Output guard trip rate, tokens saved and latency against a fake upstream.
+
+A share of the fake completions state the answer a third of the way through;
+the guard should cancel those streams, so the run reports how many tokens
+were not generated and how much sooner the student got a reply.
+
+Usage: python benchmarks/output_guard.py [--requests 100] [--answer-rate 0.3]
+"""
+import argparse
+import json
+import time
+
+import bench_util
+import fake_openai
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--answer-rate", type=float, default=0.3)
+    parser.add_argument("--tokens", type=int, default=300)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    args = parser.parse_args()
+
+    bench_util.use_fake_upstream(fake_openai.start_in_thread(
+        latency=0.05, token_delay=args.token_delay, tokens=args.tokens, answer_rate=args.answer_rate))
+    import app
+    from guard import create_output_guard
+    from response_cache import ResponseCache
+
+    services = app.app.extensions["nuanswers"]
+    services.response_cache = ResponseCache(max_entries=0)
+    client = app.app.test_client()
+    results = {}
+    for endpoint in ("/chat", "/chat/stream"):
+        services.output_guard = create_output_guard()
+        latencies = []
+        for i in range(args.requests):
+            start = time.perf_counter()
+            response = client.post(endpoint, json={"message": f"What is the accounting equation? ({i})"})
+            body = response.get_data(as_text=True)
+            latencies.append(time.perf_counter() - start)
+            assert "the answer is" not in body.lower()
+        result = bench_util.summarize(latencies)
+        result["output_guard"] = services.output_guard.stats()
+        results[endpoint] = result
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
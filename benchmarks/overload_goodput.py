@@ -0,0 +1,169 @@
+"""Goodput of /chat under overload against a slow upstream, with and without request deadlines.
+
+The fake upstream answers in about --latency + --tokens * --token-delay
+seconds, and stalls --slow-rate of its requests for --slow-latency seconds
+first. Students arrive at random (Poisson) at --rate per second, above what
+--max-upstream concurrent upstream calls can serve. Each student sends
+X-Request-Deadline-Ms and hangs up when it passes.
+
+Two phases per deployment, each against a fresh fake upstream:
+- no_deadlines: REQUEST_DEADLINE_ENABLED=false, as before. Calls run to
+  OPENAI_DEADLINE_SECONDS whether anyone waits for them or not.
+- deadlines: the admission queue sheds requests that cannot finish in
+  time, and upstream calls are cut off at the deadline or on disconnect.
+
+Goodput is upstream replies delivered within the deadline, per second.
+Shed requests get a fast 429. Wasted tokens are the ones the upstream
+streamed beyond those in delivered replies, counted once every upstream
+call has ended. Rate limits per client are raised and the local tier is
+off, so only the queue and the deadlines decide the outcome.
+
+Usage: python benchmarks/overload_goodput.py [--rate 10] [--seconds 30] [--deadline-ms 4000]
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+import bench_util
+import fake_openai
+
+import httpx
+
+DEPLOYMENTS = {
+    "app:app@gthread": ("app:app", "gthread", 32),
+    "asgi_app:app@uvicorn": ("asgi_app:app", "uvicorn.workers.UvicornWorker", 1),
+}
+QUESTIONS = [
+    "What is the current ratio and how do I calculate it?",
+    "How do I find the present value of a bond?",
+    "Why does buying inventory on credit keep the accounting equation balanced?",
+]
+
+
+async def drive(url, rate, seconds, deadline_ms, seed):
+    """Open-loop arrivals for `seconds`; returns the outcome and latency of every request"""
+    rng = random.Random(seed)
+    outcomes = []
+
+    async def student(client, number):
+        # The number makes every message distinct, so the response cache never answers
+        payload = {"message": f"{QUESTIONS[number % len(QUESTIONS)]} (student {number})"}
+        start = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                client.post(f"{url}/chat", json=payload, headers={"X-Request-Deadline-Ms": str(deadline_ms)}),
+                deadline_ms / 1000)
+            if response.status_code == 429:
+                outcome = "shed"
+            elif response.status_code == 200 and not response.json()["response"].startswith("Error: "):
+                outcome = "ok"
+            else:
+                outcome = "error"
+        except asyncio.TimeoutError:
+            # The student hangs up; its connection is closed
+            outcome = "timeout"
+        except httpx.HTTPError:
+            outcome = "error"
+        outcomes.append((outcome, time.perf_counter() - start))
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=0)
+    async with httpx.AsyncClient(limits=limits, timeout=None) as client:
+        tasks, number = [], 0
+        started = time.perf_counter()
+        next_arrival = started
+        while next_arrival < started + seconds:
+            await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+            tasks.append(asyncio.ensure_future(student(client, number)))
+            number += 1
+            next_arrival += rng.expovariate(rate)
+        await asyncio.gather(*tasks)
+    return outcomes
+
+
+def wait_until_idle(upstream_url, limit=60.0):
+    """Fake upstream counters once its streams have ended, or after limit seconds"""
+    stop = time.monotonic() + limit
+    while True:
+        counters = httpx.get(f"{upstream_url}/fake/stats").json()
+        if counters["streaming"] == 0 or time.monotonic() > stop:
+            return counters
+        time.sleep(0.5)
+
+
+def run(deployment, deadlines, args):
+    module, worker_class, threads = DEPLOYMENTS[deployment]
+    upstream, upstream_url = fake_openai.start_in_subprocess(
+        latency=args.latency, token_delay=args.token_delay, tokens=args.tokens,
+        slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+    env = {
+        "REQUEST_DEADLINE_ENABLED": "true" if deadlines else "false",
+        "RATE_LIMIT_MAX_UPSTREAM": str(args.max_upstream),
+        "RATE_LIMIT_IP_RATE": "100000", "RATE_LIMIT_IP_BURST": "100000",
+        "LOCAL_TIER_ENABLED": "false",
+        "TRANSCRIPTS_ENABLED": "false",
+        "COALESCE_BACKEND": "off",
+    }
+    try:
+        process, url = bench_util.start_gunicorn(module, worker_class, 1, fake_openai.free_port(), upstream_url,
+                                                 threads=threads, env_overrides=env)
+        try:
+            outcomes = asyncio.run(drive(url, args.rate, args.seconds, args.deadline_ms, args.seed))
+            admission = httpx.get(f"{url}/stats", timeout=30).json()["admission"]["upstream"]
+            upstream_counters = wait_until_idle(upstream_url)
+        finally:
+            process.terminate()
+            process.wait()
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+    by_outcome = {}
+    for outcome, seconds in outcomes:
+        by_outcome.setdefault(outcome, []).append(seconds)
+    ok = len(by_outcome.get("ok", []))
+    return {
+        "requests": len(outcomes),
+        "goodput_per_sec": round(ok / args.seconds, 2),
+        "outcomes": {outcome: bench_util.summarize(latencies) for outcome, latencies in sorted(by_outcome.items())},
+        "admission": admission,
+        "upstream": {
+            "requests": upstream_counters["requests"],
+            "completed": upstream_counters["completed"],
+            "cancelled": upstream_counters["cancelled"],
+            "tokens_sent": upstream_counters["tokens_sent"],
+            "wasted_tokens": upstream_counters["tokens_sent"] - ok * args.tokens,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--deployments", default=",".join(DEPLOYMENTS),
+                        help="comma-separated deployments (default: %(default)s)")
+    parser.add_argument("--rate", type=float, default=10.0, help="student arrivals per second")
+    parser.add_argument("--seconds", type=float, default=30.0, help="how long students keep arriving")
+    parser.add_argument("--deadline-ms", type=int, default=4000, help="deadline each student sends and keeps to")
+    parser.add_argument("--max-upstream", type=int, default=8, help="concurrent upstream calls allowed")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake upstream seconds to first token")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="fake upstream seconds between tokens")
+    parser.add_argument("--tokens", type=int, default=100, help="fake upstream tokens per completion")
+    parser.add_argument("--slow-rate", type=float, default=0.1, help="fraction of upstream calls that stall")
+    parser.add_argument("--slow-latency", type=float, default=20.0, help="seconds a stalled call stalls for")
+    parser.add_argument("--seed", type=int, default=24)
+    args = parser.parse_args()
+
+    results = {}
+    for deployment in args.deployments.split(","):
+        for phase, deadlines in (("no_deadlines", False), ("deadlines", True)):
+            result = run(deployment, deadlines, args)
+            results.setdefault(deployment, {})[phase] = result
+            print(f"{deployment} {phase}: goodput {result['goodput_per_sec']}/s, "
+                  f"wasted {result['upstream']['wasted_tokens']} tokens", file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
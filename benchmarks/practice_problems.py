@@ -0,0 +1,120 @@
+"""Generation throughput and serve latency of the generated practice problems.
+
+- generation: problems per second for each template, generated as one
+  vectorised batch against one problem at a time, and the share the
+  check rejected
+- serve: latency of taking a problem from the warm pool, of generating one
+  synchronously (what a request pays on a pool miss), and of a practice
+  request through the tutor with the pool against one sampling the
+  retrieval corpus
+- answers: check_answer on every template's exact answers (all should be
+  accepted) and on answers 10% off (all should be rejected), and its latency
+
+Usage: python benchmarks/practice_problems.py [--batch 20000] [--serves 20000]
+"""
+import argparse
+import json
+import random
+import time
+
+import bench_util
+
+import numpy as np
+
+from NuAnswers import AccountingFinanceTutor, ConversationState, TOPICS, TutorState
+from practice import SEED_BITS, TEMPLATES, ProblemPool, problem_code
+
+
+def generation(batch, singles):
+    results = {}
+    for number, template in enumerate(TEMPLATES):
+        seeds = np.random.default_rng(number).integers(0, 1 << SEED_BITS, batch)
+        start = time.perf_counter()
+        kept, params, _ = template.generate(seeds)
+        template.render(params)
+        batch_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for index in range(singles):
+            _, params, _ = template.generate(seeds[index:index + 1])
+            template.render(params)
+        single_seconds = (time.perf_counter() - start) / singles
+
+        results[f"{template.topic}/{template.difficulty}"] = {
+            "batch_per_sec": round(batch / batch_seconds),
+            "single_per_sec": round(1 / single_seconds),
+            "rejected": round(1 - len(kept) / batch, 4),
+        }
+    return results
+
+
+def latencies(function, count):
+    seconds = []
+    for index in range(count):
+        start = time.perf_counter()
+        function(index)
+        seconds.append(time.perf_counter() - start)
+    return bench_util.summarize(seconds)
+
+
+def practice_request(problems, retriever):
+    def request(index):
+        topic = TOPICS.index(TEMPLATES[index % len(TEMPLATES)].topic)
+        tutor = AccountingFinanceTutor(retriever=retriever, problems=problems,
+                                       state=TutorState(ConversationState.TOPIC_SELECTED, topic))
+        tutor.evaluate_response(f"practice {TEMPLATES[index % len(TEMPLATES)].difficulty}")
+    return request
+
+
+def answers(pool, count):
+    rng = np.random.default_rng(23)
+    accepted = rejected = 0
+    seconds = []
+    for index in range(count):
+        number = index % len(TEMPLATES)
+        template = TEMPLATES[number]
+        kept, _, solved = template.generate(rng.integers(0, 1 << SEED_BITS, 1))
+        if not len(kept):
+            continue
+        code = problem_code(number, kept[0])
+        exact = " and ".join(f"${abs(values[0]):,.2f}" for name, values in solved.items() if name in template.required)
+        off = " and ".join(f"${abs(values[0]) * 1.1 + 1:,.2f}" for name, values in solved.items()
+                           if name in template.required)
+        start = time.perf_counter()
+        accepted += pool.check_answer(code, exact) is True
+        seconds.append(time.perf_counter() - start)
+        rejected += pool.check_answer(code, off) is False
+    return {"answers": len(seconds), "exact_accepted": accepted, "off_by_10pct_rejected": rejected,
+            "check": bench_util.summarize(seconds)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch", type=int, default=20000, help="problems per template in the batch run")
+    parser.add_argument("--singles", type=int, default=2000, help="problems per template generated one at a time")
+    parser.add_argument("--serves", type=int, default=20000)
+    args = parser.parse_args()
+
+    from retrieval import create_retrieval_index
+    retriever = create_retrieval_index()
+
+    results = {"generation": generation(args.batch, args.singles)}
+
+    start = time.perf_counter()
+    pool = ProblemPool(size=max(256, args.serves // len(TEMPLATES) + 1), low_water=0)
+    results["pool_fill_seconds"] = round(time.perf_counter() - start, 3)
+    results["serve"] = {
+        "pool_take": latencies(lambda index: pool.take(*[(t.topic, t.difficulty) for t in TEMPLATES][
+            index % len(TEMPLATES)]), args.serves),
+        "synchronous_generation": latencies(lambda index: pool._generate_one(index % len(TEMPLATES), random),
+                                            args.serves // 10),
+        "practice_request_pool": latencies(practice_request(ProblemPool(), retriever), args.serves // 10),
+        "practice_request_corpus": latencies(practice_request(None, retriever), args.serves // 10),
+    }
+    results["pool"] = pool.stats()
+    results["answers"] = answers(pool, 1200)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Ingest and query times of the progress analytics dataset at millions of turns.
+
+Synthetic students hold sessions over two academic years: each picks a
+topic, climbs part of its learning path, and takes some hints on the way.
+Their turns are written as closed transcript segments, a day or so each, as
+the app's transcript log would leave them. Then:
+- ingest_full: every segment into an empty dataset
+- ingest_incremental: one more day's segment into the existing dataset,
+  against re-ingesting everything from scratch (full recomputation)
+- queries: each report over the whole dataset, and stage_summary for one
+  topic and one semester, which reads only those partitions
+- raw_log_topics: the topic distribution computed straight from the
+  transcript log with pandas, for comparison
+
+Usage: python benchmarks/progress_analytics.py [--turns 2000000] [--segments 240]
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import date
+
+import bench_util  # noqa: F401  (puts the repo root on sys.path)
+
+import numpy as np
+import pyarrow as pa
+
+from NuAnswers import LEARNING_PATH, TOPICS
+from analytics import ProgressAnalytics
+from transcripts import TRANSCRIPT_SCHEMA, read_transcripts
+
+START = np.datetime64("2024-08-26T00:00:00", "us")
+DAYS = 2 * 365
+MESSAGES = pa.array([f"student message {i} about ratios, equity and present value" for i in range(200)])
+RESPONSES = pa.array([f"tutor reply {i}: what do you think happens to equity when assets change, and why?"
+                      for i in range(200)])
+STATES = ["topic_selected", "in_discussion", "practice"]
+
+
+def make_turns(count, rng):
+    """count turns of sessions 4 to 20 turns long, as one Arrow table sorted by time"""
+    # More sessions than needed; the turns past count are cut off
+    sessions = count // 10 + 10
+    lengths = rng.integers(4, 21, sessions)
+    session = np.repeat(np.arange(sessions), lengths)[:count]
+    turn = np.arange(len(session)) - np.repeat(np.cumsum(lengths) - lengths, lengths)[:count]
+    progress = turn / lengths[session]
+
+    topic = rng.integers(0, len(TOPICS), sessions)[session]
+    # The stage a session gets to (len(path) means it completed the topic), and its hints on the way
+    reach = rng.integers(0, len(LEARNING_PATH[TOPICS[0]]) + 1, sessions)[session]
+    stage = np.minimum(np.floor(progress * (reach + 1)), reach).astype(np.uint8)
+    hints = np.minimum(np.floor(progress * rng.integers(0, 4, sessions)[session] * 1.5), 3).astype(np.uint8)
+    started = START + rng.integers(0, DAYS * 86400, sessions).astype("timedelta64[s]")
+    timestamp = started[session] + (turn * 45_000_000).astype("timedelta64[us]")
+    # About one turn in twelve comes before a topic is picked
+    no_topic = turn == 0
+
+    table = pa.table({
+        "timestamp": pa.array(timestamp, pa.timestamp("us")).cast(pa.timestamp("us", tz="UTC")),
+        "session_id": pa.array(np.char.add("s", session.astype(str))),
+        "user_message": MESSAGES.take(rng.integers(0, len(MESSAGES), len(session))),
+        "response": RESPONSES.take(rng.integers(0, len(RESPONSES), len(session))),
+        "tier": pa.DictionaryArray.from_arrays(pa.array(rng.integers(0, 3, len(session)), pa.int8()),
+                                               pa.array(["local", "llm", "cache"])),
+        "topic": pa.DictionaryArray.from_arrays(pa.array(topic, pa.int8(), mask=no_topic), pa.array(list(TOPICS))),
+        "conversation_state": pa.DictionaryArray.from_arrays(
+            pa.array(np.where(no_topic, 0, 1 + (progress > 0.8)), pa.int8()), pa.array(STATES)),
+        "hints_given": pa.array(hints),
+        "stage": pa.array(stage),
+        "latency_ms": pa.array(rng.uniform(0.1, 2500, len(session)).astype(np.float32)),
+    }, schema=TRANSCRIPT_SCHEMA)
+    return table.sort_by("timestamp")
+
+
+def write_segments(table, directory, count, first=0):
+    """Splits a time-sorted table into count closed segment files"""
+    os.makedirs(directory, exist_ok=True)
+    for number, rows in enumerate(np.array_split(np.arange(table.num_rows), count), first):
+        part = table.slice(rows[0], len(rows))
+        path = os.path.join(directory, f"transcripts-20260101T000000-1-{number:06d}.arrows")
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_stream(sink, TRANSCRIPT_SCHEMA) as writer:
+            writer.write_table(part, max_chunksize=1024)
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, round(time.perf_counter() - start, 3)
+
+
+def dataset_bytes(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory)
+               for name in names if name.endswith(".parquet"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=2_000_000)
+    parser.add_argument("--segments", type=int, default=240, help="segments the turns are split into")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(21)
+    directory = tempfile.mkdtemp(prefix="analytics-bench-")
+    transcripts = os.path.join(directory, "transcripts")
+    try:
+        write_segments(make_turns(args.turns, rng), transcripts, args.segments)
+        one_day = make_turns(args.turns // args.segments, rng)
+        results = {"turns": args.turns, "segments": args.segments}
+
+        analytics = ProgressAnalytics(os.path.join(directory, "dataset"))
+        rows, seconds = timed(analytics.ingest, transcripts)
+        results["ingest_full"] = {"rows": rows, "seconds": seconds, "turns_per_sec": round(rows / seconds),
+                                  "parquet_mb": round(dataset_bytes(analytics.directory) / 2**20, 1)}
+
+        write_segments(one_day, transcripts, 1, first=args.segments)
+        rows, seconds = timed(analytics.ingest, transcripts)
+        _, recompute_seconds = timed(ProgressAnalytics(os.path.join(directory, "recomputed")).ingest, transcripts)
+        results["ingest_incremental"] = {"rows": rows, "seconds": seconds,
+                                         "full_recompute_seconds": recompute_seconds}
+
+        queries = {
+            "stage_summary": lambda: analytics.stage_summary(),
+            "hint_usage_by_week": lambda: analytics.hint_usage(by="week"),
+            "topic_distribution_by_semester": lambda: analytics.topic_distribution(by="semester"),
+            "stage_summary_one_topic_one_semester": lambda: analytics.stage_summary(
+                start=date(2025, 8, 1), end=date(2025, 12, 31), topics=[TOPICS[1]]),
+        }
+        results["query_seconds"] = {}
+        for name, query in queries.items():
+            frame, seconds = timed(query)
+            results["query_seconds"][name] = seconds
+            results.setdefault("query_rows", {})[name] = len(frame)
+
+        def raw_log_topics():
+            frame = read_transcripts(transcripts, columns=["timestamp", "session_id", "topic"]).to_pandas()
+            month = frame["timestamp"].dt.month
+            frame["period"] = (frame["timestamp"].dt.year.astype(str) + " "
+                               + np.where(month >= 8, "Fall", np.where(month >= 6, "Summer", "Spring")))
+            return frame.groupby(["period", "topic"], observed=True, dropna=False)["session_id"].agg(["size", "nunique"])
+        _, results["raw_log_topics_seconds"] = timed(raw_log_topics)
+        results["semesters"] = analytics.topic_distribution(by="semester")["period"].unique().tolist()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
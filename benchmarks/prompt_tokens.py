@@ -0,0 +1,108 @@
+"""Input tokens and latency of the original system prompt (v0) versus the templated one (v1).
+
+Token counts come from a `tokenizers` tokenizer (--tokenizer, a Hub repo id or
+a tokenizer.json path). If it cannot be loaded they fall back to the chars/4
+estimate, and the report says which counter was used. Time to first token is
+measured against the fake upstream with a per-prompt-token prefill delay.
+
+Usage: python benchmarks/prompt_tokens.py [--tokenizer Xenova/gpt-4] [--requests 20] [--prefill-delay 0.0005]
+"""
+import argparse
+import json
+import time
+
+import bench_util
+import fake_openai
+
+from tutor_prompt import PromptBuilder, TokenCounter, COMPLETION_PARAMS
+from upstream import UpstreamClient
+
+QUESTIONS = [
+    "How does buying equipment with a note affect the accounting equation?",
+    "What does a current ratio of 1.5 say about liquidity?",
+    "Where does net income show up on the balance sheet and cash flow statement?",
+    "What is the present value of $10,000 received in 3 years at 5% interest?",
+    "What amount of stock option compensation expense should be recognized in 2021?",
+]
+
+CONVERSATION = [
+    ("What is the present value of $10,000 received in 3 years at 5% interest?",
+     "Let's work it out. First question: are we looking for a present value or a future value?"),
+    ("Present value", "Excellent! What formula connects a future amount to its present value?"),
+    ("PV = FV / (1 + r)^n", "Perfect! Which values of r and n should we use?"),
+]
+
+
+def conversation_requests():
+    """(user_prompt, history) for every turn of a short tutoring conversation"""
+    history = []
+    for question, reply in CONVERSATION:
+        yield question, list(history)
+        history += [{"role": "user", "content": question}, {"role": "assistant", "content": reply}]
+
+
+def token_report(builder):
+    first_turns = [builder.report(question) for question in QUESTIONS]
+    turns = [builder.report(prompt, history) for prompt, history in conversation_requests()]
+    return {
+        "first_turn_mean": round(sum(r["total"] for r in first_turns) / len(first_turns), 1),
+        "first_turns": {r["topic"]: r["total"] for r in first_turns},
+        "conversation_total": sum(r["total"] for r in turns),
+        "system_prefix": builder.prefix_tokens,
+    }
+
+
+def build_time(builder, repeat):
+    """Mean microseconds to assemble the messages for one request"""
+    requests = [(question, None) for question in QUESTIONS] + list(conversation_requests())
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for prompt, history in requests:
+            builder.build(prompt, history)
+    return round(1e6 * (time.perf_counter() - start) / (repeat * len(requests)), 2)
+
+
+def time_to_first_token(client, builder, requests):
+    latencies = []
+    for i in range(requests):
+        messages = builder.build(QUESTIONS[i % len(QUESTIONS)])
+        start = time.perf_counter()
+        stream = client.stream_chat(messages, **dict(COMPLETION_PARAMS, max_tokens=5))
+        next(stream)
+        latencies.append(time.perf_counter() - start)
+        stream.close()
+    return bench_util.summarize(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokenizer", default="Xenova/gpt-4")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--prefill-delay", type=float, default=0.0005)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    counter = TokenCounter(args.tokenizer)
+    builders = {version: PromptBuilder(version, counter=counter) for version in ("v0", "v1")}
+
+    base_url = fake_openai.start_in_thread(latency=args.latency, token_delay=0.0,
+                                           prefill_delay=args.prefill_delay)
+    bench_util.use_fake_upstream(base_url)
+    client = UpstreamClient("sk-fake-benchmark-key")
+
+    results = {"tokenizer": counter.name}
+    for version, builder in builders.items():
+        results[version] = {
+            "tokens": token_report(builder),
+            "build_us": build_time(builder, args.repeat),
+            "time_to_first_token": time_to_first_token(client, builder, args.requests),
+        }
+    v0, v1 = results["v0"]["tokens"], results["v1"]["tokens"]
+    results["first_turn_token_reduction"] = round(1 - v1["first_turn_mean"] / v0["first_turn_mean"], 3)
+    results["conversation_token_reduction"] = round(1 - v1["conversation_total"] / v0["conversation_total"], 3)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Latency of well-behaved students while other clients hammer /chat.
+
+Runs the Flask app under gunicorn (4 sync workers, the production default)
+against the fake upstream, in three scenarios:
+- baseline: only the well-behaved students, limits on
+- abuse, limits off: the same students plus scripted abusers, RATE_LIMIT_ENABLED=false
+- abuse, limits on: the same, with the SQLite/flock backend shared by the workers
+
+Each student asks a question, waits for the answer, then thinks for
+--think-time seconds. Each abuser sends requests back to back with no pause
+from --abuser-connections connections. Every client has its own address,
+passed in X-Forwarded-For with RATE_LIMIT_TRUST_PROXY=true.
+
+Usage: python benchmarks/rate_limit_abuse.py [--students 10] [--abusers 2] [--duration 30]
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import bench_util
+import fake_openai
+
+import httpx
+
+
+async def run_load(url, students, abusers, abuser_connections, duration, think_time):
+    results = {"students": {"latencies": [], "statuses": {}}, "abusers": {"latencies": [], "statuses": {}}}
+    stop_at = time.perf_counter() + duration
+
+    async def client(client, kind, address, pause):
+        outcome = results[kind]
+        session_id = None
+        turn = 0
+        while time.perf_counter() < stop_at:
+            payload = {"message": f"How do I calculate the current ratio? ({address}, turn {turn})"}
+            if session_id:
+                payload["session_id"] = session_id
+            start = time.perf_counter()
+            try:
+                response = await client.post(f"{url}/chat", json=payload, headers={"X-Forwarded-For": address})
+                status = str(response.status_code)
+                if response.status_code == 200:
+                    outcome["latencies"].append(time.perf_counter() - start)
+                    session_id = response.json().get("session_id")
+                elif response.status_code == 429 and kind == "abusers":
+                    # A scripted client ignoring Retry-After
+                    pass
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            outcome["statuses"][status] = outcome["statuses"].get(status, 0) + 1
+            turn += 1
+            if pause:
+                await asyncio.sleep(pause)
+
+    connections = students + abusers * abuser_connections
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(limits=limits, timeout=300) as http:
+        tasks = [client(http, "students", f"10.0.1.{i}", think_time) for i in range(students)]
+        tasks += [client(http, "abusers", f"10.0.2.{i}", 0)
+                  for i in range(abusers) for _ in range(abuser_connections)]
+        await asyncio.gather(*tasks)
+
+    summary = {}
+    for kind, outcome in results.items():
+        if not sum(outcome["statuses"].values()):
+            continue
+        summary[kind] = bench_util.summarize(outcome["latencies"])
+        summary[kind]["statuses"] = outcome["statuses"]
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=10)
+    parser.add_argument("--think-time", type=float, default=3.0)
+    parser.add_argument("--abusers", type=int, default=2)
+    parser.add_argument("--abuser-connections", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--tokens", type=int, default=50)
+    args = parser.parse_args()
+
+    upstream, upstream_url = fake_openai.start_in_subprocess(latency=args.latency, token_delay=0.0,
+                                                             tokens=args.tokens)
+    scenarios = {
+        "baseline": (0, "true"),
+        "abuse_limits_off": (args.abusers, "false"),
+        "abuse_limits_on": (args.abusers, "true"),
+    }
+    results = {}
+    try:
+        for name, (abusers, enabled) in scenarios.items():
+            with tempfile.TemporaryDirectory() as tmp:
+                env = {
+                    "RATE_LIMIT_ENABLED": enabled,
+                    "RATE_LIMIT_BACKEND": "sqlite",
+                    "RATE_LIMIT_DB_PATH": os.path.join(tmp, "ratelimit.db"),
+                    "RATE_LIMIT_SLOTS_DIR": os.path.join(tmp, "slots"),
+                    "RATE_LIMIT_TRUST_PROXY": "true",
+                }
+                process, url = bench_util.start_gunicorn("app:app", "sync", args.workers, fake_openai.free_port(),
+                                                         upstream_url, env_overrides=env)
+                try:
+                    results[name] = asyncio.run(run_load(url, args.students, abusers, args.abuser_connections,
+                                                         args.duration, args.think_time))
+                finally:
+                    process.terminate()
+                    process.wait()
+    finally:
+        upstream.terminate()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Latency and upstream calls for repeated homework questions, with and without the cache.
+
+Replays a Zipf-distributed stream of textbook problems through /chat against
+the fake upstream. A share of the pastes carry small edits (extra whitespace,
+a changed letter) to exercise the near-duplicate mode.
+
+Usage: python benchmarks/response_cache.py [--requests 300] [--problems 40]
+"""
+import argparse
+import json
+import random
+import time
+
+import bench_util
+import fake_openai
+
+PROBLEM = ("Problem {n}: In order to retain certain key executives, Company {n} granted them incentive "
+           "stock options on December 31, 2020. {shares} options were granted at an option price of "
+           "${price} per share. The options were granted as compensation for executives' services to be "
+           "rendered over a {years}-year period. What amount of compensation expense should be recognized "
+           "for the year ended December 31, 2021 under the fair value method?")
+
+
+def make_workload(requests, problems, edit_rate, seed=7):
+    rng = random.Random(seed)
+    texts = [PROBLEM.format(n=n, shares=1000 * rng.randint(50, 300), price=rng.randint(10, 90),
+                            years=rng.randint(2, 5)) for n in range(problems)]
+    weights = [1.0 / (rank + 1) for rank in range(problems)]
+    workload = []
+    for text in rng.choices(texts, weights=weights, k=requests):
+        if rng.random() < edit_rate:
+            i = rng.randrange(len(text))
+            text = text[:i] + rng.choice(["  ", "x", ""]) + text[i + 1:]
+        workload.append(text)
+    return workload
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--problems", type=int, default=40)
+    parser.add_argument("--edit-rate", type=float, default=0.3)
+    parser.add_argument("--latency", type=float, default=0.3)
+    args = parser.parse_args()
+
+    bench_util.use_fake_upstream(fake_openai.start_in_thread(latency=args.latency, token_delay=0.0, tokens=100))
+    import app
+    from response_cache import ResponseCache
+
+    workload = make_workload(args.requests, args.problems, args.edit_rate)
+    modes = {
+        "no_cache": ResponseCache(max_entries=0),
+        "exact": ResponseCache(),
+        "near_duplicate": ResponseCache(near_duplicates=True),
+    }
+    client = app.app.test_client()
+    services = app.app.extensions["nuanswers"]
+    results = {}
+    for name, cache in modes.items():
+        services.response_cache = cache
+        latencies = []
+        for text in workload:
+            start = time.perf_counter()
+            client.post("/chat", json={"message": text})
+            latencies.append(time.perf_counter() - start)
+        result = bench_util.summarize(latencies)
+        result["upstream_calls"] = cache.misses
+        result["cache"] = cache.stats()
+        results[name] = result
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Top-k lookup latency of the worked-problem retrieval index at corpus scale.
+
+Synthesises a large corpus from the seed problems (varied figures, company
+names and industry words), builds the memory-mapped index once, then times
+searches with student-style questions, with and without a topic filter.
+
+Usage: python benchmarks/retrieval_index.py [--items 100000] [--queries 2000] [-k 3]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import bench_util
+
+from retrieval import DEFAULT_CORPUS, RetrievalIndex, build_index, read_corpus
+
+QUERIES = [
+    ("How do I find the present value of a bond that pays interest every year?", "time_value_money"),
+    ("What does the quick ratio leave out compared with the current ratio?", "financial_ratios"),
+    ("Where does net income go on the balance sheet?", "financial_statements"),
+    ("If I buy inventory on credit what happens to liabilities and assets?", "accounting_equation"),
+    ("How is depreciation handled in the cash flow statement indirect method?", "financial_statements"),
+    ("How many days does it take to collect receivables for a retailer?", "financial_ratios"),
+    ("What is the future value of an annuity with monthly compounding?", "time_value_money"),
+    ("Does paying dividends change equity in the accounting equation?", "accounting_equation"),
+]
+
+COMPANIES = ["Acme", "Birch", "Cobalt", "Delta", "Evergreen", "Falcon", "Granite", "Harbor", "Ivory", "Juniper"]
+
+
+def rss_kb(field):
+    """RssAnon (private heap) or RssFile (file-backed pages, shared with other workers) of this process"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def synthetic_items(seed_items, count, seed=7):
+    rng = random.Random(seed)
+    # Synthetic industry vocabulary so the corpus has a realistic long tail of terms
+    industry_words = ["".join(rng.choice("bcdfghklmnprstvz") + rng.choice("aeiou") for _ in range(4))
+                      for _ in range(20000)]
+    for i in range(count):
+        base = seed_items[i % len(seed_items)]
+        context = " ".join(rng.choice(industry_words) for _ in range(3))
+        figure = rng.randint(1, 900) * 1000
+        yield {
+            "id": f"synthetic-{i}",
+            "topic": base["topic"],
+            "difficulty": base["difficulty"],
+            "problem": f"{rng.choice(COMPANIES)} Corporation ({context}) reports ${figure:,}. {base['problem']}",
+            "hint": base["hint"],
+        }
+
+
+def time_queries(index, queries, k, with_topic):
+    latencies = []
+    for i in range(queries):
+        text, topic = QUERIES[i % len(QUERIES)]
+        start = time.perf_counter()
+        index.search(text, k=k, topic=topic if with_topic else None)
+        latencies.append(time.perf_counter() - start)
+    return bench_util.summarize(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args()
+
+    seed_items = read_corpus(DEFAULT_CORPUS)
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = os.path.join(tmp, "index")
+        start = time.perf_counter()
+        build_index(synthetic_items(seed_items, args.items), directory)
+        build_s = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+        anon_before, file_before = rss_kb("RssAnon"), rss_kb("RssFile")
+        start = time.perf_counter()
+        index = RetrievalIndex(directory)
+        open_s = time.perf_counter() - start
+
+        # Warm the page cache, as a long-running worker would have
+        time_queries(index, len(QUERIES), args.k, with_topic=False)
+        results = {
+            "items": len(index),
+            "terms": len(index.vocabulary),
+            "build_s": round(build_s, 2),
+            "index_mb": round(size / 2 ** 20, 1),
+            "open_ms": round(1000 * open_s, 2),
+            "search": time_queries(index, args.queries, args.k, with_topic=False),
+            "search_with_topic": time_queries(index, args.queries, args.k, with_topic=True),
+            "private_memory_growth_mb": round((rss_kb("RssAnon") - anon_before) / 1024, 1),
+            "shared_mapped_growth_mb": round((rss_kb("RssFile") - file_before) / 1024, 1),
+            "example": [(round(score, 3), item["problem"][-80:]) for score, item in index.search(QUERIES[0][0], k=args.k)],
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
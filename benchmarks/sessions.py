@@ -0,0 +1,81 @@
+"""Memory per session and lookup latency of the session store backends.
+
+Usage: python benchmarks/sessions.py [--sessions 10000] [--turns 6]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import bench_util
+
+from sessions import InMemorySessionBackend, SQLiteSessionBackend, SessionStore
+
+QUESTION = "A company purchases $1,000 of inventory on credit. How does this affect the accounting equation?"
+ANSWER = "Let's think about this step by step. Which side of the equation changes first, and why?"
+
+
+def fill(store, count, turns):
+    session_ids = [store.new_session_id() for _ in range(count)]
+    for session_id in session_ids:
+        for turn in range(turns):
+            # Distinct strings per turn, as real conversations don't share text
+            store.append_turn(session_id, f"{QUESTION} ({turn})", f"{ANSWER} ({turn})")
+    return session_ids
+
+
+def time_lookups(store, session_ids, lookups):
+    latencies = []
+    for session_id in random.choices(session_ids, k=lookups):
+        start = time.perf_counter()
+        store.get_history(session_id)
+        latencies.append(time.perf_counter() - start)
+    return bench_util.summarize(latencies)
+
+
+def time_appends(store, session_ids, appends):
+    latencies = []
+    for session_id in random.choices(session_ids, k=appends):
+        start = time.perf_counter()
+        store.append_turn(session_id, QUESTION, ANSWER)
+        latencies.append(time.perf_counter() - start)
+    return bench_util.summarize(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--turns", type=int, default=6)
+    parser.add_argument("--lookups", type=int, default=20000)
+    args = parser.parse_args()
+
+    results = {}
+
+    tracemalloc.start()
+    store = SessionStore(InMemorySessionBackend(max_sessions=args.sessions))
+    session_ids = fill(store, args.sessions, args.turns)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results["memory"] = {
+        "bytes_per_session": round(current / args.sessions),
+        "get_history": time_lookups(store, session_ids, args.lookups),
+        "append_turn": time_appends(store, session_ids, args.lookups),
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SessionStore(SQLiteSessionBackend(os.path.join(tmp, "sessions.db"), max_sessions=args.sessions))
+        session_ids = fill(store, args.sessions, args.turns)
+        results["sqlite"] = {
+            "bytes_per_session": round(os.path.getsize(os.path.join(tmp, "sessions.db")) / args.sessions),
+            "get_history": time_lookups(store, session_ids, args.lookups),
+            "append_turn": time_appends(store, session_ids, args.lookups),
+        }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Cold start and per-worker memory of the Flask app under gunicorn.
+
+Each mode starts gunicorn with N sync workers and records:
+- the time from launch until every worker has loaded the app and is serving
+- each worker's RSS, PSS and USS after a short warm-up. Shared pages count
+  in full in RSS, split between the sharing processes in PSS, and not at all
+  in USS (private memory). USS is what each extra worker really costs.
+
+Modes:
+- preload: the current tree with preload_app (the default)
+- no_preload: the current tree with GUNICORN_PRELOAD=false
+- baseline: with --baseline-rev, that git revision checked out in a
+  temporary worktree, run with its own gunicorn_config.py
+
+Usage: python benchmarks/startup.py [--workers 4] [--runs 3] [--baseline-rev HEAD~1]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+
+import bench_util
+import fake_openai
+
+import httpx
+
+# Wraps a tree's own gunicorn config and logs when each worker has loaded the app
+WRAPPER_CONFIG = """
+__file__ = {path!r}
+exec(compile(open(__file__).read(), __file__, "exec"))
+
+def post_worker_init(worker):
+    worker.log.info("startup-benchmark worker ready %s", worker.pid)
+"""
+
+
+def memory_kb(pid):
+    """Rss, Pss and private (USS) memory of a process, in kB"""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                fields[parts[0][:-1]] = int(parts[1])
+    return {"rss": fields["Rss"], "pss": fields["Pss"],
+            "uss": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)}
+
+
+def worker_pids(master_pid):
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def run_once(tree, workers, upstream_url, warmup, env_overrides):
+    with tempfile.TemporaryDirectory() as tmp:
+        config = os.path.join(tmp, "gunicorn_wrapper.py")
+        with open(config, "w") as f:
+            f.write(WRAPPER_CONFIG.format(path=os.path.join(tree, "gunicorn_config.py")))
+        log_path = os.path.join(tmp, "gunicorn.log")
+        with open(log_path, "w") as log:
+            started = time.perf_counter()
+            process, url = bench_util.start_gunicorn("app:app", "sync", workers, fake_openai.free_port(),
+                                                     upstream_url, env_overrides=env_overrides,
+                                                     cwd=tree, config=config, stderr=log)
+        try:
+            while True:
+                with open(log_path) as f:
+                    ready = f.read().count("startup-benchmark worker ready")
+                if ready >= workers:
+                    break
+                if time.perf_counter() - started > 120:
+                    raise RuntimeError(f"only {ready} of {workers} workers became ready")
+                time.sleep(0.01)
+            ready_s = time.perf_counter() - started
+
+            with httpx.Client(timeout=60) as client:
+                for i in range(warmup):
+                    client.post(f"{url}/chat", json={"message": f"What is the quick ratio? ({i})"})
+            usage = [memory_kb(pid) for pid in worker_pids(process.pid)]
+            master = memory_kb(process.pid)
+        finally:
+            process.terminate()
+            process.wait()
+    return ready_s, usage, master
+
+
+def measure(tree, workers, runs, upstream_url, warmup, env_overrides=None):
+    ready, per_worker, masters = [], [], []
+    for _ in range(runs):
+        ready_s, usage, master = run_once(tree, workers, upstream_url, warmup, env_overrides)
+        ready.append(ready_s)
+        per_worker.extend(usage)
+        masters.append(master)
+    mean_mb = lambda rows, field: round(statistics.fmean(row[field] for row in rows) / 1024, 1)
+    return {
+        "all_workers_ready_s": round(statistics.median(ready), 3),
+        "worker_rss_mb": mean_mb(per_worker, "rss"),
+        "worker_pss_mb": mean_mb(per_worker, "pss"),
+        "worker_uss_mb": mean_mb(per_worker, "uss"),
+        "master_rss_mb": mean_mb(masters, "rss"),
+        "total_pss_mb": round(mean_mb(per_worker, "pss") * workers + mean_mb(masters, "pss"), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=20, help="/chat requests before memory is read")
+    parser.add_argument("--baseline-rev", help="git revision to compare against, e.g. HEAD~1")
+    args = parser.parse_args()
+
+    # Every tree reads the same prebuilt retrieval index, so no mode pays for building it
+    from retrieval import DEFAULT_INDEX_DIR, load_retrieval_index
+    load_retrieval_index()
+    env = {"RETRIEVAL_INDEX_DIR": DEFAULT_INDEX_DIR}
+
+    upstream, upstream_url = fake_openai.start_in_subprocess(latency=0.05, token_delay=0.0, tokens=50)
+    results = {}
+    try:
+        if args.baseline_rev:
+            with tempfile.TemporaryDirectory() as tmp:
+                tree = os.path.join(tmp, "baseline")
+                subprocess.run(["git", "worktree", "add", "--detach", tree, args.baseline_rev],
+                               cwd=bench_util.REPO_ROOT, check=True, capture_output=True)
+                try:
+                    results[f"baseline ({args.baseline_rev})"] = measure(
+                        tree, args.workers, args.runs, upstream_url, args.warmup, env)
+                finally:
+                    subprocess.run(["git", "worktree", "remove", "--force", tree], cwd=bench_util.REPO_ROOT)
+        results["no_preload"] = measure(bench_util.REPO_ROOT, args.workers, args.runs, upstream_url, args.warmup,
+                                        dict(env, GUNICORN_PRELOAD="false"))
+        results["preload"] = measure(bench_util.REPO_ROOT, args.workers, args.runs, upstream_url, args.warmup,
+                                     dict(env, GUNICORN_PRELOAD="true"))
+    finally:
+        upstream.terminate()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
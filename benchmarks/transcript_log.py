@@ -0,0 +1,153 @@
+"""Transcript log write throughput, read speed and overhead on /chat.
+
+- write: --turns synthetic turns through TranscriptLog.record(). Reports
+  the caller's cost per record() call, the writer's sustained turns/s and
+  MB/s, and bytes per turn on disk. The baseline is a synchronous JSON
+  lines append, flushed per turn, as an in-request logger would do it.
+- read: every segment memory-mapped into one Arrow table and converted to
+  pandas, against pandas.read_json of the JSON lines file
+- chat: /chat per-request latency through the Flask test client, with the
+  log on and off. Turns are answered by the local tier, so the log's share
+  of the request is as large as it gets.
+
+Usage: python benchmarks/transcript_log.py [--turns 200000] [--requests 3000]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import bench_util
+
+import pandas as pd
+
+from transcripts import TranscriptLog, read_transcripts, segment_paths
+
+TIERS = ["local", "llm", "llm", "cache", "fallback"]
+TOPICS = [None, "accounting_equation", "financial_ratios", "financial_statements", "time_value_money"]
+STATES = ["initial", "topic_selected", "in_discussion", "practice"]
+WORDS = ("the ratio of current assets to current liabilities shows liquidity because we divide "
+         "what the company owns by what it owes within a year so what do you think").split()
+
+
+def make_turns(count, seed=5):
+    rng = random.Random(seed)
+    sessions = [f"{rng.getrandbits(128):032x}" for _ in range(max(1, count // 8))]
+    return [(rng.choice(sessions), " ".join(rng.choices(WORDS, k=rng.randint(5, 25))),
+             " ".join(rng.choices(WORDS, k=rng.randint(40, 120))), rng.choice(TIERS), rng.choice(TOPICS),
+             rng.choice(STATES), rng.randint(0, 3), rng.uniform(0.1, 3000)) for _ in range(count)]
+
+
+def bench_write(directory, turns, segment_mb):
+    log = TranscriptLog(directory, segment_bytes=int(segment_mb * 2**20))
+    start = time.perf_counter()
+    for turn in turns:
+        log.record(*turn)
+    record_s = time.perf_counter() - start
+    log.close(timeout=600)
+    total_s = time.perf_counter() - start
+    size = sum(os.path.getsize(path) for path in segment_paths(directory))
+    return {
+        "record_call_us": round(1e6 * record_s / len(turns), 3),
+        "turns_per_sec": round(len(turns) / total_s),
+        "mb_per_sec": round(size / 2**20 / total_s, 1),
+        "bytes_per_turn": round(size / len(turns), 1),
+        "segments": len(segment_paths(directory)),
+        "batches": log.batches,
+        "dropped": log.dropped,
+    }
+
+
+def bench_jsonl_write(path, turns):
+    fields = ("session_id", "user_message", "response", "tier", "topic", "conversation_state", "hints_given",
+              "latency_ms")
+    start = time.perf_counter()
+    with open(path, "w", encoding="utf-8") as f:
+        for turn in turns:
+            f.write(json.dumps(dict(zip(fields, turn), timestamp=time.time())) + "\n")
+            f.flush()
+    elapsed = time.perf_counter() - start
+    return {
+        "record_call_us": round(1e6 * elapsed / len(turns), 3),
+        "turns_per_sec": round(len(turns) / elapsed),
+        "bytes_per_turn": round(os.path.getsize(path) / len(turns), 1),
+    }
+
+
+def bench_read(directory, jsonl_path):
+    start = time.perf_counter()
+    table = read_transcripts(directory)
+    mapped_s = time.perf_counter() - start
+    frame = table.to_pandas()
+    arrow_s = time.perf_counter() - start
+    start = time.perf_counter()
+    baseline = pd.read_json(jsonl_path, lines=True)
+    jsonl_s = time.perf_counter() - start
+    assert len(frame) == len(baseline)
+    return {
+        "arrow_mmap_table_ms": round(1000 * mapped_s, 1),
+        "arrow_to_pandas_ms": round(1000 * arrow_s, 1),
+        "jsonl_read_json_ms": round(1000 * jsonl_s, 1),
+        "rows": len(frame),
+    }
+
+
+def bench_chat(requests_count, directory):
+    os.environ["TRANSCRIPTS_DIR"] = directory
+    import app
+    messages = ["financial ratios please",
+                "The ratio divides current assets by current liabilities, so if it is above one then liquidity is good"]
+    results = {}
+    for enabled in ("false", "true", "false", "true"):
+        os.environ["TRANSCRIPTS_ENABLED"] = enabled
+        flask_app = app.create_app()
+        client = flask_app.test_client()
+        latencies, session_id = [], None
+        for i in range(requests_count):
+            payload = {"message": messages[min(i % 20, 1)]}
+            if i % 20:
+                payload["session_id"] = session_id
+            start = time.perf_counter()
+            body = client.post("/chat", json=payload).get_json()
+            latencies.append(time.perf_counter() - start)
+            assert body["tier"] == "local", body
+            session_id = body["session_id"]
+        if flask_app.extensions["nuanswers"].transcripts is not None:
+            flask_app.extensions["nuanswers"].transcripts.close()
+        # The second run of each setting is kept: the first warms up the interpreter
+        results["transcripts_on" if enabled == "true" else "transcripts_off"] = bench_util.summarize(latencies)
+    on, off = results["transcripts_on"]["mean_ms"], results["transcripts_off"]["mean_ms"]
+    results["overhead_us_per_request"] = round(1000 * (on - off), 1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=200000)
+    parser.add_argument("--segment-mb", type=float, default=16, help="rotate segments at this size")
+    parser.add_argument("--requests", type=int, default=3000, help="/chat requests per setting")
+    args = parser.parse_args()
+
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    bench_util.use_fake_upstream("http://127.0.0.1:9/v1")
+    directory = tempfile.mkdtemp(prefix="transcripts-bench-")
+    try:
+        turns = make_turns(args.turns)
+        jsonl_path = os.path.join(directory, "baseline.jsonl")
+        results = {
+            "turns": args.turns,
+            "write": bench_write(os.path.join(directory, "log"), turns, args.segment_mb),
+            "write_jsonl_baseline": bench_jsonl_write(jsonl_path, turns),
+        }
+        results["read"] = bench_read(os.path.join(directory, "log"), jsonl_path)
+        results["chat"] = bench_chat(args.requests, os.path.join(directory, "chat"))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Time-to-first-token of /chat versus /chat/stream against a fake upstream.
+
+Usage: python benchmarks/ttft.py [--requests 20] [--latency 0.5] [--token-delay 0.02]
+"""
+import argparse
+import json
+import time
+
+import bench_util
+import fake_openai
+
+import requests
+
+
+def time_blocking(session, url, prompt):
+    """Returns (first_text_s, total_s) for the blocking JSON endpoint"""
+    start = time.perf_counter()
+    response = session.post(f"{url}/chat", json={"message": prompt})
+    response.raise_for_status()
+    elapsed = time.perf_counter() - start
+    # Nothing is visible until the whole body has arrived
+    return elapsed, elapsed
+
+
+def time_streaming(session, url, prompt):
+    """Returns (first_token_s, total_s) for the SSE endpoint"""
+    start = time.perf_counter()
+    first = None
+    with session.post(f"{url}/chat/stream", json={"message": prompt}, stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if first is None and line and line.startswith("data:") and '"delta"' in line:
+                first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--tokens", type=int, default=200)
+    args = parser.parse_args()
+
+    bench_util.use_fake_upstream(fake_openai.start_in_thread(
+        latency=args.latency, token_delay=args.token_delay, tokens=args.tokens))
+    import app
+    url = bench_util.serve_wsgi_in_thread(app.app, fake_openai.free_port())
+
+    session = requests.Session()
+    results = {}
+    for name, measure in (("chat", time_blocking), ("chat_stream", time_streaming)):
+        firsts, totals = [], []
+        for i in range(args.requests):
+            first, total = measure(session, url, f"Explain the accounting equation ({i})")
+            firsts.append(first)
+            totals.append(total)
+        results[name] = {"time_to_first_token": bench_util.summarize(firsts),
+                         "total": bench_util.summarize(totals)}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Microbenchmark of TutorRules phrase checks on long responses.
+
+Compares per-pattern substring scans with the compiled single-pass matcher,
+both for finding every direct-answer match with its offset in a whole
+response and when checking a stream chunk by chunk (substring scans have to
+rescan everything received so far).
+
+Usage: python benchmarks/tutor_rules.py [--words 4000] [--repeat 50]
+"""
+import argparse
+import json
+import random
+import time
+
+import bench_util  # noqa: F401  (puts the repo root on sys.path)
+
+from NuAnswers import TutorRules
+
+VOCABULARY = ("the company what approach we should think about balance sheet assets equity liabilities "
+              "you need consider the ratio of current assets to liabilities how would this affect net "
+              "income cash flow statement answer result method").split()
+
+
+def legacy_find_all(rules, response):
+    """All forbidden matches with offsets using repeated str.find"""
+    response_lower = response.lower()
+    matches = []
+    for pattern in rules.forbidden_patterns:
+        start = response_lower.find(pattern)
+        while start != -1:
+            matches.append((start, pattern))
+            start = response_lower.find(pattern, start + 1)
+    return sorted(matches)
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return round((time.perf_counter() - start) / repeat * 1000, 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--words", type=int, default=4000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--chunk", type=int, default=20, help="characters per streamed chunk")
+    args = parser.parse_args()
+
+    rules = TutorRules()
+    rng = random.Random(1)
+    words = [rng.choice(VOCABULARY) for _ in range(args.words)]
+    # A typical guiding response: long, a guiding question, a direct answer slipped in near the end
+    response = " ".join(words) + " what do you think? so the answer is 42."
+    chunks = [response[i:i + args.chunk] for i in range(0, len(response), args.chunk)]
+
+    assert legacy_find_all(rules, response) == rules.find_direct_answers(response)
+
+    def legacy_stream():
+        received = ""
+        for chunk in chunks:
+            received += chunk
+            legacy_find_all(rules, received)
+
+    def compiled_stream():
+        scanner = rules.direct_answer_scanner()
+        for chunk in chunks:
+            scanner.feed(chunk)
+
+    results = {
+        "response_chars": len(response),
+        "validate_ms": timed(lambda: rules.validate_response(response), args.repeat),
+        "find_all_ms": {"legacy": timed(lambda: legacy_find_all(rules, response), args.repeat),
+                        "compiled": timed(lambda: rules.find_direct_answers(response), args.repeat)},
+        "stream_ms": {"chunks": len(chunks),
+                      "legacy_rescan": timed(legacy_stream, max(1, args.repeat // 25)),
+                      "compiled_incremental": timed(compiled_stream, args.repeat)},
+    }
+    results["find_all_ms"]["speedup"] = round(
+        results["find_all_ms"]["legacy"] / results["find_all_ms"]["compiled"], 2)
+    results["stream_ms"]["speedup"] = round(
+        results["stream_ms"]["legacy_rescan"] / results["stream_ms"]["compiled_incremental"], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
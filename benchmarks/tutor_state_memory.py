@@ -0,0 +1,112 @@
+"""Memory of many concurrent tutoring sessions, before and after splitting out TutorState.
+
+Keeps --sessions sessions alive, each partway into a practice problem, and
+measures the memory they hold with tracemalloc:
+- baseline: one AccountingFinanceTutor per session as in --baseline-rev
+  (loaded from git), which copied the learning path, hints, keywords and
+  rules into every instance
+- tutor: one current AccountingFinanceTutor per session around its state
+- state: only the TutorState per session, sharing one tutor's content
+- packed: only TutorState.to_bytes() per session, as an external store keeps it
+
+Also times to_bytes()/from_bytes() and rebuilding a tutor around a stored
+state, which a server pays for every message.
+
+Usage: python benchmarks/tutor_state_memory.py [--sessions 100000] [--baseline-rev HEAD~1]
+"""
+import argparse
+import gc
+import json
+import random
+import subprocess
+import time
+import tracemalloc
+import types
+
+import bench_util
+
+from NuAnswers import AccountingFinanceTutor, TutorState
+
+MESSAGES = ["financial ratios please", "practice hard", "hint please"]
+
+
+def load_baseline(revision):
+    """NuAnswers.py as of a git revision, as a module"""
+    source = subprocess.run(["git", "show", f"{revision}:NuAnswers.py"], cwd=bench_util.REPO_ROOT,
+                            capture_output=True, text=True, check=True).stdout
+    module = types.ModuleType("NuAnswers_baseline")
+    exec(compile(source, f"{revision}:NuAnswers.py", "exec"), module.__dict__)
+    return module
+
+
+def measure(make, count):
+    """Bytes held per session by `count` objects from make(index), and the objects"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = [make(index) for index in range(count)]
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return held / count, sessions
+
+
+def in_practice(tutor):
+    for message in MESSAGES:
+        tutor.evaluate_response(message)
+    return tutor
+
+
+def per_op_us(fn, items):
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return round(1e6 * (time.perf_counter() - start) / len(items), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--baseline-rev", default="HEAD~1", help="git revision of the per-session tutor baseline")
+    args = parser.parse_args()
+
+    baseline_module = load_baseline(args.baseline_rev)
+    template = in_practice(AccountingFinanceTutor(seed=0))
+
+    # The session list itself (8 bytes per entry) is counted in every row
+    results = {}
+    baseline_bytes, sessions = measure(
+        lambda index: in_practice(baseline_module.AccountingFinanceTutor(seed=index)), args.sessions)
+    results["baseline"] = round(baseline_bytes)
+    del sessions
+    tutor_bytes, sessions = measure(lambda index: in_practice(AccountingFinanceTutor(seed=index)), args.sessions)
+    results["tutor"] = round(tutor_bytes)
+    del sessions
+    state_bytes, states = measure(lambda index: TutorState.from_bytes(template.state.to_bytes()), args.sessions)
+    results["state"] = round(state_bytes)
+    packed_bytes, packed = measure(lambda index: template.state.to_bytes()[:], args.sessions)
+    results["packed"] = round(packed_bytes)
+
+    # Every packed session round-trips to an equal state
+    assert all(TutorState.from_bytes(data) == template.state for data in packed[:1000])
+    sample = random.Random(0).sample(states, min(len(states), 20000))
+    timings = {
+        "to_bytes_us": per_op_us(TutorState.to_bytes, sample),
+        "from_bytes_us": per_op_us(TutorState.from_bytes, [state.to_bytes() for state in sample]),
+        "tutor_from_state_us": per_op_us(lambda state: AccountingFinanceTutor(state=state), sample),
+    }
+
+    print(json.dumps({
+        "sessions": args.sessions,
+        "baseline_rev": args.baseline_rev,
+        "packed_size": len(template.state.to_bytes()),
+        "bytes_per_session": results,
+        "total_mb": {name: round(value * args.sessions / 2**20, 1) for name, value in results.items()},
+        "reduction_vs_baseline": {name: round(results["baseline"] / value, 1)
+                                  for name, value in results.items() if name != "baseline"},
+        **timings,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Share of /chat turns the rule-based local tier answers, and the latency of each tier.
+
+Simulated students hold scripted conversations: naming or asking about a
+topic, answering with or without reasoning, asking for hints and practice
+problems. Each turn's tier (local, llm, cache or fallback) comes from the
+response, and server_mean_ms is the time /chat itself spent per tier. The
+same scripts run in three phases:
+- llm_only: the local tier disabled, as before it existed
+- tiered: the local tier in front of a healthy fake upstream
+- upstream_down: the fake upstream stopped, so the breaker opens and the
+  local tier answers everything
+
+Usage: python benchmarks/tutor_tiers.py [--students 40] [--turns 8] [--latency 0.5]
+"""
+import argparse
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bench_util
+import fake_openai
+
+import requests
+
+TOPIC_NAMES = ["financial ratios please", "let's do the accounting equation", "time value of money",
+               "I want to work on financial statements"]
+QUESTIONS = ["How do I calculate the current ratio?", "Why does the accounting equation always balance?",
+             "What's the difference between present value and future value?",
+             "Where does depreciation show up in the financial statements?"]
+GOOD_ANSWERS = ["I think assets equal liabilities plus equity because every transaction is balanced, "
+                "therefore equity changes",
+                "The ratio divides current assets by current liabilities, so if it is above one then liquidity is good",
+                "Since interest compounds, the present value is lower than the future value, thus we discount",
+                "The income statement feeds the balance sheet because net income flows into equity, "
+                "therefore the statements connect"]
+WEAK_ANSWERS = ["not sure", "maybe the second one", "I don't really get it", "is it 500?"]
+
+
+def script(rng, turns):
+    """A student's messages: opening, then a mix of answers, hints, practice and questions"""
+    messages = [rng.choice(TOPIC_NAMES) if rng.random() < 0.6 else rng.choice(QUESTIONS)]
+    for _ in range(turns - 1):
+        kind = rng.choices(["good", "weak", "hint", "practice", "question"], [3, 3, 2, 1, 1])[0]
+        if kind == "good":
+            messages.append(rng.choice(GOOD_ANSWERS))
+        elif kind == "weak":
+            messages.append(rng.choice(WEAK_ANSWERS))
+        elif kind == "hint":
+            messages.append("can I get a hint?")
+        elif kind == "practice":
+            messages.append(f"give me a {rng.choice(['easy', 'medium', 'hard'])} practice problem")
+        else:
+            messages.append(rng.choice(QUESTIONS))
+    return messages
+
+
+def converse(url, messages, number):
+    session = requests.Session()
+    session_id, turns = None, []
+    for turn, message in enumerate(messages):
+        # Questions are made distinct so the response cache does not answer them
+        payload = {"message": f"{message} ({number}.{turn})" if "?" in message else message}
+        if session_id:
+            payload["session_id"] = session_id
+        start = time.perf_counter()
+        body = session.post(f"{url}/chat", json=payload).json()
+        turns.append((body.get("tier", "error"), time.perf_counter() - start))
+        session_id = body.get("session_id", session_id)
+    return turns
+
+
+def run_phase(url, scripts, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        turns = [turn for result in pool.map(converse, [url] * len(scripts), scripts, range(len(scripts)))
+                 for turn in result]
+    elapsed = time.perf_counter() - start
+    by_tier = {}
+    for tier, seconds in turns:
+        by_tier.setdefault(tier, []).append(seconds)
+    local = len(by_tier.get("local", [])) + len(by_tier.get("fallback", []))
+    return {
+        "turns": len(turns),
+        "local_fraction": round(local / len(turns), 3),
+        "by_tier": {tier: bench_util.summarize(seconds) for tier, seconds in sorted(by_tier.items())},
+        "all_turns": bench_util.summarize([seconds for _, seconds in turns]),
+        "wall_s": round(elapsed, 2),
+    }
+
+
+def upstream_requests(upstream_url):
+    return requests.get(f"{upstream_url}/fake/stats").json()["requests"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=40)
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.5, help="fake upstream seconds to first token")
+    parser.add_argument("--tokens", type=int, default=50)
+    args = parser.parse_args()
+
+    upstream, upstream_url = fake_openai.start_in_subprocess(latency=args.latency, tokens=args.tokens)
+    bench_util.use_fake_upstream(upstream_url)
+    # Every student shares one address
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    import app
+    local_tier = app.app.extensions["nuanswers"].local_tier
+    url = bench_util.serve_wsgi_in_thread(app.app, fake_openai.free_port())
+
+    rng = random.Random(7)
+    scripts = [script(rng, args.turns) for _ in range(args.students)]
+    results = {}
+    try:
+        for phase in ("llm_only", "tiered"):
+            local_tier.enabled = phase == "tiered"
+            before = upstream_requests(upstream_url)
+            results[phase] = run_phase(url, scripts, args.concurrency)
+            results[phase]["upstream_requests"] = upstream_requests(upstream_url) - before
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+    results["upstream_down"] = run_phase(url, scripts, args.concurrency)
+    results["upstream_down"]["breaker"] = local_tier.health.stats()
+    # Time inside the app, without HTTP: how long each tier takes to produce a reply
+    results["server_mean_ms"] = local_tier.stats()["mean_ms"]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
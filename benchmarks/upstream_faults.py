@@ -0,0 +1,70 @@
+"""Tail latency and success rate of the upstream client against injected faults.
+
+The fake upstream fails a share of requests with 429/500 and stalls another
+share before the first token. Each client configuration streams the same
+number of completions with a pool of concurrent callers.
+
+Usage: python benchmarks/upstream_faults.py [--requests 400] [--error-rate 0.1] [--slow-rate 0.05]
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bench_util
+import fake_openai
+
+from upstream import UpstreamClient, UpstreamConfig
+
+CONFIGS = {
+    "no_retries": UpstreamConfig(max_attempts=1),
+    "retries": UpstreamConfig(max_attempts=4, backoff_initial=0.1, backoff_max=1.0),
+    "retries_and_hedging": UpstreamConfig(max_attempts=4, backoff_initial=0.1, backoff_max=1.0,
+                                          hedge=True, hedge_min_samples=20),
+}
+
+
+def run(client, requests, concurrency):
+    messages = [{"role": "user", "content": "What is the quick ratio?"}]
+
+    def one(_):
+        start = time.perf_counter()
+        try:
+            client.complete(messages, model="gpt-4-turbo-preview", max_tokens=50)
+            return time.perf_counter() - start
+        except Exception:
+            return None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, range(requests)))
+    latencies = [o for o in outcomes if o is not None]
+    result = bench_util.summarize(latencies)
+    result["success_rate"] = round(len(latencies) / requests, 4)
+    result["upstream"] = client.stats_dict()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-latency", type=float, default=3.0)
+    args = parser.parse_args()
+
+    upstream, base_url = fake_openai.start_in_subprocess(
+        latency=0.1, token_delay=0.001, tokens=50, error_rate=args.error_rate,
+        slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+    bench_util.use_fake_upstream(base_url)
+    results = {}
+    try:
+        for name, config in CONFIGS.items():
+            results[name] = run(UpstreamClient("sk-fake-benchmark-key", config), args.requests, args.concurrency)
+    finally:
+        upstream.terminate()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+
+from response_cache import normalize_prompt
+
+def flight_key(messages, params):
+    """Key shared by requests that would send the same conversation upstream"""
+    payload = json.dumps({
+        "messages": [[m["role"], normalize_prompt(m["content"])] for m in messages],
+        "params": params
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class CoalescingStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self, in_flight):
+        total = self.leaders + self.coalesced
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_rate": round(self.coalesced / total, 4) if total else 0.0,
+            "in_flight": in_flight
+        }
+
+class _Flight:
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.cancelled = False
+        self.condition = threading.Condition()
+
+class SingleFlight:
+    """Shares one upstream stream between concurrent identical requests in a worker
+
+    The first request for a key starts a producer thread that reads the
+    upstream stream into a buffer; later requests replay the buffer from the
+    start and then follow it live. The upstream stream is closed early only
+    when every subscriber has gone away; the flight is then dropped at once,
+    so a request arriving afterwards starts a new one rather than getting
+    the cut-off text.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.stats = CoalescingStats()
+
+    def stream(self, key, open_deltas):
+        """Yields the deltas of the shared stream for key; open_deltas() starts a new one"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.stats.incr("leaders")
+                threading.Thread(target=self._produce, args=(key, flight, open_deltas), daemon=True).start()
+            else:
+                self.stats.incr("coalesced")
+            with flight.condition:
+                flight.subscribers += 1
+
+        index = 0
+        try:
+            while True:
+                with flight.condition:
+                    while index >= len(flight.chunks) and not flight.done:
+                        flight.condition.wait()
+                    chunks = flight.chunks[index:]
+                    done, error = flight.done, flight.error
+                index += len(chunks)
+                yield from chunks
+                if done and index >= len(flight.chunks):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            # Under self._lock too, so no request joins between the last one leaving and the cancel
+            with self._lock, flight.condition:
+                flight.subscribers -= 1
+                if flight.subscribers == 0 and not flight.done:
+                    flight.cancelled = True
+                    self._forget(key, flight)
+
+    def _produce(self, key, flight, open_deltas):
+        deltas = None
+        try:
+            deltas = open_deltas()
+            for delta in deltas:
+                with flight.condition:
+                    if flight.cancelled:
+                        raise RuntimeError("Leader request was cancelled")
+                    flight.chunks.append(delta)
+                    flight.condition.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            if deltas is not None:
+                deltas.close()
+            with self._lock:
+                self._forget(key, flight)
+            with flight.condition:
+                flight.done = True
+                flight.condition.notify_all()
+
+    def _forget(self, key, flight):
+        # A cancelled flight's key may already belong to a newer flight
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats_dict(self):
+        return self.stats.as_dict(len(self._flights))
+
+class FileSingleFlight:
+    """Shares one upstream stream between identical requests across worker processes
+
+    The leader holds an exclusive flock on <key>.lock and appends deltas as
+    JSON lines to <key>.spool; followers in other workers tail the spool. The
+    spool and then the lock file are unlinked before the lock is released,
+    so a request arriving afterwards starts a fresh flight and the directory
+    does not keep a file per key. A request that wins the lock on a lock
+    file already unlinked opens the current one and tries again. A follower
+    that finds the lock free but the spool unfinished knows the leader died.
+    """
+
+    def __init__(self, directory, poll_interval=0.01):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        os.makedirs(directory, exist_ok=True)
+        self.stats = CoalescingStats()
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def stream(self, key, open_deltas):
+        lock_path = os.path.join(self.directory, f"{key}.lock")
+        spool_path = os.path.join(self.directory, f"{key}.spool")
+        lock_file = open(lock_path, "a")
+        try:
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    pass
+                else:
+                    if _is_linked(lock_file, lock_path):
+                        break
+                    # The previous leader unlinked this lock file after it was opened
+                    lock_file.close()
+                    lock_file = open(lock_path, "a")
+                    continue
+                try:
+                    spool = open(spool_path)
+                except FileNotFoundError:
+                    # The leader hasn't created its spool yet, or just finished
+                    time.sleep(self.poll_interval)
+                    continue
+                self.stats.incr("coalesced")
+                yield from self._follow(spool, lock_file)
+                return
+            self.stats.incr("leaders")
+            try:
+                yield from self._lead(spool_path, open_deltas)
+            finally:
+                os.unlink(lock_path)
+        finally:
+            lock_file.close()
+
+    def _lead(self, spool_path, open_deltas):
+        with self._lock:
+            self._in_flight += 1
+        deltas = None
+        if os.path.exists(spool_path):
+            # Left behind by a leader that crashed; its followers give up once the lock is free
+            os.unlink(spool_path)
+        with open(spool_path, "w") as spool:
+            try:
+                deltas = open_deltas()
+                for delta in deltas:
+                    spool.write(json.dumps({"delta": delta}) + "\n")
+                    spool.flush()
+                    yield delta
+                spool.write(json.dumps({"done": True}) + "\n")
+            except GeneratorExit:
+                spool.write(json.dumps({"error": "Leader request was cancelled"}) + "\n")
+                raise
+            except Exception as e:
+                spool.write(json.dumps({"error": str(e)}) + "\n")
+                raise
+            finally:
+                spool.flush()
+                os.unlink(spool_path)
+                if deltas is not None:
+                    deltas.close()
+                with self._lock:
+                    self._in_flight -= 1
+
+    def _follow(self, spool, lock_file):
+        with spool:
+            pending = ""
+            while True:
+                line = spool.readline()
+                if not line.endswith("\n"):
+                    pending += line
+                    if self._leader_gone(lock_file):
+                        raise RuntimeError("Coalesced request lost its leader")
+                    time.sleep(self.poll_interval)
+                    continue
+                event = json.loads(pending + line)
+                pending = ""
+                if "delta" in event:
+                    yield event["delta"]
+                elif "error" in event:
+                    raise RuntimeError(event["error"])
+                else:
+                    return
+
+    def _leader_gone(self, lock_file):
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return True
+
+    def stats_dict(self):
+        return self.stats.as_dict(self._in_flight)
+
+def _is_linked(lock_file, path):
+    """Whether path still names the open lock_file"""
+    try:
+        linked = os.stat(path)
+    except FileNotFoundError:
+        return False
+    opened = os.fstat(lock_file.fileno())
+    return (linked.st_dev, linked.st_ino) == (opened.st_dev, opened.st_ino)
+
+class _AsyncFlight:
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self.changed = asyncio.Condition()
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight for the ASGI app"""
+
+    def __init__(self):
+        self._flights = {}
+        self.stats = CoalescingStats()
+
+    async def stream(self, key, open_deltas):
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _AsyncFlight()
+            self.stats.incr("leaders")
+            flight.task = asyncio.ensure_future(self._produce(key, flight, open_deltas))
+        else:
+            self.stats.incr("coalesced")
+        flight.subscribers += 1
+
+        index = 0
+        try:
+            while True:
+                async with flight.changed:
+                    await flight.changed.wait_for(lambda: index < len(flight.chunks) or flight.done)
+                chunks = flight.chunks[index:]
+                index += len(chunks)
+                for chunk in chunks:
+                    yield chunk
+                if flight.done and index >= len(flight.chunks):
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # Nobody is listening any more, so stop paying for the stream; later requests start afresh
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    async def _produce(self, key, flight, open_deltas):
+        deltas = open_deltas()
+        try:
+            async for delta in deltas:
+                async with flight.changed:
+                    flight.chunks.append(delta)
+                    flight.changed.notify_all()
+        except asyncio.CancelledError:
+            flight.error = RuntimeError("Leader request was cancelled")
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            await deltas.aclose()
+            self._forget(key, flight)
+            flight.done = True
+            async with flight.changed:
+                flight.changed.notify_all()
+
+    def _forget(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats_dict(self):
+        return self.stats.as_dict(len(self._flights))
+
+def create_coalescer():
+    """Builds the single-flight coalescer configured by the COALESCE_* environment variables"""
+    backend = os.getenv("COALESCE_BACKEND", "memory")
+    if backend == "file":
+        return FileSingleFlight(os.getenv("COALESCE_DIR", "/tmp/nuanswers-coalesce"))
+    if backend == "off":
+        return None
+    return SingleFlight()
+
+def create_async_coalescer():
+    """Builds the asyncio coalescer; shared across workers is not supported there"""
+    return None if os.getenv("COALESCE_BACKEND", "memory") == "off" else AsyncSingleFlight()
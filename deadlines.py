@@ -0,0 +1,115 @@
+import math
+import os
+import select
+import socket
+import time
+
+from metrics import UPSTREAM_CANCELLED
+
+# The time budget a client gives a request, in milliseconds from its arrival;
+# the frontend (or a proxy) sets it to how long it is still willing to wait
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+
+class ClientDisconnected(Exception):
+    """Raised when the client goes away before its reply is ready"""
+
+class UpstreamDeadlineExceeded(Exception):
+    """Raised when a request's time budget runs out before OpenAI finishes
+
+    requested is True when the deadline that passed was the one the request
+    brought, which was earlier than the upstream client's own deadline_seconds.
+    Defined here rather than in upstream.py so catching it does not import
+    the OpenAI SDK.
+    """
+
+    requested = False
+
+class Deadline:
+    """When a request has to be answered by, as a time.monotonic() value
+
+    The admission queue sheds requests that cannot finish by then and the
+    upstream client cuts its call off there. client_gone is an optional
+    callable that tells whether the client has disconnected; watch() polls
+    it between upstream deltas, at most every poll_interval seconds.
+    """
+
+    def __init__(self, at, client_gone=None, poll_interval=0.1):
+        self.at = at
+        self.client_gone = client_gone
+        self.poll_interval = poll_interval
+
+    def remaining(self):
+        return self.at - time.monotonic()
+
+    def watch(self, deltas):
+        """Passes deltas through; raises ClientDisconnected, closing them, once the client is gone"""
+        polled = time.monotonic()
+        try:
+            for delta in deltas:
+                if self.client_gone is not None and time.monotonic() - polled >= self.poll_interval:
+                    polled = time.monotonic()
+                    if self.client_gone():
+                        UPSTREAM_CANCELLED.labels("disconnect").inc()
+                        raise ClientDisconnected("Client disconnected before the reply was ready")
+                yield delta
+        finally:
+            deltas.close()
+
+class DeadlinePolicy:
+    """Deadline of each request: the client's X-Request-Deadline-Ms, else default_seconds
+
+    Every deadline is capped at max_seconds, which stays inside gunicorn's
+    worker timeout, so a stalled upstream call is cancelled and the student
+    gets the local tier's reply before the worker would be killed. Header
+    values that are not finite numbers are ignored, and shorter ones than
+    min_seconds are raised to it, so a client cannot send requests that
+    are bound to time out. With
+    enabled=False requests get no deadline, are not cancelled when their
+    client leaves, and only the upstream client's own OPENAI_DEADLINE_SECONDS
+    applies.
+    """
+
+    def __init__(self, default_seconds=60.0, min_seconds=1.0, max_seconds=100.0, enabled=True):
+        self.default_seconds = default_seconds
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.enabled = enabled
+
+    def start(self, header=None, client_gone=None):
+        """The Deadline of a request arriving now, or None when deadlines are off"""
+        if not self.enabled:
+            return None
+        seconds = self.default_seconds
+        if header:
+            try:
+                requested = float(header) / 1000
+            except ValueError:
+                requested = math.nan
+            if math.isfinite(requested):
+                seconds = requested
+        return Deadline(time.monotonic() + min(max(seconds, self.min_seconds), self.max_seconds), client_gone)
+
+def socket_closed(sock):
+    """Whether the peer has closed a connected socket, without consuming anything it sent"""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b""
+    except BlockingIOError:
+        return False
+    except (OSError, ValueError):
+        return True
+
+def create_deadline_policy():
+    """Builds the request deadline policy configured by the REQUEST_DEADLINE_* environment variables"""
+    default_seconds = float(os.getenv("REQUEST_DEADLINE_SECONDS", "60"))
+    min_seconds = float(os.getenv("REQUEST_DEADLINE_MIN_SECONDS", "1"))
+    max_seconds = float(os.getenv("REQUEST_DEADLINE_MAX_SECONDS", "100"))
+    if not min_seconds <= default_seconds <= max_seconds:
+        raise ValueError("❌ ERROR: REQUEST_DEADLINE_SECONDS must be between REQUEST_DEADLINE_MIN_SECONDS "
+                         "and REQUEST_DEADLINE_MAX_SECONDS")
+    return DeadlinePolicy(
+        default_seconds=default_seconds,
+        min_seconds=min_seconds,
+        max_seconds=max_seconds,
+        enabled=os.getenv("REQUEST_DEADLINE_ENABLED", "true").lower() == "true"
+    )
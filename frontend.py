@@ -1,35 +1,114 @@
+import os
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import json
 
+# Point at a local server with e.g. NUANSWERS_BACKEND_URL=http://localhost:5000
+BACKEND_URL = os.getenv("NUANSWERS_BACKEND_URL", "https://nuanswers.onrender.com").rstrip("/")
+# Messages shown as chat bubbles; older ones are folded into a single block
+RECENT_MESSAGES = int(os.getenv("NUANSWERS_RECENT_MESSAGES", "10"))
+# How long to wait for a reply; sent along so the backend stops working on replies nobody waits for
+DEADLINE_SECONDS = float(os.getenv("NUANSWERS_DEADLINE_SECONDS", "60"))
+
 st.title("NuAnswers: Beta Alpha Psi - Nu Sigma Chapter's AI Tutor Bot")
 st.write("Welcome to your Accounting & Finance Tutor! I'm here to help you understand concepts and work through problems.")
 
-# Initialize session state for conversation flow
-if 'conversation_state' not in st.session_state:
-    st.session_state.conversation_state = 'initial'
-
-# Main interaction
-if st.session_state.conversation_state == 'initial':
-    user_input = st.text_area("What would you like to learn about?", height=100)
-    if st.button("Ask Question"):
-        if user_input:
-            try:
-                response = requests.post("https://nuanswers.onrender.com/chat", 
-                                      json={"message": user_input},
-                                      headers={"Content-Type": "application/json"})
-                
-                response.raise_for_status()
-                
-                try:
-                    response_data = response.json()
-                    tutor_response = response_data.get("response", "I apologize, but I couldn't process that response.")
-                    st.write("Tutor Bot:", tutor_response)
-                except json.JSONDecodeError as e:
-                    st.error("I apologize, but I received an invalid response format. Please try again.")
-                    st.write("Debug info:", str(e))
-            except requests.exceptions.RequestException as e:
-                st.error("I apologize, but I couldn't connect to the tutor service. Please try again later.")
-                st.write("Debug info:", str(e))
-        else:
-            st.warning("Please enter your question!")
+@st.cache_resource
+def http_session():
+    """One pooled HTTP session for every rerun and every user of this process
+
+    Keeping the connection alive saves a TCP and TLS handshake on each turn.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=int(os.getenv("NUANSWERS_POOL_SIZE", "20")))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Content-Type": "application/json", "Accept": "text/event-stream"})
+    return session
+
+def iter_sse_events(response):
+    """Yields (event, data) pairs from a Server-Sent Events response"""
+    event, data_lines = None, []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if data_lines:
+                yield event or "message", json.loads("\n".join(data_lines))
+            event, data_lines = None, []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+
+def stream_reply(user_input, placeholder):
+    """Streams the tutor's reply into placeholder; returns the text, or None on failure"""
+    try:
+        with http_session().post(f"{BACKEND_URL}/chat/stream",
+                                 json={"message": user_input, "session_id": st.session_state.session_id},
+                                 headers={"X-Request-Deadline-Ms": str(int(DEADLINE_SECONDS * 1000))},
+                                 stream=True, timeout=(5, DEADLINE_SECONDS)) as response:
+            response.raise_for_status()
+            tutor_response = ""
+            for event, payload in iter_sse_events(response):
+                if event == "error":
+                    placeholder.error("I apologize, but the tutor ran into a problem. Please try again.")
+                    st.write("Debug info:", payload.get("error"))
+                    return None
+                if event == "done":
+                    # Send the id back next time so the tutor remembers this conversation
+                    st.session_state.session_id = payload.get("session_id")
+                    break
+                tutor_response += payload.get("delta", "")
+                placeholder.markdown(f"{tutor_response}▌")
+            placeholder.markdown(tutor_response)
+            return tutor_response
+    except json.JSONDecodeError as e:
+        placeholder.error("I apologize, but I received an invalid response format. Please try again.")
+        st.write("Debug info:", str(e))
+    except requests.exceptions.RequestException as e:
+        placeholder.error("I apologize, but I couldn't connect to the tutor service. Please try again later.")
+        st.write("Debug info:", str(e))
+    return None
+
+def remember(role, content):
+    """Adds a message to the history, folding the oldest bubbles into the earlier transcript"""
+    messages = st.session_state.messages
+    messages.append({"role": role, "content": content})
+    while len(messages) > RECENT_MESSAGES:
+        oldest = messages.pop(0)
+        speaker = "You" if oldest["role"] == "user" else "Tutor Bot"
+        st.session_state.earlier += f"**{speaker}:** {oldest['content']}\n\n"
+
+def reset_conversation():
+    st.session_state.messages = []
+    st.session_state.earlier = ""
+    st.session_state.session_id = None
+
+# The conversation so far, kept across reruns. Every rerun redraws what is
+# on the page, so a long conversation costs one markdown block plus at most
+# RECENT_MESSAGES bubbles, not a bubble per message.
+if 'messages' not in st.session_state:
+    reset_conversation()
+
+with st.sidebar:
+    st.button("New conversation", on_click=reset_conversation)
+
+if st.session_state.earlier:
+    with st.expander("Earlier in this conversation"):
+        st.markdown(st.session_state.earlier)
+for message in st.session_state.messages:
+    with st.chat_message(message["role"]):
+        st.markdown(message["content"])
+
+user_input = st.chat_input("What would you like to learn about?")
+if user_input:
+    with st.chat_message("user"):
+        st.markdown(user_input)
+    with st.chat_message("assistant"):
+        tutor_response = stream_reply(user_input, st.empty())
+    # A failed turn is not kept, so the question can simply be asked again
+    if tutor_response is not None:
+        remember("user", user_input)
+        remember("assistant", tutor_response)
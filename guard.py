@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+
+from NuAnswers import TutorRules
+from metrics import COMPLETION_TOKENS, add_span, observe
+
+# Added before the student's message when a completion is regenerated after a trip
+REGENERATION_REMINDER = {
+    "role": "system",
+    "content": "Do not state the answer or the method directly. Guide the student with a question instead."
+}
+
+class GuardedText:
+    """Guard state for one streamed completion
+
+    Text is held back by the length of the longest forbidden pattern minus one
+    so a direct answer never reaches the student. Each upstream delta is
+    counted as one completion token, which is how the API streams them.
+    """
+
+    def __init__(self, guard, max_tokens):
+        self.guard = guard
+        self.max_tokens = max_tokens
+        self.scanner = guard.rules.direct_answer_scanner()
+        self.hold = guard.rules.forbidden_matcher.max_length - 1
+        self.text = ""
+        self.sent = 0
+        self.tokens = 0
+        self.tripped = False
+        self.seconds = 0.0  # time spent scanning, reported as the request's "guard" span
+
+    def feed(self, delta):
+        """Returns the text that is now safe to send; sets tripped on a direct answer"""
+        started = time.perf_counter()
+        self.tokens += 1
+        self.text += delta
+        matches = self.scanner.feed(delta)
+        if matches:
+            self.tripped = True
+            self.guard.record_trip(self.max_tokens - self.tokens)
+            safe, self.text = self.text[self.sent:matches[0][0]], self.text[:matches[0][0]]
+            self.sent = len(self.text)
+            self._done(started)
+            return safe
+        end = len(self.text) - self.hold
+        if end > self.sent:
+            safe, self.sent = self.text[self.sent:end], end
+        else:
+            safe = ""
+        self.seconds += time.perf_counter() - started
+        return safe
+
+    def finish(self):
+        """Returns the held-back text once the completion ends without tripping"""
+        started = time.perf_counter()
+        self.guard.record_completion()
+        safe, self.sent = self.text[self.sent:], len(self.text)
+        self._done(started)
+        return safe
+
+    def _done(self, started):
+        self.seconds += time.perf_counter() - started
+        add_span("guard", self.seconds)
+        observe(COMPLETION_TOKENS, self.tokens)
+
+class OutputGuard:
+    """Applies TutorRules to LLM output and counts how often it has to step in"""
+
+    def __init__(self, rules=None, max_regenerations=1):
+        self.rules = rules or TutorRules()
+        self.max_regenerations = max_regenerations
+        self._lock = threading.Lock()
+        self.completions = 0
+        self.trips = 0
+        self.regenerations = 0
+        self.fallbacks = 0
+        self.tokens_saved = 0
+
+    def start(self, max_tokens):
+        return GuardedText(self, max_tokens)
+
+    def record_completion(self):
+        with self._lock:
+            self.completions += 1
+
+    def record_trip(self, tokens_saved):
+        with self._lock:
+            self.completions += 1
+            self.trips += 1
+            self.tokens_saved += max(0, tokens_saved)
+
+    def record_regeneration(self):
+        with self._lock:
+            self.regenerations += 1
+
+    def fallback(self):
+        """Redirecting question sent instead of (or after) a cut-off completion"""
+        with self._lock:
+            self.fallbacks += 1
+        return self.rules.get_redirecting_response()
+
+    def collect(self, deltas, max_tokens):
+        """Consumes a delta iterator; returns (text, tripped)
+
+        On a trip the iterator is closed at once, which cancels the upstream
+        stream and saves the tokens it would still have generated.
+        """
+        guarded = self.start(max_tokens)
+        for delta in deltas:
+            guarded.feed(delta)
+            if guarded.tripped:
+                deltas.close()
+                return guarded.text, True
+        guarded.finish()
+        return guarded.text, False
+
+    def stats(self):
+        return {
+            "completions": self.completions,
+            "trips": self.trips,
+            "trip_rate": round(self.trips / self.completions, 4) if self.completions else 0.0,
+            "regenerations": self.regenerations,
+            "fallbacks": self.fallbacks,
+            "tokens_saved_estimate": self.tokens_saved
+        }
+
+def create_output_guard():
+    """Builds the output guard configured by the GUARD_* environment variables"""
+    return OutputGuard(max_regenerations=int(os.getenv("GUARD_MAX_REGENERATIONS", "1")))
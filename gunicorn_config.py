@@ -5,10 +5,38 @@ import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # Gunicorn configuration
-bind = "0.0.0.0:8000"
-workers = 4
+#
+# The default serves the Flask app with sync workers:
+#     gunicorn -c gunicorn_config.py app:app
+# The asyncio path serves many concurrent tutoring sessions per process:
+#     GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn -c gunicorn_config.py asgi_app:app
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", "4"))
+# Request deadlines are capped below this (REQUEST_DEADLINE_MAX_SECONDS), so a
+# stalled OpenAI call is cut off and answered locally before the worker is killed
 timeout = 120
-worker_class = "sync"
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+# Threads per worker; more than 1 switches sync workers to gthread
+threads = int(os.getenv("GUNICORN_THREADS", "1"))
+# Load the app (prompt templates, tutor rules, retrieval index) once in the
+# master; workers share those pages copy-on-write instead of each loading them
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
 accesslog = "-"
 errorlog = "-"
 loglevel = "info" 
+
+def pre_fork(server, worker):
+    # Import the OpenAI SDK in the master too, so forked workers start with it
+    if preload_app:
+        import upstream  # noqa: F401
+
+def post_fork(server, worker):
+    import metrics
+    metrics.REGISTRY.start_sharing()
+    # Connection pools must not cross a fork: each worker opens its own client
+    application = server.app.wsgi()
+    # Flask keeps the TutorServices in its extensions, Starlette in its state
+    services = (getattr(application, "extensions", {}).get("nuanswers")
+                or getattr(getattr(application, "state", None), "nuanswers", None))
+    if services is not None:
+        services.start_worker()
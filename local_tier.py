@@ -0,0 +1,211 @@
+import os
+import threading
+import time
+
+from NuAnswers import AccountingFinanceTutor, TutorState
+from practice import create_problem_pool
+from sessions import InMemorySessionBackend, SQLiteSessionBackend
+from deadlines import UpstreamDeadlineExceeded
+from metrics import TUTOR_TIER_SECONDS, TUTOR_TURNS, observe
+
+# Tiers a chat turn can be answered by; cached LLM responses are counted apart
+LOCAL, LLM, CACHE, FALLBACK = "local", "llm", "cache", "fallback"
+
+class TutorStateStore:
+    """TutorState of each session, kept as its packed bytes in a session backend
+
+    Any backend with get/set/delete works; the bytes are stored as a list of
+    ints so the SQLite backend can keep them as JSON.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, session_id):
+        data = self.backend.get(session_id) if session_id else None
+        return TutorState.from_bytes(bytes(data)) if data else TutorState()
+
+    def put(self, session_id, state):
+        self.backend.set(session_id, list(state.to_bytes()))
+
+class UpstreamHealth:
+    """Circuit breaker that sends turns to the local tier while the upstream is down or slow
+
+    Opens after failure_threshold failures in a row, or when the moving
+    average of time to first token passes slow_seconds. After cooldown_seconds
+    one call is let through as a probe; a quick success closes it again.
+    """
+
+    def __init__(self, failure_threshold=3, slow_seconds=10.0, cooldown_seconds=30.0, alpha=0.2):
+        self.failure_threshold = failure_threshold
+        self.slow_seconds = slow_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.first_token_ewma = None
+        # 0 while closed; otherwise when the next probe may go through
+        self.open_until = 0.0
+        self.opened = 0
+
+    @property
+    def is_open(self):
+        return self.open_until > time.monotonic()
+
+    def available(self):
+        """Whether to call the upstream for this turn"""
+        with self._lock:
+            if self.open_until == 0.0:
+                return True
+            now = time.monotonic()
+            if now < self.open_until:
+                return False
+            # Let this call through as the probe; the others stay local for another cooldown
+            self.open_until = now + self.cooldown_seconds
+            return True
+
+    def record(self, seconds, ok):
+        """Records an upstream call: time to its first token, or its failure"""
+        with self._lock:
+            tripped = self.open_until != 0.0
+            if ok:
+                self.failures = 0
+                if tripped or self.first_token_ewma is None:
+                    self.first_token_ewma = seconds
+                else:
+                    self.first_token_ewma += self.alpha * (seconds - self.first_token_ewma)
+                if self.first_token_ewma <= self.slow_seconds:
+                    self.open_until = 0.0
+                    return
+            else:
+                self.failures += 1
+                if self.failures < self.failure_threshold and not tripped:
+                    return
+            if not tripped:
+                self.opened += 1
+            self.open_until = time.monotonic() + self.cooldown_seconds
+
+    def watch(self, deltas):
+        """Passes completion deltas through, recording the time to the first one or the failure"""
+        started = time.monotonic()
+        waiting = True
+        try:
+            for delta in deltas:
+                if waiting:
+                    waiting = False
+                    self.record(time.monotonic() - started, True)
+                yield delta
+        except UpstreamDeadlineExceeded as e:
+            # A request that brought its own, shorter deadline ran out of time; OpenAI did not fail
+            if not e.requested:
+                self.record(time.monotonic() - started, False)
+            raise
+        except Exception:
+            self.record(time.monotonic() - started, False)
+            raise
+        finally:
+            deltas.close()
+
+    async def awatch(self, deltas):
+        """Async counterpart of watch"""
+        started = time.monotonic()
+        waiting = True
+        try:
+            async for delta in deltas:
+                if waiting:
+                    waiting = False
+                    self.record(time.monotonic() - started, True)
+                yield delta
+        except UpstreamDeadlineExceeded as e:
+            if not e.requested:
+                self.record(time.monotonic() - started, False)
+            raise
+        except Exception:
+            self.record(time.monotonic() - started, False)
+            raise
+        finally:
+            await deltas.aclose()
+
+    def stats(self):
+        return {
+            "open": self.is_open,
+            "times_opened": self.opened,
+            "consecutive_failures": self.failures,
+            "first_token_ewma_ms": None if self.first_token_ewma is None else round(self.first_token_ewma * 1000, 1)
+        }
+
+class LocalTier:
+    """The rule-based AccountingFinanceTutor as a zero-cost tier in front of the LLM
+
+    Turns the rules can answer (see AccountingFinanceTutor.can_answer) are
+    answered here in microseconds, and so is every turn while the upstream
+    is unavailable. With enabled=False, /chat always goes to the LLM but
+    /tutor still uses the rules.
+    """
+
+    def __init__(self, states, retriever=None, health=None, enabled=True, problems=None):
+        self.states = states
+        self.retriever = retriever
+        self.problems = problems
+        self.health = health or UpstreamHealth()
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.turns = dict.fromkeys((LOCAL, LLM, CACHE, FALLBACK), 0)
+        self.seconds = dict.fromkeys((LOCAL, LLM, CACHE, FALLBACK), 0.0)
+
+    def answer(self, session_id, user_message, force=False):
+        """The tutor's reply, saving the session's new state; None when the turn needs the LLM
+
+        force answers even turns the rules would escalate, for when the
+        upstream cannot.
+        """
+        tutor = AccountingFinanceTutor(retriever=self.retriever, state=self.states.get(session_id),
+                                       problems=self.problems)
+        if not force and not tutor.can_answer(user_message):
+            return None
+        reply = tutor.evaluate_response(user_message)
+        self.states.put(session_id, tutor.state)
+        return reply
+
+    def state(self, session_id):
+        return self.states.get(session_id)
+
+    def record(self, tier, seconds):
+        with self._lock:
+            self.turns[tier] += 1
+            self.seconds[tier] += seconds
+        TUTOR_TURNS.labels(tier).inc()
+        observe(TUTOR_TIER_SECONDS.labels(tier), seconds)
+
+    def stats(self):
+        total = sum(self.turns.values())
+        return {
+            "enabled": self.enabled,
+            "turns": dict(self.turns),
+            "local_fraction": round((self.turns[LOCAL] + self.turns[FALLBACK]) / total, 4) if total else 0.0,
+            "mean_ms": {tier: round(1000 * self.seconds[tier] / count, 3) if count else None
+                        for tier, count in self.turns.items()},
+            "upstream": self.health.stats(),
+            "practice": None if self.problems is None else self.problems.stats()
+        }
+
+def create_local_tier(retriever=None):
+    """Builds the local tier configured by the LOCAL_TIER_*, SESSION_* and PRACTICE_* environment variables"""
+    max_sessions = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+    ttl_seconds = int(os.getenv("SESSION_TTL_SECONDS", "3600"))
+    if os.getenv("SESSION_BACKEND", "memory") == "sqlite":
+        backend = SQLiteSessionBackend(
+            os.getenv("TUTOR_STATE_DB_PATH", "tutor_state.db"),
+            max_sessions=max_sessions,
+            ttl_seconds=ttl_seconds
+        )
+    else:
+        backend = InMemorySessionBackend(max_sessions=max_sessions, ttl_seconds=ttl_seconds)
+    health = UpstreamHealth(
+        failure_threshold=int(os.getenv("LOCAL_TIER_FAILURE_THRESHOLD", "3")),
+        slow_seconds=float(os.getenv("LOCAL_TIER_SLOW_SECONDS", "10")),
+        cooldown_seconds=float(os.getenv("LOCAL_TIER_COOLDOWN_SECONDS", "30"))
+    )
+    return LocalTier(TutorStateStore(backend), retriever=retriever, health=health,
+                     enabled=os.getenv("LOCAL_TIER_ENABLED", "true").lower() == "true",
+                     problems=create_problem_pool())
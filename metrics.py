@@ -0,0 +1,450 @@
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+# Seconds, from a cache hit to a long completion
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Per-request stages are much shorter than whole requests
+SPAN_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Metric:
+    """A named family of samples, one child per combination of label values"""
+
+    type = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def snapshot(self):
+        """{label values: plain data} for rendering and sharing with other workers"""
+        return {values: child.snapshot() for values, child in list(self._children.items())}
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+class _GaugeChild(_CounterChild):
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+    def set(self, value):
+        self._default.set(value)
+
+class _HistogramChild:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            return {"counts": list(self.counts), "sum": self.sum}
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+class CallbackMetric:
+    """A counter or gauge read from a component's own statistics at scrape time"""
+
+    def __init__(self, name, help_text, type, callback, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.type = type
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+
+    def snapshot(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            return {(): values}
+        return {label if isinstance(label, tuple) else (label,): value for label, value in values.items()}
+
+class Registry:
+    """Holds the metrics of one worker process and renders the Prometheus text format
+
+    With a shared directory, each worker writes a snapshot of its own metrics
+    there every few seconds. A scrape of any worker then adds up the latest
+    snapshot of every other live worker, so one target reports the whole
+    server. In-flight gauges add up to the server's total queue depth.
+    """
+
+    def __init__(self, directory=None, interval=5.0):
+        self.metrics = []
+        self.directory = directory
+        self.interval = interval
+        self._writer = None
+        self._writer_pid = None
+
+    def register(self, metric):
+        # A second app in one process (benchmarks) replaces the first one's component callbacks
+        self.metrics = [existing for existing in self.metrics if existing.name != metric.name]
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self.register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def callback(self, name, help_text, type, callback, labelnames=()):
+        return self.register(CallbackMetric(name, help_text, type, callback, labelnames))
+
+    def start_sharing(self):
+        """Starts the snapshot writer in this process (call after gunicorn forks)"""
+        if self.directory is None or self._writer_pid == os.getpid():
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._writer_pid = os.getpid()
+        self._writer = threading.Thread(target=self._write_snapshots, daemon=True)
+        self._writer.start()
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def _write_snapshots(self):
+        while True:
+            payload = {metric.name: [[list(labels), value] for labels, value in metric.snapshot().items()]
+                       for metric in self.metrics if not isinstance(metric, CallbackMetric)}
+            temporary = self._snapshot_path(os.getpid()) + ".tmp"
+            with open(temporary, "w") as f:
+                json.dump(payload, f)
+            os.replace(temporary, self._snapshot_path(os.getpid()))
+            time.sleep(self.interval)
+
+    def _other_workers(self):
+        if self.directory is None or not os.path.isdir(self.directory):
+            return []
+        snapshots = []
+        stale_before = time.time() - 3 * self.interval
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if not filename.endswith(".json") or filename == f"{os.getpid()}.json":
+                continue
+            try:
+                if os.path.getmtime(path) < stale_before:
+                    continue  # worker has exited
+                with open(path) as f:
+                    snapshots.append({name: {tuple(labels): value for labels, value in samples}
+                                      for name, samples in json.load(f).items()})
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        """Prometheus text exposition format 0.0.4"""
+        others = self._other_workers()
+        lines = []
+        for metric in self.metrics:
+            samples = metric.snapshot()
+            if not isinstance(metric, CallbackMetric):
+                for other in others:
+                    for labels, value in other.get(metric.name, {}).items():
+                        samples[labels] = _merge(samples.get(labels), value)
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for labels, value in sorted(samples.items()):
+                if metric.type == "histogram":
+                    cumulative = 0
+                    for bound, count in zip(metric.bounds + (float("inf"),), value["counts"]):
+                        cumulative += count
+                        le = _format_labels(metric.labelnames, labels, ("le", _format_value(bound)))
+                        lines.append(f"{metric.name}_bucket{le} {cumulative}")
+                    label_text = _format_labels(metric.labelnames, labels)
+                    lines.append(f"{metric.name}_sum{label_text} {_format_value(value['sum'])}")
+                    lines.append(f"{metric.name}_count{label_text} {cumulative}")
+                else:
+                    lines.append(f"{metric.name}{_format_labels(metric.labelnames, labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+def _merge(mine, theirs):
+    if mine is None:
+        return theirs
+    if isinstance(mine, dict):
+        return {"counts": [a + b for a, b in zip(mine["counts"], theirs["counts"])], "sum": mine["sum"] + theirs["sum"]}
+    return mine + theirs
+
+# One registry per worker process; METRICS_DIR shares it between gunicorn workers
+REGISTRY = Registry(directory=os.getenv("METRICS_DIR") or None)
+ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "nuanswers_request_duration_seconds", "Time to handle a request, to the last byte for streams",
+    ["route", "status"])
+REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "nuanswers_requests_in_flight", "Requests being handled (summed over workers: the queue depth)")
+UPSTREAM_FIRST_TOKEN_SECONDS = REGISTRY.histogram(
+    "nuanswers_upstream_first_token_seconds", "Time from sending a completion request to its first chunk")
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    "nuanswers_upstream_duration_seconds", "Time from sending a completion request to the end of its stream")
+UPSTREAM_CANCELLED = REGISTRY.counter(
+    "nuanswers_upstream_cancelled_total",
+    "Upstream calls cut off before they finished, by cause: the request's deadline or its client leaving", ["cause"])
+PROMPT_TOKENS = REGISTRY.histogram(
+    "nuanswers_prompt_tokens", "Input tokens per completion request", buckets=TOKEN_BUCKETS)
+COMPLETION_TOKENS = REGISTRY.histogram(
+    "nuanswers_completion_tokens", "Completion tokens streamed per request", buckets=TOKEN_BUCKETS)
+RATE_LIMITED = REGISTRY.counter(
+    "nuanswers_rate_limited_total", "Requests refused with a 429, by the limit that refused them", ["reason"])
+ADMISSION_WAIT_SECONDS = REGISTRY.histogram(
+    "nuanswers_admission_wait_seconds", "Time a request queued for an upstream call slot", buckets=SPAN_BUCKETS)
+TUTOR_TURNS = REGISTRY.counter(
+    "nuanswers_tutor_turns_total",
+    "Chat turns by the tier that answered them: local rules, the LLM, or local fallback for the upstream",
+    ["tier"])
+MODEL_ROUTES = REGISTRY.counter(
+    "nuanswers_model_routes_total", "Chat turns sent to the LLM, by the model route the router picked", ["route"])
+TUTOR_TIER_SECONDS = REGISTRY.histogram(
+    "nuanswers_tutor_tier_duration_seconds", "Time to answer a chat turn, by tier", ["tier"], buckets=SPAN_BUCKETS)
+SPAN_SECONDS = REGISTRY.histogram(
+    "nuanswers_span_duration_seconds", "Time spent in each stage of a request", ["span"], buckets=SPAN_BUCKETS)
+
+# Most recent finished traces, for /traces
+RECENT_TRACES = deque(maxlen=int(os.getenv("METRICS_RECENT_TRACES", "100")))
+
+_current_trace = contextvars.ContextVar("nuanswers_trace", default=None)
+
+class Trace:
+    """Timed spans of one request (parse, prompt_build, upstream, guard, ...)"""
+
+    def __init__(self, route):
+        self.route = route
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.spans = []
+
+    @contextmanager
+    def span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started, started)
+
+    def add(self, name, seconds, started=None):
+        offset = (started if started is not None else time.perf_counter() - seconds) - self.started
+        self.spans.append((name, offset, seconds))
+        SPAN_SECONDS.labels(name).observe(seconds)
+
+    def server_timing(self):
+        """Server-Timing header value, so browser dev tools show the spans"""
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, _, seconds in self.spans)
+
+    def as_dict(self, status=None):
+        return {
+            "trace_id": self.trace_id,
+            "route": self.route,
+            "status": status,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "spans": [{"name": name, "offset_ms": round(offset * 1000, 3), "duration_ms": round(seconds * 1000, 3)}
+                      for name, offset, seconds in self.spans]
+        }
+
+class _NullTrace:
+    trace_id = None
+    spans = ()
+
+    @contextmanager
+    def span(self, name):
+        yield
+
+    def add(self, name, seconds, started=None):
+        pass
+
+    def server_timing(self):
+        return ""
+
+NULL_TRACE = _NullTrace()
+
+# Route label of requests that match no route, so probes cannot add label values without bound
+UNMATCHED_ROUTE = "other"
+
+def start_trace(route):
+    """Starts timing a request and makes its trace current in this thread or task"""
+    if not ENABLED:
+        return NULL_TRACE
+    REQUESTS_IN_FLIGHT.inc()
+    trace = Trace(route)
+    _current_trace.set(trace)
+    return trace
+
+def finish_trace(trace, status):
+    if trace is NULL_TRACE:
+        return
+    REQUESTS_IN_FLIGHT.dec()
+    REQUEST_SECONDS.labels(trace.route, str(status)).observe(time.perf_counter() - trace.started)
+    RECENT_TRACES.append(trace.as_dict(status))
+
+def current_trace():
+    return _current_trace.get() or NULL_TRACE
+
+def span(name):
+    """Times a block as a span of the current request, if there is one"""
+    return current_trace().span(name)
+
+def add_span(name, seconds):
+    current_trace().add(name, seconds)
+
+def observe(histogram, value):
+    if ENABLED:
+        histogram.observe(value)
+
+def observe_components(response_cache=None, coalescer=None, output_guard=None, local_tier=None):
+    """Exposes the components' own counters, read only when /metrics is scraped"""
+    if response_cache is not None:
+        REGISTRY.callback(
+            "nuanswers_response_cache_lookups_total", "Response cache lookups by result", "counter",
+            lambda: {"hit": response_cache.hits, "near_hit": response_cache.near_hits, "miss": response_cache.misses},
+            ["result"])
+        REGISTRY.callback(
+            "nuanswers_response_cache_hit_ratio", "Share of response cache lookups answered from the cache", "gauge",
+            lambda: response_cache.stats()["hit_rate"])
+    if coalescer is not None:
+        REGISTRY.callback(
+            "nuanswers_coalesced_requests_total", "Upstream requests by whether they led or joined a flight",
+            "counter", lambda: {"leader": coalescer.stats.leaders, "follower": coalescer.stats.coalesced}, ["role"])
+        REGISTRY.callback(
+            "nuanswers_coalesced_ratio", "Share of requests that joined an identical in-flight request", "gauge",
+            lambda: coalescer.stats_dict()["coalesced_rate"])
+    if output_guard is not None:
+        REGISTRY.callback(
+            "nuanswers_guard_trips_total", "Completions cut off for giving the answer away", "counter",
+            lambda: output_guard.trips)
+    if local_tier is not None:
+        REGISTRY.callback(
+            "nuanswers_upstream_breaker_open", "1 while turns go to the local tier because the upstream is down or slow",
+            "gauge", lambda: int(local_tier.health.is_open))
+
+def render():
+    return REGISTRY.render()
+
+# Prometheus scrapers accept this content type for the text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class TracingMiddleware:
+    """ASGI middleware that traces each HTTP request of the Starlette app
+
+    The trace is current for the whole request task, including a streaming
+    response's body, and finishes when the last body chunk has been sent.
+    Requests are labelled with the path template of the route they match.
+    """
+
+    def __init__(self, app, untraced=("/metrics", "/traces")):
+        self.app = app
+        self.untraced = set(untraced)
+
+    @staticmethod
+    def route(scope):
+        """Path template of the app's route the request matches, as Flask's url_rule"""
+        from starlette.routing import Match
+        for route in getattr(scope.get("app"), "routes", ()):
+            match, _ = route.matches(scope)
+            if match is Match.FULL:
+                return route.path
+        return UNMATCHED_ROUTE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.untraced:
+            await self.app(scope, receive, send)
+            return
+        trace = start_trace(self.route(scope))
+        status = 500
+
+        async def send_traced(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timing = trace.server_timing()
+                if timing:
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            finish_trace(trace, status)
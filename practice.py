@@ -0,0 +1,358 @@
+import os
+import random
+import re
+import threading
+from collections import deque
+
+import numpy as np
+
+from NuAnswers import TOPICS
+
+# TutorState.problem values from here up are generated problems: the template
+# index in bits 24-29 and the seed in bits 0-23, so a problem is rebuilt from
+# its code alone and sessions stay a few bytes whichever worker serves them
+GENERATED = 1 << 30
+SEED_BITS = 24
+
+# "$1,500", "-2,000", "12.5%", "0.85"
+NUMBER = re.compile(r"-?\$?\d[\d,]*(?:\.\d+)?")
+
+def _uniforms(seeds, count):
+    """count uniform draws in [0, 1) per seed, as a (len(seeds), count) array
+
+    splitmix64 over seed * count + column: the same seed gives the same draws
+    whether it is generated alone or in a batch of thousands.
+    """
+    with np.errstate(over="ignore"):
+        z = (seeds.astype(np.uint64)[:, None] * np.uint64(count)
+             + np.arange(count, dtype=np.uint64)) * np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)).astype(np.float64) * 2.0**-53
+
+def _steps(u, low, high, step):
+    """Maps uniform draws onto low, low + step, ..., high"""
+    return low + np.floor(u * ((high - low) / step + 1)) * step
+
+def _hundreds(values):
+    return np.round(values / 100) * 100
+
+def _close(a, b):
+    return np.isclose(a, b, rtol=1e-9, atol=1e-6)
+
+class ProblemTemplate:
+    """One kind of practice problem, generated for a whole array of seeds at once
+
+    parameters turns an (n, draws) array of uniform draws into named
+    parameter arrays, solve computes the answers from them, and check
+    verifies the answers a second way (e.g. discounting a future value back
+    to the amount invested) and that the numbers make sense. Problems that
+    fail the check are never served. required names the answers a student's
+    reply has to contain to count as correct; percent ones may also be given
+    as fractions.
+    """
+
+    def __init__(self, topic, difficulty, text, draws, parameters, solve, check, required, percent=()):
+        self.topic = topic
+        self.difficulty = difficulty
+        self.text = text
+        self.draws = draws
+        self.parameters = parameters
+        self.solve = solve
+        self.check = check
+        self.required = required
+        self.percent = percent
+
+    def generate(self, seeds):
+        """Returns (seeds, parameters, answers) of the seeds whose problems pass the check"""
+        params = self.parameters(_uniforms(seeds, self.draws))
+        answers = self.solve(params)
+        valid = self.check(params, answers)
+        return (seeds[valid], {name: values[valid] for name, values in params.items()},
+                {name: values[valid] for name, values in answers.items()})
+
+    def render(self, params):
+        """Problem texts for generated parameter arrays"""
+        names = list(params)
+        return [self.text.format(**dict(zip(names, row))) for row in zip(*(params[name].tolist() for name in names))]
+
+def _annuity_check(p, a):
+    # Discounts every payment on its own, up to the longest term in the batch
+    years = np.arange(1, int(p["years"].max()) + 1)
+    factors = (1 + p["rate"][:, None] / 100) ** -years * (years <= p["years"][:, None])
+    return _close((p["payment"][:, None] * factors).sum(axis=1), a["present_value"]) & (a["present_value"] > 0)
+
+TEMPLATES = (
+    ProblemTemplate(
+        "accounting_equation", "easy",
+        "A company purchases ${amount:,.0f} of inventory on credit. How does this affect the accounting equation?",
+        1, lambda u: {"amount": _steps(u[:, 0], 500, 20000, 100)},
+        lambda p: {"assets": p["amount"], "liabilities": p["amount"], "equity": np.zeros_like(p["amount"])},
+        lambda p, a: _close(a["assets"], a["liabilities"] + a["equity"]),
+        required=("assets",)),
+    ProblemTemplate(
+        "accounting_equation", "medium",
+        "A company issues ${stock:,.0f} in common stock and purchases equipment worth ${equipment:,.0f} cash. "
+        "Show the impact on the accounting equation.",
+        2, lambda u: {"stock": (stock := _steps(u[:, 0], 2000, 50000, 500)),
+                      "equipment": _hundreds(stock * (0.2 + 0.6 * u[:, 1]))},
+        lambda p: {"cash": p["stock"] - p["equipment"], "assets": p["stock"], "equity": p["stock"]},
+        lambda p, a: _close(a["cash"] + p["equipment"], a["equity"]) & (a["cash"] > 0),
+        required=("cash", "equity")),
+    ProblemTemplate(
+        "accounting_equation", "hard",
+        "A company takes out a ${loan:,.0f} loan, purchases inventory for ${inventory:,.0f} cash, and pays "
+        "${dividends:,.0f} in dividends. What's the net effect on the accounting equation?",
+        3, lambda u: {"loan": (loan := _steps(u[:, 0], 5000, 50000, 500)),
+                      "inventory": _hundreds(loan * (0.3 + 0.6 * u[:, 1])),
+                      "dividends": _hundreds(loan * (0.05 + 0.25 * u[:, 2]))},
+        lambda p: {"assets": p["loan"] - p["dividends"], "liabilities": p["loan"], "equity": -p["dividends"]},
+        lambda p, a: (_close((p["loan"] - p["inventory"] - p["dividends"]) + p["inventory"],
+                             a["liabilities"] + a["equity"])
+                      & _close(a["assets"], a["liabilities"] + a["equity"])
+                      & (p["inventory"] + p["dividends"] < p["loan"]) & (p["dividends"] > 0)),
+        required=("assets", "liabilities", "equity")),
+    ProblemTemplate(
+        "financial_ratios", "easy",
+        "Calculate the current ratio if current assets are ${current_assets:,.0f} and current liabilities are "
+        "${current_liabilities:,.0f}.",
+        2, lambda u: {"current_assets": _steps(u[:, 0], 10000, 500000, 1000),
+                      "current_liabilities": _steps(u[:, 1], 5000, 250000, 1000)},
+        lambda p: {"current_ratio": p["current_assets"] / p["current_liabilities"]},
+        lambda p, a: (_close(a["current_ratio"] * p["current_liabilities"], p["current_assets"])
+                      & (a["current_ratio"] > 0.2) & (a["current_ratio"] < 10)),
+        required=("current_ratio",)),
+    ProblemTemplate(
+        "financial_ratios", "medium",
+        "A company has current assets of ${current_assets:,.0f}, inventory of ${inventory:,.0f}, and current "
+        "liabilities of ${current_liabilities:,.0f}. Calculate the quick ratio.",
+        3, lambda u: {"current_assets": (assets := _steps(u[:, 0], 20000, 500000, 1000)),
+                      "inventory": _hundreds(assets * (0.1 + 0.5 * u[:, 1])),
+                      "current_liabilities": _hundreds(assets * (0.2 + 0.8 * u[:, 2]))},
+        lambda p: {"quick_ratio": (p["current_assets"] - p["inventory"]) / p["current_liabilities"]},
+        lambda p, a: (_close(a["quick_ratio"] * p["current_liabilities"] + p["inventory"], p["current_assets"])
+                      & (a["quick_ratio"] > 0)),
+        required=("quick_ratio",)),
+    ProblemTemplate(
+        "financial_ratios", "hard",
+        "Calculate the return on equity if net income is ${net_income:,.0f}, total assets are "
+        "${total_assets:,.0f}, and total liabilities are ${total_liabilities:,.0f}.",
+        3, lambda u: {"total_assets": (assets := _steps(u[:, 0], 100000, 2000000, 10000)),
+                      "total_liabilities": (debt := np.round(assets * (0.2 + 0.6 * u[:, 1]), -3)),
+                      "net_income": _hundreds((assets - debt) * (0.02 + 0.28 * u[:, 2]))},
+        lambda p: {"return_on_equity": 100 * p["net_income"] / (p["total_assets"] - p["total_liabilities"])},
+        lambda p, a: (_close(a["return_on_equity"] / 100 * (p["total_assets"] - p["total_liabilities"]),
+                             p["net_income"]) & (p["net_income"] > 0)),
+        required=("return_on_equity",), percent=("return_on_equity",)),
+    ProblemTemplate(
+        "financial_statements", "easy",
+        "A company earns ${revenue:,.0f} in revenue and has ${expenses:,.0f} of expenses this year. What is its "
+        "net income, and on which financial statement does it appear?",
+        2, lambda u: {"revenue": (revenue := _steps(u[:, 0], 20000, 1000000, 1000)),
+                      "expenses": _hundreds(revenue * (0.5 + 0.45 * u[:, 1]))},
+        lambda p: {"net_income": p["revenue"] - p["expenses"]},
+        lambda p, a: _close(a["net_income"] + p["expenses"], p["revenue"]) & (a["net_income"] > 0),
+        required=("net_income",)),
+    ProblemTemplate(
+        "financial_statements", "medium",
+        "Retained earnings were ${beginning:,.0f} at the start of the year. Net income was ${net_income:,.0f} and "
+        "the company paid ${dividends:,.0f} in dividends. What are retained earnings at the end of the year, and "
+        "where do they appear?",
+        3, lambda u: {"beginning": _steps(u[:, 0], 10000, 500000, 1000),
+                      "net_income": (income := _steps(u[:, 1], 5000, 200000, 500)),
+                      "dividends": _hundreds(income * (0.1 + 0.5 * u[:, 2]))},
+        lambda p: {"ending_retained_earnings": p["beginning"] + p["net_income"] - p["dividends"]},
+        lambda p, a: (_close(a["ending_retained_earnings"] - p["beginning"], p["net_income"] - p["dividends"])
+                      & (a["ending_retained_earnings"] > p["beginning"])),
+        required=("ending_retained_earnings",)),
+    ProblemTemplate(
+        "financial_statements", "hard",
+        "Net income is ${net_income:,.0f} and depreciation is ${depreciation:,.0f}. Accounts receivable increased "
+        "by ${receivables:,.0f} and accounts payable increased by ${payables:,.0f}. What is cash flow from "
+        "operating activities, using the indirect method?",
+        4, lambda u: {"net_income": (income := _steps(u[:, 0], 10000, 500000, 1000)),
+                      "depreciation": _hundreds(income * (0.05 + 0.3 * u[:, 1])),
+                      "receivables": _hundreds(income * (0.02 + 0.2 * u[:, 2])),
+                      "payables": _hundreds(income * (0.02 + 0.2 * u[:, 3]))},
+        lambda p: {"operating_cash_flow": p["net_income"] + p["depreciation"] - p["receivables"] + p["payables"]},
+        lambda p, a: (_close(a["operating_cash_flow"] - p["net_income"],
+                             p["depreciation"] + p["payables"] - p["receivables"])
+                      & (p["receivables"] > 0) & (p["payables"] > 0) & (p["receivables"] != p["payables"])),
+        required=("operating_cash_flow",)),
+    ProblemTemplate(
+        "time_value_money", "easy",
+        "If you invest ${present_value:,.0f} today at {rate:g}% interest compounded annually, what will it be "
+        "worth in {years:.0f} years?",
+        3, lambda u: {"present_value": _steps(u[:, 0], 500, 50000, 100), "rate": _steps(u[:, 1], 2, 12, 0.5),
+                      "years": _steps(u[:, 2], 2, 30, 1)},
+        lambda p: {"future_value": p["present_value"] * (1 + p["rate"] / 100) ** p["years"]},
+        lambda p, a: _close(np.exp(np.log(a["future_value"] / p["present_value"]) / p["years"]) - 1,
+                            p["rate"] / 100),
+        required=("future_value",)),
+    ProblemTemplate(
+        "time_value_money", "medium",
+        "How much would you need to invest today at {rate:g}% interest compounded annually to have "
+        "${future_value:,.0f} in {years:.0f} years?",
+        3, lambda u: {"future_value": _steps(u[:, 0], 1000, 100000, 500), "rate": _steps(u[:, 1], 2, 12, 0.5),
+                      "years": _steps(u[:, 2], 2, 30, 1)},
+        lambda p: {"present_value": p["future_value"] / (1 + p["rate"] / 100) ** p["years"]},
+        lambda p, a: _close(a["present_value"] * (1 + p["rate"] / 100) ** p["years"], p["future_value"]),
+        required=("present_value",)),
+    ProblemTemplate(
+        "time_value_money", "hard",
+        "What is the present value of an annuity that pays ${payment:,.0f} at the end of each year for "
+        "{years:.0f} years, if the discount rate is {rate:g}%?",
+        3, lambda u: {"payment": _steps(u[:, 0], 100, 20000, 100), "rate": _steps(u[:, 1], 2, 12, 0.5),
+                      "years": _steps(u[:, 2], 3, 30, 1)},
+        lambda p: {"present_value": p["payment"] * (1 - (1 + p["rate"] / 100) ** -p["years"]) / (p["rate"] / 100)},
+        _annuity_check,
+        required=("present_value",)),
+)
+
+TEMPLATE_INDEX = {(template.topic, template.difficulty): number for number, template in enumerate(TEMPLATES)}
+assert {template.topic for template in TEMPLATES} == set(TOPICS)
+
+def problem_code(template_number, seed):
+    return GENERATED | (template_number << SEED_BITS) | int(seed)
+
+def split_code(code):
+    """(template, seed) of a generated problem's code"""
+    return TEMPLATES[(code >> SEED_BITS) & 0x3F], (code & ((1 << SEED_BITS) - 1))
+
+class ProblemPool:
+    """Generated practice problems, pre-generated for every topic and difficulty
+
+    take() pops a ready problem, so serving one costs a deque pop. A
+    background thread, started in each process that serves problems (i.e.
+    after gunicorn forks), tops up any template's pool that falls under
+    low_water with one vectorised batch. The pools are filled when the pool
+    is created, and again with a fresh generator the first time a forked
+    worker takes from them, so workers never serve the same problems.
+    """
+
+    def __init__(self, size=256, low_water=64):
+        self.size = size
+        self.low_water = low_water
+        self.served = 0
+        self.misses = 0
+        self.generated = 0
+        self.rejected = 0
+        self._pools = [deque() for _ in TEMPLATES]
+        self._rng = np.random.default_rng()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._filled_by = os.getpid()
+        for number in range(len(TEMPLATES)):
+            self._refill(number)
+
+    def owns(self, code):
+        return code >= GENERATED
+
+    def take(self, topic, difficulty, rng=None):
+        """(code, text) of a problem for the topic and difficulty, or None if there is no template
+
+        With rng (a seeded tutor replaying a transcript) the problem is
+        generated from rng's draw instead, so replays stay repeatable.
+        """
+        number = TEMPLATE_INDEX.get((topic, difficulty))
+        if number is None:
+            return None
+        if rng is not None:
+            return self._generate_one(number, rng)
+        if self._pid != os.getpid():
+            self._start()
+        pool = self._pools[number]
+        try:
+            problem = pool.popleft()
+            self.served += 1
+        except IndexError:
+            self.misses += 1
+            problem = self._generate_one(number, random)
+        if len(pool) < self.low_water:
+            self._wake.set()
+        return problem
+
+    def text(self, code):
+        template, seed = split_code(code)
+        _, params, _ = template.generate(np.array([seed]))
+        return template.render(params)[0]
+
+    def check_answer(self, code, reply):
+        """Whether the reply contains every required answer to the problem; None if it has no numbers"""
+        numbers = [abs(float(number.replace("$", "").replace(",", ""))) for number in NUMBER.findall(reply)]
+        if not numbers:
+            return None
+        template, seed = split_code(code)
+        _, _, answers = template.generate(np.array([seed]))
+        for name in template.required:
+            expected = abs(float(answers[name][0]))
+            candidates = numbers + [100 * number for number in numbers] if name in template.percent else numbers
+            if not any(abs(number - expected) <= max(0.005 * expected, 0.01) for number in candidates):
+                return False
+        return True
+
+    def _generate_one(self, number, rng):
+        template = TEMPLATES[number]
+        while True:
+            seeds, params, _ = template.generate(np.array([rng.getrandbits(SEED_BITS)]))
+            if len(seeds):
+                return problem_code(number, seeds[0]), template.render(params)[0]
+
+    def _refill(self, number):
+        pool = self._pools[number]
+        wanted = self.size - len(pool)
+        if wanted <= 0:
+            return
+        template = TEMPLATES[number]
+        # A quarter more than wanted, so the check's rejections rarely leave the pool short
+        drawn = wanted + wanted // 4 + 1
+        seeds, params, _ = template.generate(self._rng.integers(0, 1 << SEED_BITS, drawn))
+        self.rejected += drawn - len(seeds)
+        seeds, params = seeds[:wanted], {name: values[:wanted] for name, values in params.items()}
+        self.generated += len(seeds)
+        pool.extend(zip((problem_code(number, seed) for seed in seeds.tolist()), template.render(params)))
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._filled_by != os.getpid():
+                # A forked worker inherits the parent's generator state and problems
+                self._rng = np.random.default_rng()
+                for number, pool in enumerate(self._pools):
+                    pool.clear()
+                    self._refill(number)
+                self._filled_by = os.getpid()
+            threading.Thread(target=self._run, daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            for number, pool in enumerate(self._pools):
+                if len(pool) < self.low_water:
+                    try:
+                        self._refill(number)
+                    except Exception as e:
+                        print(f"❌ Error while generating practice problems: {str(e)}")
+
+    def stats(self):
+        return {
+            "served": self.served,
+            "misses": self.misses,
+            "generated": self.generated,
+            "rejected": self.rejected,
+            "pooled": sum(len(pool) for pool in self._pools)
+        }
+
+def create_problem_pool():
+    """Builds the practice problem pool configured by the PRACTICE_* environment variables, or returns None"""
+    if os.getenv("PRACTICE_POOL_ENABLED", "true").lower() != "true":
+        return None
+    return ProblemPool(
+        size=int(os.getenv("PRACTICE_POOL_SIZE", "256")),
+        low_water=int(os.getenv("PRACTICE_POOL_LOW_WATER", "64"))
+    )
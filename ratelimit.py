@@ -0,0 +1,457 @@
+import asyncio
+import fcntl
+import heapq
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import ADMISSION_WAIT_SECONDS, RATE_LIMITED, observe
+
+# Admission priorities; lower is served first
+PRIORITY_NORMAL = 0
+PRIORITY_HEAVY = 1
+
+class RateLimited(Exception):
+    """Raised when a request is refused; the client should retry after retry_after seconds"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Rate limited ({reason}), retry after {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class InMemoryBucketBackend:
+    """Token buckets held in one worker process, evicting the least recently used"""
+
+    blocking = False  # take() never waits on another process
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1.0):
+        """Takes cost tokens from the bucket for key; returns (allowed, tokens left)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, tokens
+
+class SQLiteBucketBackend:
+    """Token buckets shared by every worker on a host through a SQLite file
+
+    Each take is one short write transaction, so the read-refill-write of a
+    bucket is atomic across worker processes.
+    """
+
+    blocking = True  # take() can wait up to the busy timeout for other workers' writes
+
+    def __init__(self, path, max_keys=100000, evict_every=1000):
+        self.path = path
+        self.max_keys = max_keys
+        self.evict_every = evict_every
+        self._writes = 0
+        self._local = threading.local()
+        # A connection opened before gunicorn forks must not be used by the workers
+        os.register_at_fork(after_in_child=self._forget_connections)
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS buckets_updated ON buckets (updated)")
+
+    def _forget_connections(self):
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, burst, cost=1.0):
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                         (key, tokens, now))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._writes += 1
+        if self._writes % self.evict_every == 0:
+            self.evict()
+        return allowed, tokens
+
+    def evict(self):
+        """Drops the least recently used buckets beyond max_keys"""
+        self._connection().execute(
+            "DELETE FROM buckets WHERE key IN ("
+            "SELECT key FROM buckets ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+            (self.max_keys,)
+        )
+
+class LocalSlots:
+    """Upstream call slots counted in one worker process"""
+
+    poll_interval = None  # releases in this process wake waiters directly
+    blocking = False
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self._used >= self.limit:
+                return None
+            self._used += 1
+            return True
+
+    def release(self, slot):
+        with self._lock:
+            self._used -= 1
+
+    def in_use(self):
+        return self._used
+
+class FileSlots:
+    """Upstream call slots shared by every worker on a host
+
+    Slot i is held with an exclusive flock on <directory>/slot-<i>.lock, so
+    a slot held by a worker that dies is freed by the kernel. Waiters in
+    other processes are not woken by a release and poll instead.
+    """
+
+    poll_interval = 0.005
+    blocking = True  # file operations, which the event loop should not wait on
+
+    def __init__(self, directory, limit):
+        self.directory = directory
+        self.limit = limit
+        self._next = itertools.count()
+        os.makedirs(directory, exist_ok=True)
+
+    def try_acquire(self):
+        start = next(self._next)
+        for i in range(self.limit):
+            path = os.path.join(self.directory, f"slot-{(start + i) % self.limit}.lock")
+            lock_file = open(path, "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock_file
+            except BlockingIOError:
+                lock_file.close()
+        return None
+
+    def release(self, slot):
+        slot.close()
+
+    def in_use(self):
+        used = 0
+        for i in range(self.limit):
+            with open(os.path.join(self.directory, f"slot-{i}.lock"), "a") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    used += 1
+        return used
+
+class Permit:
+    """A held upstream call slot; release() is safe to call more than once"""
+
+    def __init__(self, limiter, slot):
+        self._limiter = limiter
+        self._slot = slot
+        self._acquired = time.monotonic()
+
+    def release(self):
+        slot, self._slot = self._slot, None
+        if slot is not None:
+            self._limiter.release(slot, time.monotonic() - self._acquired)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+# Stands in for a permit when admission control is off
+NO_PERMIT = Permit(None, None)
+
+class ConcurrencyLimiter:
+    """Caps in-flight upstream calls, queueing briefly by priority
+
+    Waiters are served lowest priority value first, then in arrival order.
+    When max_queue requests are already waiting, or a slot does not free up
+    within max_wait seconds, the request is refused with RateLimited at once
+    instead of tying up a worker until gunicorn's timeout.
+
+    A request with a deadline that has to queue is also refused as soon as
+    it cannot make it: straight away when the expected queue wait plus the
+    expected service time (a moving average of how long permits are held,
+    with weight alpha) runs past the deadline, or later, once the deadline
+    is nearer than the expected service time. A free slot is always taken,
+    so the average recovers after an upstream stall.
+    """
+
+    def __init__(self, slots, max_queue=32, max_wait=2.0, alpha=0.2):
+        self.slots = slots
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.alpha = alpha
+        self.service_ewma = None
+        self.shed = 0
+        self._waiters = []  # heap of (priority, sequence)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def expected_wait(self, entry):
+        """Seconds the waiter entry can expect to queue: a slot frees up every service_ewma / limit"""
+        if self.service_ewma is None:
+            return 0.0
+        ahead = sum(1 for waiter in self._waiters if waiter < entry)
+        return ahead * self.service_ewma / self.slots.limit
+
+    def _give_up_at(self, started, entry, deadline):
+        """When the waiter stops waiting; raises RateLimited if it cannot finish by its deadline at all"""
+        give_up_at = started + self.max_wait
+        if deadline is None or self.service_ewma is None:
+            return give_up_at, False
+        expected_wait = self.expected_wait(entry)
+        if started + expected_wait + self.service_ewma > deadline:
+            self.shed += 1
+            RATE_LIMITED.labels("deadline").inc()
+            raise RateLimited("deadline", expected_wait + self.service_ewma)
+        latest = deadline - self.service_ewma
+        return min(give_up_at, latest), latest < give_up_at
+
+    def _timed_out(self, by_deadline):
+        if by_deadline:
+            self.shed += 1
+            RATE_LIMITED.labels("deadline").inc()
+            raise RateLimited("deadline", self.service_ewma)
+        RATE_LIMITED.labels("queue_timeout").inc()
+        raise RateLimited("queue_timeout", self.max_wait)
+
+    def acquire(self, priority=PRIORITY_NORMAL, deadline=None):
+        """Returns a Permit; deadline is the time.monotonic() value the request has to finish by"""
+        started = time.monotonic()
+        with self._condition:
+            if len(self._waiters) >= self.max_queue:
+                RATE_LIMITED.labels("queue_full").inc()
+                raise RateLimited("queue_full", self.max_wait)
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._waiters, entry)
+            try:
+                give_up_at = None
+                while True:
+                    if self._waiters[0] == entry:
+                        slot = self.slots.try_acquire()
+                        if slot is not None:
+                            observe(ADMISSION_WAIT_SECONDS, time.monotonic() - started)
+                            return Permit(self, slot)
+                    if give_up_at is None:
+                        give_up_at, by_deadline = self._give_up_at(started, entry, deadline)
+                    remaining = give_up_at - time.monotonic()
+                    if remaining <= 0:
+                        self._timed_out(by_deadline)
+                    self._condition.wait(min(remaining, self.slots.poll_interval or remaining))
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+
+    def release(self, slot, held=None):
+        """Frees a slot; held is how long it was held, for the expected service time"""
+        self.slots.release(slot)
+        with self._condition:
+            self._record_service(held)
+            self._condition.notify_all()
+
+    def _record_service(self, held):
+        if held is None:
+            return
+        if self.service_ewma is None:
+            self.service_ewma = held
+        else:
+            self.service_ewma += self.alpha * (held - self.service_ewma)
+
+    def stats(self):
+        return {
+            "limit": self.slots.limit,
+            "in_flight": self.slots.in_use(),
+            "waiting": len(self._waiters),
+            "shed_for_deadline": self.shed,
+            "service_ewma_ms": None if self.service_ewma is None else round(self.service_ewma * 1000, 1)
+        }
+
+class AsyncConcurrencyLimiter(ConcurrencyLimiter):
+    """asyncio counterpart of ConcurrencyLimiter for the ASGI app
+
+    Slots that block (FileSlots) are tried on a worker thread, so the event
+    loop keeps serving other connections meanwhile.
+    """
+
+    def __init__(self, slots, max_queue=256, max_wait=2.0, alpha=0.2):
+        super().__init__(slots, max_queue, max_wait, alpha)
+        self._changed = asyncio.Event()
+
+    async def acquire(self, priority=PRIORITY_NORMAL, deadline=None):
+        started = time.monotonic()
+        if len(self._waiters) >= self.max_queue:
+            RATE_LIMITED.labels("queue_full").inc()
+            raise RateLimited("queue_full", self.max_wait)
+        entry = (priority, next(self._sequence))
+        heapq.heappush(self._waiters, entry)
+        try:
+            give_up_at = None
+            while True:
+                if self._waiters[0] == entry:
+                    slot = await self._try_acquire()
+                    if slot is not None:
+                        observe(ADMISSION_WAIT_SECONDS, time.monotonic() - started)
+                        return Permit(self, slot)
+                if give_up_at is None:
+                    give_up_at, by_deadline = self._give_up_at(started, entry, deadline)
+                remaining = give_up_at - time.monotonic()
+                if remaining <= 0:
+                    self._timed_out(by_deadline)
+                try:
+                    await asyncio.wait_for(self._changed.wait(), min(remaining, self.slots.poll_interval or remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+            self._notify()
+
+    async def _try_acquire(self):
+        if not self.slots.blocking:
+            return self.slots.try_acquire()
+        attempt = asyncio.ensure_future(asyncio.to_thread(self.slots.try_acquire))
+        try:
+            return await asyncio.shield(attempt)
+        except asyncio.CancelledError:
+            # The thread may still take a slot after the request is cancelled; hand it straight back
+            attempt.add_done_callback(self._release_abandoned)
+            raise
+
+    def _release_abandoned(self, attempt):
+        if not attempt.cancelled() and attempt.exception() is None and attempt.result() is not None:
+            self.slots.release(attempt.result())
+            self._notify()
+
+    def release(self, slot, held=None):
+        self.slots.release(slot)
+        self._record_service(held)
+        self._notify()
+
+    def _notify(self):
+        # set() wakes every current waiter; clearing straight away rearms the event for the next wait
+        self._changed.set()
+        self._changed.clear()
+
+class AdmissionControl:
+    """Per-client token buckets plus a global cap on in-flight upstream calls
+
+    check() spends one token from the bucket of the session (when the client
+    sent one) and of the client IP, refusing the request when either is
+    empty. Clients that have used more than half their burst are admitted to
+    the upstream queue behind everyone else, so a scripted client cannot
+    crowd out students asking at a normal pace.
+    """
+
+    def __init__(self, backend, limiter, session_rate=0.25, session_burst=10, ip_rate=1.0, ip_burst=20):
+        self.backend = backend
+        self.limiter = limiter
+        self.limits = {"session": (session_rate, session_burst), "ip": (ip_rate, ip_burst)}
+
+    def check(self, session_id=None, ip=None):
+        """Returns the client's admission priority, or raises RateLimited"""
+        priority = PRIORITY_NORMAL
+        for kind, key in (("session", session_id), ("ip", ip)):
+            if not key:
+                continue
+            rate, burst = self.limits[kind]
+            allowed, tokens = self.backend.take(f"{kind}:{key}", rate, burst)
+            if not allowed:
+                RATE_LIMITED.labels(kind).inc()
+                raise RateLimited(kind, (1 - tokens) / rate)
+            if tokens < burst / 2:
+                priority = PRIORITY_HEAVY
+        return priority
+
+    async def acheck(self, session_id=None, ip=None):
+        """check() for the event loop; a backend that can block runs on a worker thread"""
+        if self.backend.blocking:
+            return await asyncio.to_thread(self.check, session_id, ip)
+        return self.check(session_id, ip)
+
+    def acquire(self, priority=PRIORITY_NORMAL, deadline=None):
+        """Waits briefly for an upstream slot; returns a Permit or raises RateLimited
+
+        deadline (a time.monotonic() value) also refuses the request as soon
+        as it could not finish by then.
+        """
+        return self.limiter.acquire(priority, deadline)
+
+    def stats(self):
+        return {"upstream": self.limiter.stats(),
+                "limits": {kind: {"rate": rate, "burst": burst} for kind, (rate, burst) in self.limits.items()}}
+
+def create_admission_control(asynchronous=False):
+    """Builds the admission control configured by the RATE_LIMIT_* environment variables, or None"""
+    if os.getenv("RATE_LIMIT_ENABLED", "true").lower() != "true":
+        return None
+    if os.getenv("RATE_LIMIT_BACKEND", "memory") == "sqlite":
+        backend = SQLiteBucketBackend(os.getenv("RATE_LIMIT_DB_PATH", "ratelimit.db"))
+        slots = FileSlots(os.getenv("RATE_LIMIT_SLOTS_DIR", "/tmp/nuanswers-slots"),
+                          int(os.getenv("RATE_LIMIT_MAX_UPSTREAM", "32")))
+    else:
+        backend = InMemoryBucketBackend()
+        slots = LocalSlots(int(os.getenv("RATE_LIMIT_MAX_UPSTREAM", "32")))
+    limiter_class = AsyncConcurrencyLimiter if asynchronous else ConcurrencyLimiter
+    limiter = limiter_class(
+        slots,
+        max_queue=int(os.getenv("RATE_LIMIT_MAX_QUEUE", "256" if asynchronous else "32")),
+        max_wait=float(os.getenv("RATE_LIMIT_MAX_WAIT", "2"))
+    )
+    return AdmissionControl(
+        backend,
+        limiter,
+        session_rate=float(os.getenv("RATE_LIMIT_SESSION_RATE", "0.25")),
+        session_burst=float(os.getenv("RATE_LIMIT_SESSION_BURST", "10")),
+        ip_rate=float(os.getenv("RATE_LIMIT_IP_RATE", "1")),
+        ip_burst=float(os.getenv("RATE_LIMIT_IP_BURST", "20"))
+    )
+
+def client_ip(remote_addr, forwarded_for=None):
+    """The client address; X-Forwarded-For is only used when RATE_LIMIT_TRUST_PROXY=true"""
+    if forwarded_for and os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true":
+        return forwarded_for.split(",")[0].strip()
+    return remote_addr
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+_WHITESPACE = re.compile(r"\s+")
+_NUMBER = re.compile(r"\d[\d,.]*")
+
+def normalize_prompt(prompt):
+    """Canonical form of a prompt so trivially different pastes share a cache entry"""
+    return _WHITESPACE.sub(" ", prompt).strip().casefold()
+
+def numbers_in(prompt):
+    """The figures in a problem; two pastes with different numbers are different problems"""
+    return sorted(_NUMBER.findall(prompt))
+
+class MinHasher:
+    """MinHash signatures over character n-grams, vectorised with NumPy"""
+
+    _PRIME = (1 << 61) - 1
+
+    def __init__(self, num_perm=64, ngram=5, seed=1):
+        rng = np.random.RandomState(seed)
+        self.ngram = ngram
+        self._a = rng.randint(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        shingles = {text[i:i + self.ngram] for i in range(max(1, len(text) - self.ngram + 1))}
+        hashes = np.fromiter((zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64, count=len(shingles))
+        # Universal hashing (a*x + b) mod p; a, b < 2^31 and x < 2^32 so nothing overflows
+        permuted = (np.outer(hashes, self._a) + self._b) % self._PRIME
+        return permuted.min(axis=0)
+
+    @staticmethod
+    def similarity(sig_a, sig_b):
+        """Estimated Jaccard similarity of the two shingle sets"""
+        return float(np.mean(sig_a == sig_b))
+
+class ResponseCache:
+    """LRU/TTL cache of tutor responses keyed on the normalised first-turn prompt
+
+    With near_duplicates enabled, a miss falls back to MinHash locality-sensitive
+    hashing so a paste that differs by a few characters still hits. Near matches
+    must contain exactly the same figures, since a textbook problem with one
+    number changed has a different answer.
+    """
+
+    def __init__(self, max_entries=5000, ttl_seconds=86400, near_duplicates=False,
+                 similarity_threshold=0.9, bands=16):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.near_duplicates = near_duplicates
+        self.similarity_threshold = similarity_threshold
+        self.bands = bands
+        self.hasher = MinHasher() if near_duplicates else None
+        self._entries = OrderedDict()  # key -> (stored_at, response, signature, band_keys)
+        self._buckets = {}  # (band index, band hash) -> set of keys
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def make_key(self, prompt, params):
+        payload = json.dumps({"prompt": normalize_prompt(prompt), "params": params}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _near_key(self, prompt, params):
+        return json.dumps({"numbers": numbers_in(prompt), "params": params}, sort_keys=True)
+
+    def _band_keys(self, signature, near_key):
+        rows = len(signature) // self.bands
+        return [(near_key, band, signature[band * rows:(band + 1) * rows].tobytes())
+                for band in range(self.bands)]
+
+    def get(self, prompt, params):
+        """Returns a cached response for the prompt and model params, or None"""
+        key = self.make_key(prompt, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._remove(key)
+
+        if self.near_duplicates:
+            response = self._get_similar(prompt, params)
+            if response is not None:
+                return response
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _get_similar(self, prompt, params):
+        signature = self.hasher.signature(normalize_prompt(prompt))
+        with self._lock:
+            candidates = set()
+            for band_key in self._band_keys(signature, self._near_key(prompt, params)):
+                candidates.update(self._buckets.get(band_key, ()))
+            best_key, best_score = None, self.similarity_threshold
+            for key in candidates:
+                entry = self._entries[key]
+                score = MinHasher.similarity(signature, entry[2])
+                if score >= best_score and not self._expired(entry):
+                    best_key, best_score = key, score
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            self.near_hits += 1
+            return self._entries[best_key][1]
+
+    def put(self, prompt, params, response):
+        key = self.make_key(prompt, params)
+        signature, band_keys = None, ()
+        if self.near_duplicates:
+            signature = self.hasher.signature(normalize_prompt(prompt))
+            band_keys = self._band_keys(signature, self._near_key(prompt, params))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic(), response, signature, band_keys)
+            for band_key in band_keys:
+                self._buckets.setdefault(band_key, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _expired(self, entry):
+        return time.monotonic() - entry[0] > self.ttl_seconds
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for band_key in entry[3]:
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def stats(self):
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.near_hits) / lookups, 4) if lookups else 0.0
+        }
+
+def create_response_cache():
+    """Builds the response cache configured by the RESPONSE_CACHE_* environment variables"""
+    return ResponseCache(
+        max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000")),
+        ttl_seconds=int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400")),
+        near_duplicates=os.getenv("RESPONSE_CACHE_NEAR_DUPLICATES", "false").lower() == "true",
+        similarity_threshold=float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.9"))
+    )
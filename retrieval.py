@@ -0,0 +1,233 @@
+import argparse
+import json
+import math
+import mmap
+import os
+import random
+import re
+import shutil
+import tempfile
+from collections import Counter
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(REPO_DIR, "corpus", "problems.jsonl")
+DEFAULT_INDEX_DIR = os.path.join(REPO_DIR, "retrieval_index")
+
+_TOKEN = re.compile(r"[a-z][a-z']+")
+STOPWORDS = frozenset("""
+    a an and are as at be by do does for from has have how i if in into is it its me of on or so than that
+    the their them then there these this to was we were what when where which who why will with would you your
+""".split())
+
+def tokenize(text):
+    """Lowercased word terms; figures and stopwords carry no topical signal"""
+    return [term for term in _TOKEN.findall(text.lower()) if term not in STOPWORDS]
+
+def term_frequencies(text):
+    """Sublinear term frequency weights of a text"""
+    return {term: 1.0 + math.log(count) for term, count in Counter(tokenize(text)).items()}
+
+def item_text(item):
+    return f"{item['problem']} {item.get('hint', '')}"
+
+def read_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def build_index(items, directory):
+    """Writes a TF-IDF index of corpus items to directory
+
+    Items are dicts with "problem", "hint", "topic" and "difficulty". The
+    postings are stored column-wise (term -> documents) as flat .npy arrays so
+    they can be memory-mapped. The index is written to a temporary directory
+    and renamed into place, so concurrent builders never see a partial index.
+    """
+    items = list(items)
+    vocabulary = {}
+    doc_ids, term_ids, weights = [], [], []
+    for doc_id, item in enumerate(items):
+        for term, weight in term_frequencies(item_text(item)).items():
+            doc_ids.append(doc_id)
+            term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+            weights.append(weight)
+    # intp/float64 are what np.bincount works in; casting at query time costs more than the search
+    doc_ids = np.array(doc_ids, dtype=np.intp)
+    term_ids = np.array(term_ids, dtype=np.intp)
+    weights = np.array(weights, dtype=np.float64)
+
+    # Smoothed IDF, then L2-normalise every document so scores are cosine similarities
+    document_frequency = np.bincount(term_ids, minlength=len(vocabulary))
+    idf = (np.log((len(items) + 1) / (document_frequency + 1)) + 1).astype(np.float32)
+    weights *= idf[term_ids]
+    norms = np.sqrt(np.bincount(doc_ids, weights=weights ** 2, minlength=len(items)))
+    weights /= np.maximum(norms, 1e-12)[doc_ids]
+
+    topics = sorted({item["topic"] for item in items})
+    difficulties = sorted({item.get("difficulty", "") for item in items})
+    topic_codes = {topic: code for code, topic in enumerate(topics)}
+    difficulty_codes = {difficulty: code for code, difficulty in enumerate(difficulties)}
+    doc_topics = np.array([topic_codes[item["topic"]] for item in items], dtype=np.int16)
+
+    # Postings are grouped by term, then by topic, so a topic-filtered search reads one contiguous run
+    posting_topics = doc_topics[doc_ids]
+    order = np.lexsort((doc_ids, posting_topics, term_ids))
+    run_lengths = np.bincount(term_ids * len(topics) + posting_topics, minlength=len(vocabulary) * len(topics))
+    indptr = np.zeros(len(vocabulary) * len(topics) + 1, dtype=np.int64)
+    np.cumsum(run_lengths, out=indptr[1:])
+
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".retrieval-", dir=parent)
+    try:
+        offsets = [0]
+        with open(os.path.join(staging, "items.jsonl"), "wb") as f:
+            for item in items:
+                line = (json.dumps(item) + "\n").encode()
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+        arrays = {
+            "indptr": indptr,
+            "postings": doc_ids[order],
+            "weights": weights[order],
+            "idf": idf,
+            "offsets": np.array(offsets, dtype=np.int64),
+            "topics": doc_topics,
+            "difficulties": np.array([difficulty_codes[item.get("difficulty", "")] for item in items], dtype=np.int8),
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(staging, f"{name}.npy"), array)
+        with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"vocabulary": vocabulary, "topics": topics, "difficulties": difficulties}, f)
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.rename(staging, directory)
+    except OSError:
+        # Another worker finished the same build first
+        shutil.rmtree(staging, ignore_errors=True)
+        if not os.path.isfile(os.path.join(directory, "meta.json")):
+            raise
+
+class RetrievalIndex:
+    """Top-k TF-IDF search over worked problems and hints
+
+    The arrays are opened with mmap_mode="r", so every worker process on a
+    host reads the same pages from the OS page cache rather than holding its
+    own copy. A query only reads the postings of its own terms (and topic):
+    their weights are summed per document with np.bincount and the best k
+    are picked with np.argpartition.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        load = lambda name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        self.indptr = load("indptr")
+        self.postings = load("postings")
+        self.weights = load("weights")
+        self.idf = load("idf")
+        self.offsets = load("offsets")
+        self.topic_codes = load("topics")
+        self.difficulty_codes = load("difficulties")
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.vocabulary = meta["vocabulary"]
+        self.topics = {topic: code for code, topic in enumerate(meta["topics"])}
+        self.difficulties = {difficulty: code for code, difficulty in enumerate(meta["difficulties"])}
+        with open(os.path.join(directory, "items.jsonl"), "rb") as f:
+            self._items = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def item(self, doc_id):
+        start, end = self.offsets[doc_id], self.offsets[doc_id + 1]
+        return json.loads(self._items[start:end])
+
+    def search(self, text, k=3, topic=None, min_score=0.0):
+        """Returns up to k (cosine score, item) pairs, best first"""
+        query = [(self.vocabulary[term], weight) for term, weight in term_frequencies(text).items()
+                 if term in self.vocabulary]
+        if not query or (topic is not None and topic not in self.topics):
+            return []
+        norm = math.sqrt(sum((weight * self.idf[term]) ** 2 for term, weight in query))
+        runs = len(self.topics)
+        if topic is None:
+            first, last = 0, runs
+        else:
+            first = self.topics[topic]
+            last = first + 1
+        spans = [(self.indptr[term * runs + first], self.indptr[term * runs + last], weight * self.idf[term] / norm)
+                 for term, weight in query]
+        docs = np.concatenate([self.postings[start:end] for start, end, _ in spans])
+        if not len(docs):
+            return []
+        contributions = np.concatenate([self.weights[start:end] * weight for start, end, weight in spans])
+
+        scores = np.bincount(docs, weights=contributions)
+        # The top k are all within half of the best score unless fewer than k documents are
+        threshold = max(min_score, 1e-9)
+        best = np.flatnonzero(scores >= max(threshold, 0.5 * scores.max()))
+        if len(best) < k:
+            best = np.flatnonzero(scores >= threshold)
+        if len(best) > k:
+            best = best[np.argpartition(-scores[best], k - 1)[:k]]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(float(scores[doc_id]), self.item(int(doc_id))) for doc_id in best]
+
+    def sample_id(self, topic, difficulty=None, rng=None):
+        """The id of a random corpus item for a topic (and difficulty), or None"""
+        if topic not in self.topics or (difficulty is not None and difficulty not in self.difficulties):
+            return None
+        mask = self.topic_codes == self.topics[topic]
+        if difficulty is not None:
+            mask &= self.difficulty_codes == self.difficulties[difficulty]
+        matches = np.flatnonzero(mask)
+        if not len(matches):
+            return None
+        return int(matches[(rng or random).randrange(len(matches))])
+
+    def sample(self, topic, difficulty=None, rng=None):
+        """A random corpus item for a topic (and difficulty), or None"""
+        doc_id = self.sample_id(topic, difficulty, rng)
+        return None if doc_id is None else self.item(doc_id)
+
+def load_retrieval_index(directory=DEFAULT_INDEX_DIR, corpus=DEFAULT_CORPUS):
+    """Opens the index in directory, building it from corpus the first time"""
+    if not os.path.isfile(os.path.join(directory, "meta.json")):
+        build_index(read_corpus(corpus), directory)
+    return RetrievalIndex(directory)
+
+def create_retrieval_index():
+    """Opens the index configured by the RETRIEVAL_* environment variables, or returns None"""
+    if os.getenv("RETRIEVAL_ENABLED", "true").lower() != "true":
+        return None
+    try:
+        return load_retrieval_index(
+            os.getenv("RETRIEVAL_INDEX_DIR", DEFAULT_INDEX_DIR),
+            os.getenv("RETRIEVAL_CORPUS", DEFAULT_CORPUS)
+        )
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Retrieval index unavailable ({e}), continuing without it")
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the worked-problem retrieval index")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="JSONL corpus of problems and hints")
+    parser.add_argument("--index", default=DEFAULT_INDEX_DIR, help="index directory")
+    parser.add_argument("--query", help="search the index instead of rebuilding it")
+    parser.add_argument("--topic")
+    parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.query is None:
+        items = read_corpus(args.corpus)
+        build_index(items, args.index)
+        print(f"✅ Indexed {len(items)} items into {args.index}")
+        return
+    index = RetrievalIndex(args.index)
+    for score, item in index.search(args.query, k=args.k, topic=args.topic):
+        print(f"{score:.3f}  [{item['topic']}/{item.get('difficulty', '')}] {item['problem']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import os
+import re
+import threading
+
+from NuAnswers import KEYWORD_INDEX, TOPICS
+from metrics import MODEL_ROUTES
+from tutor_prompt import COMPLETION_PARAMS
+
+# Model routes for turns the local tier leaves to the LLM
+SMALL, LARGE = "small", "large"
+
+# "2 years", "$750,000", "12.5%", "D", "b)": the replies the system prompt
+# treats as answers to the previous question
+ANSWER_SHAPE = re.compile(r"^\(?[a-e][.)]?$|^[$€£]?\s*-?[\d,]*\.?\d+\s*%?(?:\s+[a-z]+){0,2}$", re.IGNORECASE)
+ACKNOWLEDGEMENTS = frozenset((
+    "ok", "okay", "yes", "no", "yep", "nope", "sure", "right", "thanks", "thank you", "got it", "i see",
+    "makes sense", "i understand", "that makes sense", "ok thanks", "okay thanks"
+))
+# "1)", "(b)", "part 2": markers of a problem in several parts
+PART_MARKER = re.compile(r"(?:^|\s)(?:\(?[a-d1-9][.)]|part\s+\d)\s", re.IGNORECASE)
+NUMBER = re.compile(r"\d[\d,]*(?:\.\d+)?")
+
+class ModelRouter:
+    """Sends each turn that reaches the LLM to the small or the large model
+
+    Opening turns and new problems go to the large model: a question in
+    several parts, a question carrying two or more figures, or a question
+    about another topic than the session's (by the tutor's topic keywords).
+    Replies to the tutor's last question go to the small model with a tight
+    max_tokens: acknowledgements, bare answers such as "$750,000" or "D", and
+    anything of at most short_words words. Longer replies take the default
+    route.
+
+    The large route's params default to COMPLETION_PARAMS, so the response
+    cache keys of opening turns do not change.
+    """
+
+    def __init__(self, small_params, large_params, short_words=8, default=LARGE, enabled=True):
+        self.params = {SMALL: small_params, LARGE: large_params}
+        self.short_words = short_words
+        self.default = default
+        self.enabled = enabled
+        self.turns = {SMALL: 0, LARGE: 0}
+        self._lock = threading.Lock()
+
+    def classify(self, message, history, topic=None):
+        """Returns SMALL or LARGE for a turn; topic is the session's current topic name, if any"""
+        if not self.enabled or not history:
+            return LARGE
+        text = message.strip()
+        if self.is_new_problem(text, topic):
+            return LARGE
+        if (text.lower().rstrip(".!") in ACKNOWLEDGEMENTS or ANSWER_SHAPE.match(text)
+                or len(text.split()) <= self.short_words):
+            return SMALL
+        return self.default
+
+    def is_new_problem(self, text, topic=None):
+        if "?" not in text and not PART_MARKER.search(text):
+            return False
+        if text.count("?") + len(PART_MARKER.findall(text)) >= 2 or len(NUMBER.findall(text)) >= 2:
+            return True
+        named = KEYWORD_INDEX.best(text, groups=TOPICS)
+        return named is not None and named != topic
+
+    def route(self, message, history, topic=None):
+        """Returns (route, completion params) for a turn and counts it"""
+        route = self.classify(message, history, topic)
+        with self._lock:
+            self.turns[route] += 1
+        MODEL_ROUTES.labels(route).inc()
+        return route, self.params[route]
+
+    def stats(self):
+        with self._lock:
+            turns = dict(self.turns)
+        return {
+            "enabled": self.enabled,
+            "turns": turns,
+            "models": {route: params["model"] for route, params in self.params.items()}
+        }
+
+def create_model_router():
+    """Builds the model router configured by the ROUTER_* environment variables"""
+    large = dict(COMPLETION_PARAMS)
+    large["model"] = os.getenv("ROUTER_LARGE_MODEL", large["model"])
+    large["max_tokens"] = int(os.getenv("ROUTER_LARGE_MAX_TOKENS", large["max_tokens"]))
+    small = dict(COMPLETION_PARAMS)
+    small["model"] = os.getenv("ROUTER_SMALL_MODEL", "gpt-3.5-turbo")
+    small["max_tokens"] = int(os.getenv("ROUTER_SMALL_MAX_TOKENS", "300"))
+    default = os.getenv("ROUTER_DEFAULT_ROUTE", LARGE)
+    if default not in (SMALL, LARGE):
+        raise ValueError(f"❌ ERROR: ROUTER_DEFAULT_ROUTE must be {SMALL} or {LARGE}, not {default!r}")
+    return ModelRouter(
+        small_params=small,
+        large_params=large,
+        short_words=int(os.getenv("ROUTER_SHORT_WORDS", "8")),
+        default=default,
+        enabled=os.getenv("ROUTER_ENABLED", "true").lower() == "true"
+    )
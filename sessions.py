@@ -0,0 +1,235 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Rough size of a token for English text; good enough to keep history in budget
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text):
+    """Cheap token estimate used to keep conversation history within budget"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+class InMemorySessionBackend:
+    """Per-process session store with LRU and TTL eviction"""
+
+    def __init__(self, max_sessions=10000, ttl_seconds=3600):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()  # session_id -> (last_used, messages)
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return list(entry[1])
+
+    def set(self, session_id, messages):
+        with self._lock:
+            self._store(session_id, messages)
+
+    def update(self, session_id, change):
+        """Replaces a session's messages with change(messages) in one step
+
+        change gets None for an unknown or expired session. The lock is held
+        throughout, so concurrent updates to one session can't lose each other.
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl_seconds:
+                entry = None
+            self._store(session_id, change(None if entry is None else list(entry[1])))
+
+    def _store(self, session_id, messages):
+        self._sessions[session_id] = (time.monotonic(), messages)
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+class SQLiteSessionBackend:
+    """Session store shared by every worker on a host through a SQLite file
+
+    Stands in for a networked store such as Redis: any backend exposing
+    get/set/update/delete can be passed to SessionStore.
+    """
+
+    def __init__(self, path, max_sessions=100000, ttl_seconds=3600, evict_every=500):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.evict_every = evict_every
+        self._writes = 0
+        self._local = threading.local()
+        # A connection opened before gunicorn forks must not be used by the workers
+        os.register_at_fork(after_in_child=self._forget_connections)
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, messages TEXT NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used)")
+
+    def _forget_connections(self):
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id):
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT messages, last_used FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        if time.time() - row[1] > self.ttl_seconds:
+            self.delete(session_id)
+            return None
+        return json.loads(row[0])
+
+    def set(self, session_id, messages):
+        with self._connection() as conn:
+            self._store(conn, session_id, messages)
+        self._after_write()
+
+    def update(self, session_id, change):
+        """Replaces a session's messages with change(messages) in one transaction
+
+        change gets None for an unknown or expired session. BEGIN IMMEDIATE
+        takes the database's write lock before the read, so an update from
+        another thread or worker waits rather than overwriting this one.
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT messages, last_used FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            messages = None if row is None or time.time() - row[1] > self.ttl_seconds else json.loads(row[0])
+            self._store(conn, session_id, change(messages))
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        self._after_write()
+
+    def _store(self, conn, session_id, messages):
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (id, messages, last_used) VALUES (?, ?, ?)",
+            (session_id, json.dumps(messages), time.time())
+        )
+
+    def _after_write(self):
+        self._writes += 1
+        if self._writes % self.evict_every == 0:
+            self.evict()
+
+    def delete(self, session_id):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def evict(self):
+        """Drops expired sessions, then the least recently used beyond max_sessions"""
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE last_used < ?", (time.time() - self.ttl_seconds,))
+            conn.execute(
+                "DELETE FROM sessions WHERE id IN ("
+                "SELECT id FROM sessions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_sessions,)
+            )
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+class SessionStore:
+    """Keeps per-conversation message history trimmed to a token budget"""
+
+    def __init__(self, backend, token_budget=3000, summary_chars=600):
+        self.backend = backend
+        self.token_budget = token_budget
+        self.summary_chars = summary_chars
+
+    def new_session_id(self):
+        return uuid.uuid4().hex
+
+    def get_history(self, session_id):
+        """Returns the stored messages for a session, or [] if unknown/expired"""
+        if not session_id:
+            return []
+        return self.backend.get(session_id) or []
+
+    def append_turn(self, session_id, user_message, assistant_message):
+        """Records a user/assistant exchange and trims the history to budget
+
+        The read, append and write happen in one backend update, so two
+        requests on a session at once (two tabs, or a retry racing the
+        original) both keep their turn.
+        """
+        turn = [{"role": "user", "content": user_message}, {"role": "assistant", "content": assistant_message}]
+        self.backend.update(session_id, lambda history: self.trim((history or []) + turn))
+
+    def trim(self, messages):
+        """Drops the oldest turns until the history fits the token budget
+
+        The student's opening message usually states the whole problem, so the
+        first time turns are dropped it is kept as a short summary note.
+        """
+        total = sum(estimate_tokens(m["content"]) for m in messages)
+        if total <= self.token_budget:
+            return messages
+
+        summary = None
+        if messages[0]["role"] == "system":
+            summary, messages = messages[0], messages[1:]
+        elif messages[0]["role"] == "user":
+            problem = messages[0]["content"][:self.summary_chars]
+            summary = {"role": "system", "content": f"Earlier in this conversation the student asked: {problem}"}
+        budget = self.token_budget - estimate_tokens(summary["content"])
+
+        # Keep the most recent turns that fit, always dropping whole user/assistant pairs
+        kept, used = [], 0
+        for i in range(len(messages) - 2, -1, -2):
+            pair = messages[i:i + 2]
+            cost = sum(estimate_tokens(m["content"]) for m in pair)
+            if used + cost > budget:
+                break
+            kept[:0] = pair
+            used += cost
+        return [summary] + kept
+
+def create_session_store():
+    """Builds the session store configured by the SESSION_* environment variables"""
+    max_sessions = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+    ttl_seconds = int(os.getenv("SESSION_TTL_SECONDS", "3600"))
+    if os.getenv("SESSION_BACKEND", "memory") == "sqlite":
+        backend = SQLiteSessionBackend(
+            os.getenv("SESSION_DB_PATH", "sessions.db"),
+            max_sessions=max_sessions,
+            ttl_seconds=ttl_seconds
+        )
+    else:
+        backend = InMemorySessionBackend(max_sessions=max_sessions, ttl_seconds=ttl_seconds)
+    return SessionStore(backend, token_budget=int(os.getenv("SESSION_TOKEN_BUDGET", "3000")))
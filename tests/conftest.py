@@ -0,0 +1,74 @@
+import asyncio
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+# The modules live at the repository root, next to app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class FakeOpenAI:
+    """Chat-completions endpoint that answers each request with the next scripted reply
+
+    A reply is a dict: {"status": 500} fails the request; otherwise the
+    stream waits "stall" seconds, sends "tokens" tokens "token_delay" apart,
+    and stalls for "stall_after" seconds after "stall_at" of them.
+    """
+
+    def __init__(self):
+        self.replies = []
+        self.requests = 0
+
+    def script(self, *replies):
+        self.replies = list(replies)
+        self.requests = 0
+
+    async def chat_completions(self, request):
+        await request.json()
+        self.requests += 1
+        reply = self.replies.pop(0) if self.replies else {}
+        if "status" in reply:
+            return JSONResponse({"error": {"message": "Scripted failure", "type": "fake", "code": reply["status"]}},
+                                status_code=reply["status"])
+
+        async def events():
+            await asyncio.sleep(reply.get("stall", 0))
+            for number in range(reply.get("tokens", 3)):
+                if number == reply.get("stall_at"):
+                    await asyncio.sleep(reply["stall_after"])
+                chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": 0, "model": "fake",
+                         "choices": [{"index": 0, "delta": {"content": f"t{number} "}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(reply.get("token_delay", 0))
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+@pytest.fixture(scope="session")
+def fake_openai_server():
+    fake = FakeOpenAI()
+    app = Starlette(routes=[Route("/v1/chat/completions", fake.chat_completions, methods=["POST"])])
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    fake.url = f"http://127.0.0.1:{port}/v1"
+    yield fake
+    server.should_exit = True
+
+@pytest.fixture
+def fake_openai(fake_openai_server, monkeypatch):
+    """The fake upstream with an empty script; the OpenAI SDK is pointed at it"""
+    monkeypatch.setenv("OPENAI_BASE_URL", fake_openai_server.url)
+    fake_openai_server.script()
+    return fake_openai_server
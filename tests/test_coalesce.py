@@ -0,0 +1,81 @@
+import asyncio
+import threading
+
+import pytest
+
+from coalesce import AsyncSingleFlight, SingleFlight
+
+def stub_stream(deltas, opened, proceed=None):
+    """open_deltas for a fake upstream; waits on proceed after the first delta"""
+    def open_deltas():
+        opened.append(deltas)
+
+        def stream():
+            for number, delta in enumerate(deltas):
+                if number == 1 and proceed is not None:
+                    proceed.wait(5)
+                yield delta
+        return stream()
+    return open_deltas
+
+def test_concurrent_requests_share_one_stream():
+    flights = SingleFlight()
+    opened = []
+    proceed = threading.Event()
+    leader = flights.stream("key", stub_stream(["Hi ", "there"], opened, proceed))
+    assert next(leader) == "Hi "
+    follower = flights.stream("key", stub_stream(["Hi ", "there"], opened))
+    proceed.set()
+    assert "".join(follower) == "Hi there"
+    assert "".join(leader) == "there"
+    assert len(opened) == 1
+    assert flights.stats_dict()["coalesced"] == 1
+
+def test_request_after_cancelled_leader_starts_a_new_flight():
+    flights = SingleFlight()
+    opened = []
+    proceed = threading.Event()
+    leader = flights.stream("key", stub_stream(["Hi ", "there"], opened, proceed))
+    assert next(leader) == "Hi "
+    # The client goes away mid-stream; the upstream is still producing
+    leader.close()
+    threading.Timer(0.1, proceed.set).start()
+    follower = flights.stream("key", stub_stream(["Hi ", "there"], opened))
+    assert "".join(follower) == "Hi there"
+    assert len(opened) == 2
+    assert flights.stats_dict()["leaders"] == 2
+
+def test_upstream_error_reaches_every_subscriber():
+    flights = SingleFlight()
+
+    def failing():
+        yield "Hi "
+        raise ConnectionError("upstream dropped")
+    with pytest.raises(ConnectionError):
+        "".join(flights.stream("key", failing))
+    assert flights.stats_dict()["in_flight"] == 0
+
+def test_async_request_after_cancelled_leader_starts_a_new_flight():
+    async def scenario():
+        flights = AsyncSingleFlight()
+        opened = []
+        proceed = asyncio.Event()
+
+        def open_deltas(wait):
+            async def stream():
+                opened.append(wait)
+                yield "Hi "
+                if wait:
+                    await proceed.wait()
+                yield "there"
+            return stream()
+
+        leader = flights.stream("key", lambda: open_deltas(True))
+        assert await anext(leader) == "Hi "
+        await leader.aclose()
+        follower = flights.stream("key", lambda: open_deltas(False))
+        text = "".join([delta async for delta in follower])
+        return text, opened
+    text, opened = asyncio.run(scenario())
+    assert text == "Hi there"
+    assert opened == [True, False]
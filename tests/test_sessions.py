@@ -0,0 +1,45 @@
+import threading
+
+import pytest
+
+from sessions import InMemorySessionBackend, SQLiteSessionBackend, SessionStore
+
+THREADS = 8
+TURNS = 25
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        backend = SQLiteSessionBackend(str(tmp_path / "sessions.db"))
+    else:
+        backend = InMemorySessionBackend()
+    return SessionStore(backend, token_budget=100000)
+
+def test_concurrent_turns_on_one_session_are_all_kept(store):
+    start = threading.Barrier(THREADS)
+
+    def requests(worker):
+        start.wait()
+        for turn in range(TURNS):
+            store.append_turn("tab", f"question {worker}.{turn}", f"answer {worker}.{turn}")
+
+    threads = [threading.Thread(target=requests, args=(worker,)) for worker in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    history = store.get_history("tab")
+    assert len(history) == 2 * THREADS * TURNS
+    # Each turn's question is followed by its own answer
+    for question, answer in zip(history[::2], history[1::2]):
+        assert question["content"].replace("question", "answer") == answer["content"]
+
+def test_append_trims_to_budget(store):
+    store.token_budget = 80
+    for turn in range(10):
+        store.append_turn("tab", f"question {turn} " * 5, f"answer {turn} " * 5)
+    history = store.get_history("tab")
+    assert history[0]["role"] == "system"
+    assert "question 0" in history[0]["content"]
+    assert history[-1]["content"].startswith("answer 9")
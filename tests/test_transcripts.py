@@ -0,0 +1,35 @@
+import glob
+import os
+import time
+
+from transcripts import OPEN_SUFFIX, TranscriptLog, read_transcripts, segment_paths
+
+def test_out_of_range_counters_are_clamped_not_dropped(tmp_path):
+    log = TranscriptLog(str(tmp_path), linger_seconds=0.2)
+    for number in range(100):
+        log.record(f"s{number}", "hi", "hello", "llm", stage=300 if number == 50 else 1, hints_given=-1)
+    log.close()
+    table = read_transcripts(str(tmp_path))
+    assert table.num_rows == 100
+    assert log.stats()["dropped"] == 0
+    assert max(table["stage"].to_pylist()) == 255
+    assert set(table["hints_given"].to_pylist()) == {0}
+
+def test_a_turn_that_cannot_be_converted_is_dropped_alone(tmp_path):
+    log = TranscriptLog(str(tmp_path), linger_seconds=0.2)
+    for number in range(100):
+        log.record(f"s{number}", "hi", "hello", "llm", latency_ms="slow" if number == 50 else 1.0)
+    log.close()
+    assert read_transcripts(str(tmp_path)).num_rows == 99
+    assert log.stats()["dropped"] == 1
+
+def test_idle_segment_is_rotated_after_segment_seconds(tmp_path):
+    log = TranscriptLog(str(tmp_path), segment_seconds=0.2, fsync_seconds=0.05, linger_seconds=0.0)
+    log.record("s", "hi", "hello", "llm")
+    stop = time.monotonic() + 5
+    while not segment_paths(str(tmp_path)) and time.monotonic() < stop:
+        time.sleep(0.05)
+    assert len(segment_paths(str(tmp_path))) == 1
+    assert not glob.glob(os.path.join(str(tmp_path), "*" + OPEN_SUFFIX))
+    log.close()
+    assert read_transcripts(str(tmp_path)).num_rows == 1
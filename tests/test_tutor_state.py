@@ -0,0 +1,33 @@
+import pytest
+
+from NuAnswers import (LEARNING_PATH, MAX_HINTS, TOPICS, AccountingFinanceTutor, ConversationState,
+                       TutorState)
+
+GOOD_ANSWER = "assume we analyze the liquidity ratio and evaluate the current ratio"
+
+@pytest.mark.parametrize("state", [
+    TutorState(),
+    TutorState(ConversationState.PRACTICE, topic=len(TOPICS) - 1, question_index=255, hints_given=255,
+               problem=-(2**31)),
+    TutorState(ConversationState.IN_DISCUSSION, topic=0, question_index=0, hints_given=0, problem=2**31 - 1),
+])
+def test_state_round_trips_through_bytes(state):
+    data = state.to_bytes()
+    assert len(data) == 8
+    assert TutorState.from_bytes(data) == state
+
+def test_question_index_stops_at_the_end_of_the_learning_path():
+    tutor = AccountingFinanceTutor(seed=1)
+    tutor.evaluate_response("ratio analysis")
+    for _ in range(300):
+        tutor.evaluate_response(GOOD_ANSWER)
+    assert tutor.state.question_index == len(LEARNING_PATH["financial_ratios"])
+    assert TutorState.from_bytes(tutor.state.to_bytes()) == tutor.state
+
+def test_hints_stop_at_max_hints():
+    tutor = AccountingFinanceTutor(seed=1)
+    tutor.evaluate_response("ratio analysis")
+    for _ in range(300):
+        tutor.evaluate_response("hint")
+    assert tutor.state.hints_given == MAX_HINTS
+    assert TutorState.from_bytes(tutor.state.to_bytes()) == tutor.state
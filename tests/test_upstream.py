@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+import openai
+import pytest
+
+from deadlines import UpstreamDeadlineExceeded
+from upstream import AsyncUpstreamClient, UpstreamClient, UpstreamConfig
+
+MESSAGES = [{"role": "user", "content": "What is the current ratio?"}]
+PARAMS = {"model": "fake", "max_tokens": 16}
+
+def config(**overrides):
+    settings = dict(max_attempts=3, backoff_initial=0.01, backoff_max=0.02, deadline_seconds=5.0)
+    settings.update(overrides)
+    return UpstreamConfig(**settings)
+
+def test_streams_the_completion(fake_openai):
+    client = UpstreamClient("test-key", config())
+    assert client.complete(MESSAGES, **PARAMS) == "t0 t1 t2 "
+    assert client.stats_dict()["requests"] == 1
+
+def test_retries_rate_limits_and_server_errors(fake_openai):
+    fake_openai.script({"status": 429}, {"status": 500}, {})
+    client = UpstreamClient("test-key", config())
+    assert client.complete(MESSAGES, **PARAMS) == "t0 t1 t2 "
+    assert fake_openai.requests == 3
+    assert client.stats_dict()["retries"] == 2
+
+def test_gives_up_after_max_attempts(fake_openai):
+    fake_openai.script({"status": 500}, {"status": 500}, {"status": 500}, {})
+    client = UpstreamClient("test-key", config())
+    with pytest.raises(openai.InternalServerError):
+        client.complete(MESSAGES, **PARAMS)
+    assert fake_openai.requests == 3
+    assert client.stats_dict()["failures"] == 1
+
+def test_does_not_retry_client_errors(fake_openai):
+    fake_openai.script({"status": 400})
+    client = UpstreamClient("test-key", config())
+    with pytest.raises(openai.BadRequestError):
+        client.complete(MESSAGES, **PARAMS)
+    assert fake_openai.requests == 1
+
+def test_deadline_before_the_first_token(fake_openai):
+    fake_openai.script({"stall": 3}, {"stall": 3}, {"stall": 3})
+    client = UpstreamClient("test-key", config(deadline_seconds=0.5))
+    started = time.monotonic()
+    with pytest.raises(UpstreamDeadlineExceeded) as raised:
+        client.complete(MESSAGES, **PARAMS)
+    assert time.monotonic() - started < 1.5
+    # The client's own deadline passed, which counts against the upstream
+    assert not raised.value.requested
+    assert client.stats_dict()["deadline_exceeded"] == 1
+
+def test_stalled_stream_is_cut_off_at_the_request_deadline(fake_openai):
+    fake_openai.script({"tokens": 5, "stall_at": 2, "stall_after": 3})
+    client = UpstreamClient("test-key", config())
+    deltas = []
+    started = time.monotonic()
+    with pytest.raises(UpstreamDeadlineExceeded) as raised:
+        for delta in client.stream_chat(MESSAGES, time.monotonic() + 0.5, **PARAMS):
+            deltas.append(delta)
+    assert deltas == ["t0 ", "t1 "]
+    assert time.monotonic() - started < 1.5
+    # The request brought the earlier deadline
+    assert raised.value.requested
+
+def test_hedge_wins_when_the_first_request_stalls(fake_openai):
+    fake_openai.script({"stall": 2}, {})
+    client = UpstreamClient("test-key", config(hedge=True, hedge_percentile=50, hedge_min_samples=1))
+    client.latency.record(0.05)
+    started = time.monotonic()
+    assert client.complete(MESSAGES, **PARAMS) == "t0 t1 t2 "
+    assert time.monotonic() - started < 1.5
+    stats = client.stats_dict()
+    assert (stats["hedges"], stats["hedge_wins"]) == (1, 1)
+
+def test_no_hedge_without_enough_latency_samples(fake_openai):
+    client = UpstreamClient("test-key", config(hedge=True, hedge_min_samples=20))
+    assert client.complete(MESSAGES, **PARAMS) == "t0 t1 t2 "
+    assert client.stats_dict()["hedges"] == 0
+    assert fake_openai.requests == 1
+
+def test_async_client_retries_and_keeps_its_deadline(fake_openai):
+    async def scenario():
+        client = AsyncUpstreamClient("test-key", config(deadline_seconds=0.5))
+        fake_openai.script({"status": 503}, {})
+        text = await client.complete(MESSAGES, **PARAMS)
+        fake_openai.script({"stall": 3}, {"stall": 3}, {"stall": 3})
+        started = time.monotonic()
+        with pytest.raises(UpstreamDeadlineExceeded):
+            await client.complete(MESSAGES, **PARAMS)
+        return text, time.monotonic() - started, client.stats_dict()
+    text, elapsed, stats = asyncio.run(scenario())
+    assert text == "t0 t1 t2 "
+    assert elapsed < 1.5
+    assert (stats["retries"], stats["deadline_exceeded"]) == (1, 1)
+
+def test_async_hedge_wins_when_the_first_request_stalls(fake_openai):
+    async def scenario():
+        client = AsyncUpstreamClient("test-key", config(hedge=True, hedge_percentile=50, hedge_min_samples=1))
+        client.latency.record(0.05)
+        fake_openai.script({"stall": 2}, {})
+        started = time.monotonic()
+        text = await client.complete(MESSAGES, **PARAMS)
+        return text, time.monotonic() - started, client.stats_dict()
+    text, elapsed, stats = asyncio.run(scenario())
+    assert text == "t0 t1 t2 "
+    assert elapsed < 1.5
+    assert (stats["hedges"], stats["hedge_wins"]) == (1, 1)
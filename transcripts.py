@@ -0,0 +1,319 @@
+import atexit
+import glob
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+import pyarrow as pa
+
+# One row per chat turn. Tier, topic and state repeat a handful of values, so
+# they are dictionary-encoded and cost a byte or two per row.
+TRANSCRIPT_SCHEMA = pa.schema([
+    ("timestamp", pa.timestamp("us", tz="UTC")),
+    ("session_id", pa.string()),
+    ("user_message", pa.string()),
+    ("response", pa.string()),
+    ("tier", pa.dictionary(pa.int8(), pa.string())),
+    ("topic", pa.dictionary(pa.int8(), pa.string())),
+    ("conversation_state", pa.dictionary(pa.int8(), pa.string())),
+    ("hints_given", pa.uint8()),
+    # Index into the topic's LEARNING_PATH the session had reached
+    ("stage", pa.uint8()),
+    ("latency_ms", pa.float32()),
+])
+
+SEGMENT_SUFFIX = ".arrows"
+# The segment being written; renamed to SEGMENT_SUFFIX once rotated out
+OPEN_SUFFIX = SEGMENT_SUFFIX + ".open"
+
+class TranscriptLog:
+    """Append-only log of chat turns in Arrow IPC stream segments
+
+    record() only puts the turn on an in-memory queue. A background thread
+    waits linger_seconds after a turn arrives, then writes whatever has queued
+    up as one record batch, so a busy worker builds few, large batches. Every
+    batch is flushed to the OS, and fsynced at most every fsync_seconds. A
+    segment is closed and renamed once it passes segment_bytes or
+    segment_seconds, so readers can memory-map finished segments while the
+    writer carries on. Each process writes its own segments (their names carry
+    the pid), so gunicorn workers never share a file. A worker that is killed
+    leaves its segment open; the next process to start writing seals it, up
+    to its last complete batch.
+
+    A full queue drops the turn and counts it rather than slowing the request.
+    Counters beyond their column's range are clamped to it, and a turn that
+    still cannot be converted is dropped on its own, not with its batch.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 2**20, segment_seconds=3600.0, fsync_seconds=1.0,
+                 batch_size=1024, max_queue=100000, linger_seconds=0.05):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.fsync_seconds = fsync_seconds
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.linger_seconds = linger_seconds
+        self.recorded = 0
+        self.dropped = 0
+        self.batches = 0
+        self.segments = 0
+        self.bytes_written = 0
+        self.recovered = 0
+        self._pid = None
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, session_id, user_message, response, tier, topic=None, conversation_state=None,
+               hints_given=0, latency_ms=None, stage=0):
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self._queue.put_nowait((time.time(), session_id, user_message, response, tier, topic,
+                                    conversation_state, _clamp_uint8(hints_given), _clamp_uint8(stage),
+                                    latency_ms))
+            self.recorded += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        # The writer thread is started in the process that records, i.e. after gunicorn forks
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            try:
+                self.recovered += seal_orphaned_segments(self.directory)
+            except Exception as e:
+                print(f"❌ Error while sealing orphaned transcript segments: {str(e)}")
+            self._queue = queue.Queue(self.max_queue)
+            self._thread = threading.Thread(target=self._run, args=(self._queue,), daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            atexit.register(self.close)
+
+    def close(self, timeout=5.0):
+        """Writes out everything queued, then closes and renames the current segment"""
+        if self._pid != os.getpid():
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._pid = None
+
+    def _run(self, turns):
+        segment = None
+        stopping = False
+        while not stopping:
+            rows = []
+            try:
+                rows.append(turns.get(timeout=self.fsync_seconds))
+                # Let a few more turns queue up, so a batch is not built for every single turn
+                if turns.qsize() < self.batch_size:
+                    time.sleep(self.linger_seconds)
+                while len(rows) < self.batch_size:
+                    rows.append(turns.get_nowait())
+            except queue.Empty:
+                pass
+            if None in rows:
+                rows = [row for row in rows if row is not None]
+                stopping = True
+            try:
+                # Also checked when no turn came in, so an idle worker's segment is still rotated on time
+                if segment is not None and segment.full(self.segment_bytes, self.segment_seconds):
+                    self._close_segment(segment)
+                    segment = None
+                batch = self._to_batch(rows) if rows else None
+                if batch is not None:
+                    if segment is None:
+                        segment = _Segment(self.directory, self.segments)
+                        self.segments += 1
+                    written = segment.write(batch)
+                    self.batches += 1
+                    self.bytes_written += written
+                if segment is not None:
+                    segment.sync(self.fsync_seconds)
+            except Exception as e:
+                # Losing a batch must never take down the worker
+                print(f"❌ Error while writing transcripts: {str(e)}")
+                self.dropped += len(rows)
+        if segment is not None:
+            self._close_segment(segment)
+
+    def _to_batch(self, rows):
+        try:
+            return _to_batch(rows)
+        except (pa.ArrowException, TypeError, ValueError, OverflowError):
+            pass
+        # Keep every row that converts on its own; only the bad ones are lost
+        good = []
+        for row in rows:
+            try:
+                _to_batch([row])
+                good.append(row)
+            except (pa.ArrowException, TypeError, ValueError, OverflowError) as e:
+                print(f"❌ Error while converting a transcript turn: {str(e)}")
+                self.dropped += 1
+        return _to_batch(good) if good else None
+
+    def _close_segment(self, segment):
+        try:
+            segment.close()
+        except Exception as e:
+            print(f"❌ Error while closing transcript segment {segment.path}: {str(e)}")
+
+    def stats(self):
+        return {
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "segments": self.segments,
+            "bytes_written": self.bytes_written,
+            "recovered_segments": self.recovered
+        }
+
+class _Segment:
+    """One open segment file and its Arrow stream writer"""
+
+    def __init__(self, directory, number):
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        self.path = os.path.join(directory, f"transcripts-{stamp}-{os.getpid()}-{number:06d}{OPEN_SUFFIX}")
+        # Never overwrites a segment, even one from a log reopened within the same microsecond
+        self.file = open(self.path, "xb")
+        self.writer = pa.ipc.new_stream(self.file, TRANSCRIPT_SCHEMA)
+        self.opened = time.monotonic()
+        self.synced = time.monotonic()
+        self.dirty = False
+
+    def write(self, batch):
+        before = self.file.tell()
+        self.writer.write_batch(batch)
+        # Written batches reach the OS straight away; a crashed process loses nothing it logged
+        self.file.flush()
+        self.dirty = True
+        return self.file.tell() - before
+
+    def sync(self, interval):
+        """fsyncs unless that was done less than interval seconds ago"""
+        if self.dirty and time.monotonic() - self.synced >= interval:
+            os.fsync(self.file.fileno())
+            self.synced = time.monotonic()
+            self.dirty = False
+
+    def full(self, max_bytes, max_seconds):
+        return self.file.tell() >= max_bytes or time.monotonic() - self.opened >= max_seconds
+
+    def close(self):
+        self.writer.close()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.rename(self.path, self.path[:-len(".open")])
+
+def _segment_pid(path):
+    # transcripts-<stamp>-<pid>-<number>.arrows[.open]
+    return int(os.path.basename(path).split("-")[2])
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def seal_orphaned_segments(directory):
+    """Renames open segments whose writer process has died, so they are read and ingested
+
+    Pids are only meaningful on one host, and a segment whose pid has been
+    reused waits for that process to exit. Returns the number of segments
+    sealed.
+    """
+    sealed = 0
+    for path in glob.glob(os.path.join(directory, "transcripts-*" + OPEN_SUFFIX)):
+        if _pid_alive(_segment_pid(path)):
+            continue
+        try:
+            os.rename(path, path[:-len(".open")])
+        except FileNotFoundError:
+            # Another worker starting up sealed it first
+            continue
+        sealed += 1
+        print(f"⚠️ Sealed transcript segment {os.path.basename(path)} left open by a stopped worker")
+    return sealed
+
+def _clamp_uint8(value):
+    # Anything that is not an int is left for _to_batch to reject on its own
+    return min(max(value, 0), 255) if isinstance(value, int) else value
+
+def _dictionary(values):
+    return pa.array(values, pa.string()).dictionary_encode().cast(pa.dictionary(pa.int8(), pa.string()))
+
+def _to_batch(rows):
+    timestamps, session_ids, user_messages, responses, tiers, topics, states, hints, stages, latencies = zip(*rows)
+    return pa.record_batch([
+        pa.array([int(t * 1e6) for t in timestamps], pa.int64()).cast(TRANSCRIPT_SCHEMA.field("timestamp").type),
+        pa.array(session_ids, pa.string()),
+        pa.array(user_messages, pa.string()),
+        pa.array(responses, pa.string()),
+        _dictionary(tiers),
+        _dictionary(topics),
+        _dictionary(states),
+        pa.array(hints, pa.uint8()),
+        pa.array(stages, pa.uint8()),
+        pa.array(latencies, pa.float32()),
+    ], schema=TRANSCRIPT_SCHEMA)
+
+def segment_paths(directory, include_open=False):
+    """Segment files in the order they were written by each process"""
+    paths = glob.glob(os.path.join(directory, "transcripts-*" + SEGMENT_SUFFIX))
+    if include_open:
+        paths += glob.glob(os.path.join(directory, "transcripts-*" + OPEN_SUFFIX))
+    return sorted(paths)
+
+def read_segment(path):
+    """Record batches of one segment, memory-mapped rather than read into memory
+
+    A segment still being written, or cut short by a crash, yields the
+    batches that were completely written.
+    """
+    source = pa.memory_map(path)
+    reader = pa.ipc.open_stream(source)
+    batches = []
+    while True:
+        try:
+            batches.append(reader.read_next_batch())
+        except StopIteration:
+            break
+        except (pa.ArrowInvalid, OSError):
+            # A partly written batch at the end of an open or crashed segment
+            break
+    return batches
+
+def read_transcripts(directory, include_open=False, columns=None):
+    """All logged turns as one Arrow table (call .to_pandas() for a DataFrame)
+
+    Strings stay in the mapped segment files until a column is converted.
+    Dictionary columns are unified across batches.
+    """
+    batches = [batch for path in segment_paths(directory, include_open) for batch in read_segment(path)]
+    table = pa.Table.from_batches(batches, schema=TRANSCRIPT_SCHEMA).unify_dictionaries()
+    return table.select(columns) if columns else table
+
+def create_transcript_log():
+    """Builds the transcript log configured by the TRANSCRIPTS_* environment variables, or returns None"""
+    if os.getenv("TRANSCRIPTS_ENABLED", "true").lower() != "true":
+        return None
+    return TranscriptLog(
+        os.getenv("TRANSCRIPTS_DIR", "transcripts"),
+        segment_bytes=int(float(os.getenv("TRANSCRIPTS_SEGMENT_MB", "64")) * 2**20),
+        segment_seconds=float(os.getenv("TRANSCRIPTS_SEGMENT_SECONDS", "3600")),
+        fsync_seconds=float(os.getenv("TRANSCRIPTS_FSYNC_SECONDS", "1")),
+        batch_size=int(os.getenv("TRANSCRIPTS_BATCH_SIZE", "1024")),
+        max_queue=int(os.getenv("TRANSCRIPTS_MAX_QUEUE", "100000")),
+        linger_seconds=float(os.getenv("TRANSCRIPTS_LINGER_SECONDS", "0.05"))
+    )
@@ -0,0 +1,177 @@
+import os
+import threading
+
+from NuAnswers import AccountingFinanceTutor
+from metrics import PROMPT_TOKENS, observe
+from retrieval import create_retrieval_index
+from sessions import estimate_tokens
+
+# System prompt templates, one directory per version (prompts/<version>/system.txt
+# plus optional prompts/<version>/examples/<topic>.txt worked examples)
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
+
+def read_template(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read().strip()
+
+class TokenCounter:
+    """Counts prompt tokens with a `tokenizers` tokenizer, or estimates them
+
+    `source` is a tokenizer.json path or a Hugging Face Hub repo id. Without
+    one, or when it cannot be loaded, counts fall back to the chars/4
+    estimate the session store budgets with.
+    """
+
+    def __init__(self, source=None):
+        self.tokenizer = None
+        self.name = "chars/4 estimate"
+        if source:
+            try:
+                from tokenizers import Tokenizer
+                if os.path.isfile(source):
+                    self.tokenizer = Tokenizer.from_file(source)
+                else:
+                    self.tokenizer = Tokenizer.from_pretrained(source)
+                self.name = source
+            except Exception as e:
+                print(f"⚠️ Could not load tokenizer {source} ({e}), estimating prompt tokens instead")
+
+    def count(self, text):
+        if self.tokenizer is None:
+            return estimate_tokens(text)
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+class PromptBuilder:
+    """Assembles chat messages from one version of the prompt templates
+
+    Every system prompt is rendered once, when the builder is created. Each
+    one starts with the same static rules, so all requests share a stable
+    prefix that upstream prefix caching can reuse. Only the worked example
+    for the topic of the student's question follows; "default" is used when
+    no topic is recognised. The topic is taken from the earliest user message
+    that names one, so the system message stays the same for the rest of a
+    conversation.
+
+    With a retrieval index, the most similar worked problems and their hints
+    go in a second system message just before the student's message, after
+    everything that can be reused from the cache.
+    """
+
+    def __init__(self, version="v1", directory=PROMPTS_DIR, counter=None, retriever=None,
+                 retrieval_k=2, retrieval_min_score=0.2):
+        root = os.path.join(directory, version)
+        self.version = version
+        self.prefix = read_template(os.path.join(root, "system.txt"))
+        self.examples = {}
+        examples_dir = os.path.join(root, "examples")
+        if os.path.isdir(examples_dir):
+            for filename in sorted(os.listdir(examples_dir)):
+                if filename.endswith(".txt"):
+                    self.examples[filename[:-4]] = read_template(os.path.join(examples_dir, filename))
+        self.system_prompts = {
+            topic: f"{self.prefix}\n\nExample of a successful interaction:\n{example}"
+            for topic, example in self.examples.items()
+        }
+
+        self.counter = counter or TokenCounter()
+        self.prefix_tokens = self.counter.count(self.prefix)
+        self.system_tokens = {topic: self.counter.count(prompt) for topic, prompt in self.system_prompts.items()}
+
+        self.retriever = retriever
+        self.retrieval_k = retrieval_k
+        self.retrieval_min_score = retrieval_min_score
+
+        self.topic_finder = AccountingFinanceTutor()
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._totals = {"system_prefix": 0, "few_shot": 0, "retrieved": 0, "history": 0, "user": 0, "total": 0}
+
+    def select_topic(self, user_prompt, history=None):
+        """Returns the example topic for a conversation"""
+        for message in (history or []):
+            if message["role"] == "user":
+                topic = self.topic_finder.identify_topic(message["content"])
+                if topic in self.examples:
+                    return topic
+        topic = self.topic_finder.identify_topic(user_prompt)
+        return topic if topic in self.examples else "default"
+
+    def system_prompt(self, topic):
+        return self.system_prompts.get(topic) or self.system_prompts.get("default") or self.prefix
+
+    def related_problems(self, user_prompt, topic):
+        """A system message with the corpus problems most similar to the student's message, or None"""
+        if self.retriever is None:
+            return None
+        results = self.retriever.search(user_prompt, k=self.retrieval_k, min_score=self.retrieval_min_score,
+                                        topic=None if topic == "default" else topic)
+        if not results:
+            return None
+        lines = ["Similar problems from the course material. Use them only to shape your guiding questions:"]
+        for _, item in results:
+            lines.append(f"- Problem: {item['problem']}\n  Hint: {item['hint']}")
+        return {"role": "system", "content": "\n".join(lines)}
+
+    def build(self, user_prompt, history=None):
+        """Assembles the system prompt, prior turns and the new user message"""
+        topic = self.select_topic(user_prompt, history)
+        related = self.related_problems(user_prompt, topic)
+        self.record(self.report(user_prompt, history, topic, related))
+        return ([{"role": "system", "content": self.system_prompt(topic)}] + (history or [])
+                + ([related] if related else []) + [{"role": "user", "content": user_prompt}])
+
+    def report(self, user_prompt, history=None, topic=None, related=None):
+        """Breaks the input tokens of one request down by prompt section"""
+        topic = topic or self.select_topic(user_prompt, history)
+        system_tokens = self.system_tokens.get(topic) or self.system_tokens.get("default") or self.prefix_tokens
+        breakdown = {
+            "topic": topic,
+            "system_prefix": self.prefix_tokens,
+            "few_shot": system_tokens - self.prefix_tokens,
+            "retrieved": self.counter.count(related["content"]) if related else 0,
+            "history": sum(self.counter.count(m["content"]) for m in (history or [])),
+            "user": self.counter.count(user_prompt)
+        }
+        breakdown["total"] = system_tokens + breakdown["retrieved"] + breakdown["history"] + breakdown["user"]
+        return breakdown
+
+    def record(self, breakdown):
+        observe(PROMPT_TOKENS, breakdown["total"])
+        with self._lock:
+            self._requests += 1
+            for section in self._totals:
+                self._totals[section] += breakdown[section]
+
+    def stats(self):
+        with self._lock:
+            requests, totals = self._requests, dict(self._totals)
+        return {
+            "version": self.version,
+            "tokenizer": self.counter.name,
+            "requests": requests,
+            "system_prefix_tokens": self.prefix_tokens,
+            "mean_tokens": {section: round(total / requests, 1) if requests else 0.0
+                            for section, total in totals.items()}
+        }
+
+def create_prompt_builder():
+    """Builds the prompt builder configured by the PROMPT_* and RETRIEVAL_* environment variables"""
+    return PromptBuilder(
+        version=os.getenv("PROMPT_VERSION", "v1"),
+        counter=TokenCounter(os.getenv("PROMPT_TOKENIZER")),
+        retriever=create_retrieval_index()
+    )
+
+# Rendered once at import; PROMPT_VERSION=v0 restores the original single prompt
+prompt_builder = create_prompt_builder()
+
+def build_messages(user_prompt, history=None):
+    """Assembles the system prompt, prior turns and the new user message"""
+    return prompt_builder.build(user_prompt, history)
+
+# Model parameters shared by every completion request
+COMPLETION_PARAMS = {
+    "model": "gpt-4-turbo-preview",
+    "temperature": 0.7,
+    "max_tokens": 1000
+}
@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+import time
+
+from tutor_prompt import build_messages, prompt_builder
+from sessions import create_session_store
+from response_cache import create_response_cache
+from guard import create_output_guard
+from coalesce import create_async_coalescer, create_coalescer
+from ratelimit import create_admission_control
+from deadlines import create_deadline_policy
+from local_tier import FALLBACK, LOCAL, create_local_tier
+from router import LARGE, create_model_router
+from transcripts import create_transcript_log
+from NuAnswers import TOPICS
+import metrics
+from metrics import span
+
+class TutorServices:
+    """Everything the routes share: tutor content, stores and the upstream client
+
+    Both the Flask app (app.py) and the Starlette app (asgi_app.py) are built
+    on this; asynchronous=True gives the asyncio coalescer, admission queue
+    and upstream client, and the apps add only their request handling.
+
+    The prompt templates, tutor rules, retrieval index and stores are loaded
+    when the app is created. Under gunicorn with preload_app that happens once
+    in the master, and the workers share those pages copy-on-write. The
+    OpenAI client holds a connection pool that must not cross a fork, so each
+    worker creates its own: from gunicorn's post_fork hook, or on the first
+    request that needs it.
+    """
+
+    def __init__(self, api_key, asynchronous=False):
+        self.api_key = api_key
+        self.asynchronous = asynchronous
+        self.build_messages = build_messages
+        self.prompt_builder = prompt_builder
+
+        # Picks the small or the large model for each LLM turn; opening turns always get the large one
+        self.router = create_model_router()
+        self.completion_params = self.router.params[LARGE]
+
+        # Conversation history, keyed by the session id the client sends back
+        self.session_store = create_session_store()
+
+        # Repeated first-turn questions (e.g. the same textbook problem) are answered from here
+        self.response_cache = create_response_cache()
+
+        # Cuts off completions that give the answer away (see TutorRules)
+        self.output_guard = create_output_guard()
+
+        # Identical requests in flight at the same time share one upstream call
+        self.coalescer = create_async_coalescer() if asynchronous else create_coalescer()
+
+        # Per-session and per-IP token buckets, and a cap on in-flight upstream calls
+        self.admission = create_admission_control(asynchronous=asynchronous)
+
+        # How long each request may take; the admission queue and the upstream call both keep to it
+        self.deadlines = create_deadline_policy()
+
+        # The rule-based tutor answers what it can, and everything while the upstream is down
+        self.local_tier = create_local_tier(prompt_builder.retriever)
+
+        # Every finished turn, written to disk by a background thread for grading and analytics
+        self.transcripts = create_transcript_log()
+
+        # Cache, coalescing and guard counters are read from the components when /metrics is scraped
+        metrics.observe_components(response_cache=self.response_cache, coalescer=self.coalescer,
+                                   output_guard=self.output_guard, local_tier=self.local_tier)
+
+        self._upstream = None
+        self._upstream_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def upstream(self):
+        """This worker's OpenAI client with pooling, deadlines and retries (see upstream.py)"""
+        if self._upstream_pid != os.getpid():
+            with self._lock:
+                if self._upstream_pid != os.getpid():
+                    self.start_worker()
+        return self._upstream
+
+    def start_worker(self):
+        """Creates this process's upstream client and metrics writer; call after forking"""
+        # The OpenAI SDK is most of the import time, so it is only imported once a client is needed
+        if self.asynchronous:
+            from upstream import AsyncUpstreamClient, UpstreamConfig
+            # One event loop holds many in-flight upstream calls, so the connection pool
+            # has to be sized for that rather than the httpx default of 100
+            self._upstream = AsyncUpstreamClient(self.api_key, UpstreamConfig.from_env(default_max_connections=1000))
+        else:
+            from upstream import UpstreamClient
+            self._upstream = UpstreamClient(self.api_key)
+        self._upstream_pid = os.getpid()
+        metrics.REGISTRY.start_sharing()
+
+    def local_turn(self, session_id, user_message):
+        """Returns (reply, tier) when the local tier takes this turn, else (None, None)
+
+        It takes the turns its rules can answer, and every turn while the
+        upstream is down or slow. The rules take microseconds, so the ASGI
+        app runs them on the event loop.
+        """
+        if not self.local_tier.enabled:
+            return None, None
+        with span("local_tier"):
+            reply = self.local_tier.answer(session_id, user_message)
+            if reply is not None:
+                return reply, LOCAL
+            if not self.local_tier.health.available():
+                return self.local_tier.answer(session_id, user_message, force=True), FALLBACK
+        return None, None
+
+    def local_fallback(self, session_id, user_message):
+        """The local tier's reply for a turn the upstream failed to answer, or None if it is disabled"""
+        if not self.local_tier.enabled:
+            return None
+        with span("local_tier"):
+            return self.local_tier.answer(session_id, user_message, force=True)
+
+    def rule_turn(self, session_id, user_message):
+        """The rule-based tutor's reply, whatever the message; returns (reply, TutorState)"""
+        with span("local_tier"):
+            reply = self.local_tier.answer(session_id, user_message, force=True)
+            return reply, self.local_tier.state(session_id)
+
+    def route_turn(self, session_id, user_message, history):
+        """Completion params of the model the router picks for this turn"""
+        state = self.local_tier.state(session_id)
+        _, params = self.router.route(user_message, history, None if state.topic is None else TOPICS[state.topic])
+        return params
+
+    def record_turn(self, session_id, user_message, response, tier, started):
+        """Keeps a finished turn: in the session history, the tier metrics and the transcript log"""
+        seconds = time.perf_counter() - started
+        self.session_store.append_turn(session_id, user_message, response)
+        self.local_tier.record(tier, seconds)
+        if self.transcripts is not None:
+            state = self.local_tier.state(session_id)
+            self.transcripts.record(session_id, user_message, response, tier,
+                                    topic=None if state.topic is None else TOPICS[state.topic],
+                                    conversation_state=state.state.label, hints_given=state.hints_given,
+                                    stage=state.question_index, latency_ms=seconds * 1000)
+
+    def stats(self):
+        return {
+            "response_cache": self.response_cache.stats(),
+            "output_guard": self.output_guard.stats(),
+            "upstream": self.upstream.stats_dict(),
+            "coalescing": self.coalescer.stats_dict() if self.coalescer else None,
+            "prompt": self.prompt_builder.stats(),
+            "admission": self.admission.stats() if self.admission else None,
+            "local_tier": self.local_tier.stats(),
+            "router": self.router.stats(),
+            "transcripts": self.transcripts.stats() if self.transcripts else None
+        }
+
+def sse_event(payload, event=None):
+    """Formats a JSON payload as a Server-Sent Events message"""
+    message = f"data: {json.dumps(payload)}\n\n"
+    if event:
+        message = f"event: {event}\n" + message
+    return message
+
+# Stop reverse proxies from buffering the stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def local_stream_events(reply, session_id, tier):
+    """The SSE messages of a local tier reply sent as a single delta"""
+    return [sse_event({"delta": reply}),
+            sse_event({"status": "success", "session_id": session_id, "tier": tier}, event="done")]
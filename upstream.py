@@ -0,0 +1,464 @@
+import asyncio
+import heapq
+import itertools
+import os
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, TimeoutError as FuturesTimeout, wait
+
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+from tenacity import AsyncRetrying, Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from deadlines import UpstreamDeadlineExceeded
+from metrics import UPSTREAM_CANCELLED, UPSTREAM_FIRST_TOKEN_SECONDS, UPSTREAM_SECONDS, observe
+
+def is_retryable(error):
+    """Rate limits, 5xx responses, timeouts and dropped connections are worth retrying"""
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+class UpstreamConfig:
+    """Connection pool, deadline, retry and hedging settings for the OpenAI client"""
+
+    def __init__(self, max_connections=100, max_keepalive_connections=20, connect_timeout=5.0,
+                 deadline_seconds=60.0, max_attempts=3, backoff_initial=0.5, backoff_max=8.0,
+                 hedge=False, hedge_percentile=95, hedge_min_samples=20):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.connect_timeout = connect_timeout
+        self.deadline_seconds = deadline_seconds
+        self.max_attempts = max_attempts
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+
+    @classmethod
+    def from_env(cls, default_max_connections=100):
+        max_connections = int(os.getenv("OPENAI_MAX_CONNECTIONS", str(default_max_connections)))
+        return cls(
+            max_connections=max_connections,
+            max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", str(max_connections))),
+            connect_timeout=float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5")),
+            deadline_seconds=float(os.getenv("OPENAI_DEADLINE_SECONDS", "60")),
+            max_attempts=int(os.getenv("OPENAI_MAX_ATTEMPTS", "3")),
+            backoff_initial=float(os.getenv("OPENAI_BACKOFF_INITIAL", "0.5")),
+            backoff_max=float(os.getenv("OPENAI_BACKOFF_MAX", "8")),
+            hedge=os.getenv("OPENAI_HEDGE", "false").lower() == "true",
+            hedge_percentile=float(os.getenv("OPENAI_HEDGE_PERCENTILE", "95")),
+        )
+
+    def limits(self):
+        return httpx.Limits(max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_keepalive_connections)
+
+    def timeout(self):
+        return httpx.Timeout(self.deadline_seconds, connect=self.connect_timeout)
+
+class LatencyTracker:
+    """Sliding window of time-to-first-chunk samples used to decide when to hedge"""
+
+    def __init__(self, window=500):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct, min_samples=1):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+class UpstreamStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.deadline_exceeded = 0
+        self.failures = 0
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self, latency):
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "deadline_exceeded": self.deadline_exceeded,
+            "failures": self.failures,
+            "ttfc_p50_ms": _ms(latency.percentile(50)),
+            "ttfc_p95_ms": _ms(latency.percentile(95)),
+        }
+
+class Watchdog:
+    """One thread that runs callbacks at deadlines, such as cutting off a stalled stream
+
+    A callback runs at most once, and never after cancel() has returned.
+    """
+
+    def __init__(self):
+        self._heap = []  # [at, sequence, callback]; cancelled entries have callback None
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def schedule(self, at, callback):
+        """Runs callback at the time.monotonic() value at; returns the entry to cancel it with"""
+        entry = [at, next(self._sequence), callback]
+        with self._condition:
+            heapq.heappush(self._heap, entry)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return entry
+
+    def cancel(self, entry):
+        with self._condition:
+            entry[2] = None
+
+    def _run(self):
+        with self._condition:
+            while True:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                wait = self._heap[0][0] - time.monotonic()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                _, _, callback = heapq.heappop(self._heap)
+                if callback is not None:
+                    try:
+                        callback()
+                    except Exception as e:
+                        print(f"❌ Error in upstream watchdog: {str(e)}")
+
+def _cut_off(stream):
+    """Shuts down a stream's socket: unlike close(), that also ends a read blocked on it"""
+    network_stream = stream.response.extensions.get("network_stream")
+    sock = network_stream.get_extra_info("socket") if network_stream is not None else None
+    if sock is None:
+        stream.close()
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass  # already closed
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+def _content(chunk):
+    if chunk.choices and chunk.choices[0].delta.content:
+        return chunk.choices[0].delta.content
+    return None
+
+class UpstreamClient:
+    """Streams chat completions with deadlines, jittered retries and optional hedging
+
+    Retries and hedges only cover opening the stream and reading its first
+    chunk; once text has been handed to the caller a failure is final.
+    """
+
+    def __init__(self, api_key, config=None):
+        self.config = config or UpstreamConfig.from_env()
+        # Retries are done here, with jitter and within the deadline, not by the SDK
+        self.client = OpenAI(
+            api_key=api_key,
+            max_retries=0,
+            http_client=httpx.Client(limits=self.config.limits(), timeout=self.config.timeout())
+        )
+        self.latency = LatencyTracker()
+        self.stats = UpstreamStats()
+        self.watchdog = Watchdog()
+        self._hedge_pool = None
+
+    def _retrying(self):
+        def before_sleep(retry_state):
+            self.stats.incr("retries")
+        return Retrying(
+            retry=retry_if_exception(is_retryable),
+            stop=stop_after_attempt(self.config.max_attempts),
+            wait=wait_random_exponential(multiplier=self.config.backoff_initial, max=self.config.backoff_max),
+            before_sleep=before_sleep,
+            reraise=True
+        )
+
+    def _remaining(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise self._deadline_exceeded()
+        return remaining
+
+    def _deadline_exceeded(self):
+        self.stats.incr("deadline_exceeded")
+        UPSTREAM_CANCELLED.labels("deadline").inc()
+        return UpstreamDeadlineExceeded("OpenAI request exceeded its deadline")
+
+    def _open(self, messages, params, deadline):
+        """Opens a stream and reads its first chunk, retrying retryable failures"""
+        for attempt in self._retrying():
+            with attempt:
+                started = time.monotonic()
+                stream = self.client.chat.completions.create(
+                    messages=messages,
+                    stream=True,
+                    timeout=httpx.Timeout(self._remaining(deadline), connect=self.config.connect_timeout),
+                    **params
+                )
+                try:
+                    first = next(stream, None)
+                except BaseException:
+                    stream.close()
+                    raise
+                self.latency.record(time.monotonic() - started)
+                return stream, first
+
+    def _open_hedged(self, messages, params, deadline):
+        """Sends a duplicate request if the first chunk is slower than the latency percentile"""
+        delay = self.latency.percentile(self.config.hedge_percentile, self.config.hedge_min_samples)
+        if delay is None:
+            return self._open(messages, params, deadline)
+        if self._hedge_pool is None:
+            self._hedge_pool = ThreadPoolExecutor(max_workers=self.config.max_connections)
+
+        primary = self._hedge_pool.submit(self._open, messages, params, deadline)
+        try:
+            return primary.result(timeout=delay)
+        except FuturesTimeout:
+            pass
+
+        self.stats.incr("hedges")
+        hedge = self._hedge_pool.submit(self._open, messages, params, deadline)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                # Whichever request loses is closed as soon as it opens
+                for loser in {primary, hedge} - {future}:
+                    loser.add_done_callback(_close_stream)
+                if future is hedge:
+                    self.stats.incr("hedge_wins")
+                return future.result()
+        raise error
+
+    def stream_chat(self, messages, deadline=None, **params):
+        """Yields completion text deltas; raises UpstreamDeadlineExceeded past the deadline
+
+        deadline is the request's own deadline as a time.monotonic() value;
+        the earlier of it and config.deadline_seconds applies. A read still
+        blocked at the deadline is cut off by the watchdog, which closes the
+        connection so OpenAI stops generating. A timeout that runs into the
+        deadline while opening is reported as UpstreamDeadlineExceeded too.
+        """
+        self.stats.incr("requests")
+        started = time.monotonic()
+        own_deadline = started + self.config.deadline_seconds
+        requested = deadline is not None and deadline < own_deadline
+        deadline = deadline if requested else own_deadline
+        try:
+            try:
+                if self.config.hedge:
+                    stream, first = self._open_hedged(messages, params, deadline)
+                else:
+                    stream, first = self._open(messages, params, deadline)
+            except Exception as e:
+                self.stats.incr("failures")
+                if time.monotonic() >= deadline and not isinstance(e, UpstreamDeadlineExceeded):
+                    raise self._deadline_exceeded() from e
+                raise
+            observe(UPSTREAM_FIRST_TOKEN_SECONDS, time.monotonic() - started)
+            expired = threading.Event()
+
+            def expire():
+                expired.set()
+                _cut_off(stream)
+            watch = self.watchdog.schedule(deadline, expire)
+            try:
+                for chunk in itertools.chain([first] if first is not None else [], stream):
+                    if time.monotonic() > deadline:
+                        raise self._deadline_exceeded()
+                    content = _content(chunk)
+                    if content:
+                        yield content
+            except Exception as e:
+                if expired.is_set() and not isinstance(e, UpstreamDeadlineExceeded):
+                    raise self._deadline_exceeded() from e
+                raise
+            finally:
+                self.watchdog.cancel(watch)
+                # Also releases the connection if the caller stops early
+                stream.close()
+                observe(UPSTREAM_SECONDS, time.monotonic() - started)
+        except UpstreamDeadlineExceeded as e:
+            e.requested = requested
+            raise
+
+    def complete(self, messages, deadline=None, **params):
+        """Returns the whole completion text"""
+        return "".join(self.stream_chat(messages, deadline, **params))
+
+    def stats_dict(self):
+        return self.stats.as_dict(self.latency)
+
+def _close_stream(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result()[0].close()
+
+class AsyncUpstreamClient:
+    """asyncio counterpart of UpstreamClient for the ASGI app"""
+
+    def __init__(self, api_key, config=None):
+        self.config = config or UpstreamConfig.from_env()
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            max_retries=0,
+            http_client=httpx.AsyncClient(limits=self.config.limits(), timeout=self.config.timeout())
+        )
+        self.latency = LatencyTracker()
+        self.stats = UpstreamStats()
+
+    def _remaining(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise self._deadline_exceeded()
+        return remaining
+
+    def _deadline_exceeded(self):
+        self.stats.incr("deadline_exceeded")
+        UPSTREAM_CANCELLED.labels("deadline").inc()
+        return UpstreamDeadlineExceeded("OpenAI request exceeded its deadline")
+
+    async def _open(self, messages, params, deadline):
+        """Opens a stream and reads its first chunk, retrying retryable failures"""
+        def before_sleep(retry_state):
+            self.stats.incr("retries")
+        retrying = AsyncRetrying(
+            retry=retry_if_exception(is_retryable),
+            stop=stop_after_attempt(self.config.max_attempts),
+            wait=wait_random_exponential(multiplier=self.config.backoff_initial, max=self.config.backoff_max),
+            before_sleep=before_sleep,
+            reraise=True
+        )
+        async for attempt in retrying:
+            with attempt:
+                started = time.monotonic()
+                remaining = self._remaining(deadline)
+                stream = await asyncio.wait_for(self.client.chat.completions.create(
+                    messages=messages,
+                    stream=True,
+                    timeout=httpx.Timeout(remaining, connect=self.config.connect_timeout),
+                    **params
+                ), remaining)
+                try:
+                    first = await asyncio.wait_for(anext(aiter(stream), None), self._remaining(deadline))
+                except BaseException:
+                    await stream.close()
+                    raise
+                self.latency.record(time.monotonic() - started)
+                return stream, first
+
+    async def _open_hedged(self, messages, params, deadline):
+        """Sends a duplicate request if the first chunk is slower than the latency percentile"""
+        delay = self.latency.percentile(self.config.hedge_percentile, self.config.hedge_min_samples)
+        if delay is None:
+            return await self._open(messages, params, deadline)
+
+        primary = asyncio.ensure_future(self._open(messages, params, deadline))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        self.stats.incr("hedges")
+        hedge = asyncio.ensure_future(self._open(messages, params, deadline))
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                for loser in {primary, hedge} - {task}:
+                    if not loser.done():
+                        loser.cancel()
+                    elif loser.exception() is None:
+                        await loser.result()[0].close()
+                if task is hedge:
+                    self.stats.incr("hedge_wins")
+                return task.result()
+        raise error
+
+    async def stream_chat(self, messages, deadline=None, **params):
+        """Yields completion text deltas; raises UpstreamDeadlineExceeded past the deadline
+
+        deadline is the request's own deadline as a time.monotonic() value;
+        the earlier of it and config.deadline_seconds applies.
+        """
+        self.stats.incr("requests")
+        started = time.monotonic()
+        own_deadline = started + self.config.deadline_seconds
+        requested = deadline is not None and deadline < own_deadline
+        deadline = deadline if requested else own_deadline
+        try:
+            try:
+                if self.config.hedge:
+                    stream, first = await self._open_hedged(messages, params, deadline)
+                else:
+                    stream, first = await self._open(messages, params, deadline)
+            except asyncio.TimeoutError:
+                self.stats.incr("failures")
+                raise self._deadline_exceeded()
+            except Exception as e:
+                self.stats.incr("failures")
+                if time.monotonic() >= deadline and not isinstance(e, UpstreamDeadlineExceeded):
+                    raise self._deadline_exceeded() from e
+                raise
+            observe(UPSTREAM_FIRST_TOKEN_SECONDS, time.monotonic() - started)
+            try:
+                if first is not None and _content(first):
+                    yield _content(first)
+                chunks = aiter(stream)
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(anext(chunks), self._remaining(deadline))
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        raise self._deadline_exceeded()
+                    content = _content(chunk)
+                    if content:
+                        yield content
+            finally:
+                await stream.close()
+                observe(UPSTREAM_SECONDS, time.monotonic() - started)
+        except UpstreamDeadlineExceeded as e:
+            e.requested = requested
+            raise
+
+    async def complete(self, messages, deadline=None, **params):
+        """Returns the whole completion text"""
+        return "".join([delta async for delta in self.stream_chat(messages, deadline, **params)])
+
+    def stats_dict(self):
+        return self.stats.as_dict(self.latency)